@@ -1,524 +1,156 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from PIL import Image
 import os
 from dotenv import load_dotenv
-from io import BytesIO
-import base64
-from typing import List, Dict
-import re
+from typing import AsyncIterator, List, Optional, Union
+import sys
 import datetime
-import random
 import webbrowser
 import gradio as gr
-import tempfile
-import time
+
+# Make the shared hair_analysis package importable when run as V2/appv2.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hair_analysis import metrics
+from hair_analysis.admission import AdmissionGate, GateFull
+from hair_analysis.catalog import detect_hair_type
+from hair_analysis.engine import HairAnalysisEngine
+from hair_analysis.memory import DEFAULT_SESSION
+from hair_analysis.structured import HairAnalysis, analysis_context
 
 # Load environment variables
 load_dotenv()
 
-# Initialize model with memory
-model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=os.getenv("GEMINI_API_KEY"))
-memory = ConversationBufferMemory(memory_key="history", return_messages=True)
-conversation = ConversationChain(llm=model, memory=memory, verbose=True)
+# Prompts, model calls, caches and report rendering live in the shared engine.
+# Preview and Generate share its report cache, so the saved file is the report that was previewed.
+engine = HairAnalysisEngine(verbose=True)
+
+# Admission control: how many of each request run at once and how many may wait in line.
+# Analyses beyond the waiting room are turned away with a busy message rather than queued
+# until they time out, so the analysis event has no Gradio concurrency limit of its own;
+# Gradio's queue (HAIR_QUEUE_SIZE) bounds the other events.
+QUEUE_SIZE = int(os.getenv("HAIR_QUEUE_SIZE", "64"))
+MAX_ANALYSES = int(os.getenv("HAIR_MAX_ANALYSES", "4"))
+ANALYSIS_WAITING = int(os.getenv("HAIR_ANALYSIS_WAITING", "12"))
+MAX_REPORTS = int(os.getenv("HAIR_MAX_REPORTS", "4"))
+MAX_PRODUCT_LOOKUPS = int(os.getenv("HAIR_MAX_PRODUCT_LOOKUPS", "8"))
+MAX_NARRATIVES = int(os.getenv("HAIR_MAX_NARRATIVES", "2"))
+analysis_gate = AdmissionGate("analysis", MAX_ANALYSES, ANALYSIS_WAITING)
+# Specialist notes are optional, so they are skipped rather than queued when busy
+narrative_gate = AdmissionGate("specialist notes", MAX_NARRATIVES)
 
 class ProfessionalHairAnalysisSystem:
-    def __init__(self):
+    """One browser session's results, kept in its gr.State; the work is done by the shared engine."""
+    def __init__(self, session_id: str = DEFAULT_SESSION):
         self.analysis_results = ""
         self.advice_results = ""
+        # Parsed analysis when structured (JSON) analysis is on and the reply validated
+        self.structured_results: Optional[HairAnalysis] = None
         self.image_paths = []
+        # The engine's conversation memory for this session is kept under the same id
+        self.session_id = session_id
 
-    def get_product_recommendations(self, hair_type: str, concerns: List[str], budget: str = "medium") -> str:
-    # This would normally query a database
-        product_db = {
-            "shampoo": {
-                "dry": {
-                    "low": "SheaMoisture Coconut & Hibiscus Curl & Shine Shampoo",
-                    "medium": "Briogeo Don't Despair, Repair! Super Moisture Shampoo",
-                    "high": "Oribe Gold Lust Repair & Restore Shampoo"
-                },
-                "damaged": {
-                    "low": "Pantene Pro-V Repair and Protect Shampoo",
-                    "medium": "Olaplex No. 4 Bond Maintenance Shampoo",
-                    "high": "Kerastase Resistance Bain Extentioniste Shampoo"
-                }
-            },
-            "conditioner": {
-                # Similar structure
-            }
-        }
-        
-        recommendations = []
-        for product_type in ['shampoo', 'conditioner', 'treatment']:
-            for concern in concerns:
-                if concern in product_db[product_type]:
-                    rec = product_db[product_type][concern][budget]
-                    recommendations.append(f"- {product_type.capitalize()}: {rec} (for {concern})")
-        
-        if not recommendations:
-            return "No specific product recommendations available based on current analysis."
-        
-        return "Recommended Products:\n" + "\n".join(recommendations)
-
-    def prepare_image(self, image_path: str) -> Dict:
-        try:
-            img = Image.open(image_path)
-            img = img.convert('RGB')
-            
-            width, height = img.size
-            if width > 1024 or height > 1024:
-                ratio = min(1024/width, 1024/height)
-                new_size = (int(width*ratio), (int(height*ratio)))
-                img = img.resize(new_size, Image.LANCZOS)
-            
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG", quality=90)
-            return {
-                "mime_type": "image/jpeg",
-                "data": base64.b64encode(buffered.getvalue()).decode('utf-8'),
-                "filename": os.path.basename(image_path)
-            }
-        except Exception as e:
-            raise ValueError(f"Error processing image {image_path}: {str(e)}")
+    def get_product_recommendations(self, hair_type: Optional[str], concerns: List[str], budget: str = "medium") -> str:
+        return engine.recommend_products(hair_type, concerns, budget)
     
-    def analyze_single_hair_image(self, image_path: str) -> str:
-        try:
-            if not os.path.exists(image_path):
-                return "Error: Image file not found."
-            
-            image_data = self.prepare_image(image_path)
-            
-            prompt = """As a professional hair specialist, analyze this hair image in detail:
-            
-            1. Hair Characteristics:
-               - Texture (straight, wavy, curly, coily)
-               - Density (thin, medium, thick)
-               - Diameter (fine, medium, coarse)
-               - Porosity level
-            
-            2. Scalp Condition:
-               - Visible scalp health
-               - Signs of irritation or abnormalities
-            
-            3. Hair Health:
-               - Ends condition (split ends, damage)
-               - Breakage patterns
-               - Signs of chemical damage
-               - Moisture/protein balance indicators
-            
-            4. Additional Observations:
-               - Any visible scalp conditions
-               - Hairline characteristics
-               - Growth patterns
-            
-            Provide:
-            - Detailed findings with confidence levels
-            - Clear explanations of technical terms
-            - Specific areas needing closer examination
-            """
-            
-            message = [
-                {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {
-                    "url": f"data:{image_data['mime_type']};base64,{image_data['data']}",
-                    "detail": "high"
-                }}
-            ]
-            
-            response = conversation.invoke({"input": message})
-            return response["response"]
-        
-        except Exception as e:
-            return f"Error processing image: {str(e)}"
+    def hair_type_for(self, hair_analysis: str) -> Optional[str]:
+        if self.structured_results is not None and hair_analysis == self.analysis_results:
+            return self.structured_results.texture
+        return detect_hair_type(hair_analysis)
+    
+    def product_narrative_prompt(self, products: str, hair_analysis: str) -> str:
+        return engine.product_narrative_prompt(products, self.follow_up_context(hair_analysis))
     
-    def analyze_multiple_hair_images(self, image_paths: List[str]) -> str:
+    async def aget_product_narrative(self, products: str, hair_analysis: str,
+                                     session_id: Optional[str] = None) -> str:
+        return await self.aget_hair_advice(self.product_narrative_prompt(products, hair_analysis), session_id)
+    
+    async def astream_analysis(self, image_paths: List[str], session_id: Optional[str] = None) -> AsyncIterator[str]:
+        error = engine.check_image_paths(image_paths)
+        if error:
+            yield error
+            return
         try:
-            if not image_paths:
-                return "Error: No images provided."
-            
-            if len(image_paths) > 4:
-                return "Error: Maximum 4 images allowed for analysis."
-            
-            image_data_list = []
-            for path in image_paths:
-                if not os.path.exists(path):
-                    return f"Error: Image not found - {path}"
-                image_data_list.append(self.prepare_image(path))
-            
-            prompt = f"""As a senior hair specialist, analyze these {len(image_data_list)} images of the same patient's hair:
-            
-            Perform COMPREHENSIVE ANALYSIS by:
-            
-            1. Individual Image Analysis:
-               - Analyze each image separately first
-               - Note unique observations from each angle
-            
-            2. Comparative Analysis:
-               - Identify consistent characteristics across images
-               - Resolve any discrepancies between images
-               - Determine most accurate overall assessment
-            
-            3. Detailed Assessment of:
-               - Hair type and texture from all angles
-               - Scalp health from visible areas
-               - Hair density and distribution
-               - Damage patterns and severity
-               - Growth patterns and hairline
-            
-            4. Final Evaluation:
-               - Most likely hair characteristics
-               - Confidence levels for each finding
-               - Recommended additional views if needed
-            
-            Image Details: {[img['filename'] for img in image_data_list]}
-            """
-            
-            messages = [{"type": "text", "text": prompt}]
-            for img_data in image_data_list:
-                messages.append({
-                    "type": "image_url", 
-                    "image_url": {
-                        "url": f"data:{img_data['mime_type']};base64,{img_data['data']}",
-                        "detail": "high"
-                    }
-                })
-            
-            response = conversation.invoke({"input": messages})
-            return response["response"]
-        
+            async for chunk in engine.astream_analysis(image_paths, session_id or self.session_id):
+                yield chunk
         except Exception as e:
-            return f"Error processing images: {str(e)}"
+            yield f"Error processing images: {str(e)}"
     
-    def get_hair_advice(self, follow_up: str) -> str:
-        response = conversation.invoke({"input": follow_up})
-        return response["response"]
-    # Add to your ProfessionalHairAnalysisSystem class
-    # def get_detailed_product_recommendations(self, hair_analysis: str) -> str:
-    #     """
-    #     Extract key characteristics from analysis and generate detailed product recommendations
-    #     """
-    #     prompt = f"""From this hair analysis:
-    #     {hair_analysis}
-        
-    #     Identify the following characteristics:
-    #     1. Hair type (straight, wavy, curly, coily)
-    #     2. Primary concerns (e.g., dryness, breakage, scalp issues)
-    #     3. Current condition (damaged, color-treated, etc.)
-        
-    #     Then provide specific product recommendations including:
-    #     - 3 shampoo options at different price points
-    #     - 3 conditioner options
-    #     - 2 treatment products
-    #     - 1 styling product
-    #     For each product include:
-    #     - Brand and product name
-    #     - Key beneficial ingredients
-    #     - Where to purchase (e.g., Ulta, Sephora, drugstore)
-    #     - Price range
-        
-    #     Format as a clear table with columns: Product Type, Brand/Name, Key Ingredients, Where to Buy, Price.
-    #     """
-        
-    #     return self.get_hair_advice(prompt)
-    def get_detailed_product_recommendations(self, hair_analysis: str, budget: str = "medium", concerns: List[str] = None) -> str:
-        """
-        Extract key characteristics from analysis and generate detailed product recommendations
-        with budget and specific concerns taken into account.
-        """
-        if concerns is None:
-            concerns = []
-            
-        prompt = f"""From this hair analysis:
-        {hair_analysis}
-        
-        Identify the following characteristics:
-        1. Hair type (straight, wavy, curly, coily)
-        2. Primary concerns: {', '.join(concerns) if concerns else 'Not specified'}
-        3. Current condition (damaged, color-treated, etc.)
-        
-        Then provide specific product recommendations for a {budget} budget including:
-        - 3 shampoo options at different price points
-        - 3 conditioner options
-        - 2 treatment products
-        - 1 styling product
-        For each product include:
-        - Brand and product name
-        - Key beneficial ingredients
-        - Where to purchase (e.g., Ulta, Sephora, drugstore)
-        - Price range
-        
-        Format as a clear table with columns: Product Type, Brand/Name, Key Ingredients, Where to Buy, Price.
-        """
-        
-        return self.get_hair_advice(prompt)
-
-
-    def get_comprehensive_advice(self, analysis: str) -> str:
-        prompt = f"""Based on this comprehensive hair analysis:
-        {analysis}
-        
-        Provide DETAILED TREATMENT PLAN including:
-        
-        1. Immediate Care Recommendations:
-            - Daily routine with specific product types
-            - Key ingredients to look for
-            - Application techniques
-        
-        2. Professional Treatments:
-            - Recommended salon treatments
-            - Frequency
-            - Expected outcomes
-        
-        3. Product Recommendations:
-            - For each recommended product type, suggest:
-                - 1 budget option
-                - 1 premium option
-                - Key benefits of each
-                - Where to purchase
-        
-        4. Lifestyle Adjustments:
-            - Dietary suggestions
-            - Protective styling advice
-            - Environmental protection
-        
-        Format the recommendations clearly with headings for each category.
-        """
-        
-        return self.get_hair_advice(prompt)
+    def finish_analysis(self, analysis: str) -> str:
+        """Record a completed analysis and return the text to show for it."""
+        self.analysis_results, self.structured_results = engine.finish_analysis(analysis)
+        return self.analysis_results
     
-    # def get_comprehensive_advice(self, analysis: str) -> str:
-    #     prompt = f"""Based on this comprehensive hair analysis:
-    #     {analysis}
-        
-    #     Provide DETAILED TREATMENT PLAN covering:
-        
-    #     1. Immediate Care Recommendations:
-    #        - Daily routine (cleansing, conditioning)
-    #        - Recommended products
-    #        - Handling instructions
-        
-    #     2. Professional Treatments:
-    #        - Recommended salon treatments
-    #        - Frequency
-    #        - Expected outcomes
-        
-    #     3. Long-term Maintenance:
-    #        - Ongoing care regimen
-    #        - Lifestyle adjustments
-    #        - Nutritional recommendations
-        
-    #     4. Follow-up Plan:
-    #        - Recommended timeline for reassessment
-    #        - Signs to watch for
-    #        - When to seek professional help
-        
-    #     5. Product Recommendations:
-    #        - Specific product types
-    #        - Key ingredients to look for
-    #        - Ingredients to avoid
-        
-    #     Organize by priority and provide rationale for each recommendation.
-    #     """
-        
-    #     return self.get_hair_advice(prompt)
+    def follow_up_context(self, analysis: Union[str, HairAnalysis]) -> str:
+        # The shown analysis is the rendered structured result; quote its compact fields instead
+        if self.structured_results is not None and analysis == self.analysis_results:
+            return self.structured_results.compact()
+        return analysis_context(analysis)
     
-    def convert_to_html(self, text: str) -> str:
-        lines = text.splitlines()
-        html_lines = []
-        in_list = False
-        in_table = False
-
-        for line in lines:
-            stripped = line.strip()
-
-            # Handle lists
-            if stripped.startswith(("* ", "- ")):
-                if not in_list:
-                    html_lines.append("<ul>")
-                    in_list = True
-                item = stripped[2:]
-                item = re.sub(r"\*\*(.*?)\*\*", r"<strong>\1</strong>", item)
-                html_lines.append(f"<li>{item}</li>")
-            else:
-                if in_list:
-                    html_lines.append("</ul>")
-                    in_list = False
-                
-                # Convert bold text
-                line = re.sub(r"\*\*(.*?)\*\*", r"<strong>\1</strong>", line)
-                
-                # Handle paragraphs
-                if line.strip():
-                    html_lines.append(f"<p>{line}</p>")
-
-        if in_list:
-            html_lines.append("</ul>")
-
-        return "\n".join(html_lines)
+    def get_hair_advice(self, follow_up: str, session_id: Optional[str] = None, stage: str = "ask") -> str:
+        return engine.ask(follow_up, session_id or self.session_id, stage)
+    
+    async def aget_hair_advice(self, follow_up: str, session_id: Optional[str] = None, stage: str = "ask") -> str:
+        return await engine.aask(follow_up, session_id or self.session_id, stage)
+    
+    def product_recommendations_prompt(self, hair_analysis: Union[str, HairAnalysis], budget: str = "medium", concerns: List[str] = None) -> str:
+        return engine.product_recommendations_prompt(self.follow_up_context(hair_analysis), budget, concerns)
+    
+    def get_detailed_product_recommendations(self, hair_analysis: str, budget: str = "medium", concerns: List[str] = None,
+                                             session_id: Optional[str] = None) -> str:
+        prompt = self.product_recommendations_prompt(hair_analysis, budget, concerns)
+        return self.get_hair_advice(prompt, session_id)
+    
+    async def aget_detailed_product_recommendations(self, hair_analysis: str, budget: str = "medium",
+                                                    concerns: List[str] = None, session_id: Optional[str] = None) -> str:
+        prompt = self.product_recommendations_prompt(hair_analysis, budget, concerns)
+        return await self.aget_hair_advice(prompt, session_id)
+    
+    def comprehensive_advice_prompt(self, analysis: Union[str, HairAnalysis]) -> str:
+        return engine.advice_prompt(self.follow_up_context(analysis))
+    
+    def get_comprehensive_advice(self, analysis: Union[str, HairAnalysis], session_id: Optional[str] = None) -> str:
+        return self.get_hair_advice(self.comprehensive_advice_prompt(analysis), session_id, stage="advice")
+    
+    async def aget_comprehensive_advice(self, analysis: Union[str, HairAnalysis], session_id: Optional[str] = None) -> str:
+        return await self.aget_hair_advice(self.comprehensive_advice_prompt(analysis), session_id, stage="advice")
+    
+    def astream_comprehensive_advice(self, analysis: Union[str, HairAnalysis], session_id: Optional[str] = None) -> AsyncIterator[str]:
+        return engine.astream_ask(self.comprehensive_advice_prompt(analysis), session_id or self.session_id,
+                                  stage="advice")
     
     def generate_html_report(self, patient_name: str = "", patient_id: str = "", dob: str = "",
                            gender: str = "", hospital_name: str = "", doctor_name: str = "",
-                           analysis_date: str = "", report_id: str = None) -> str:
+                           analysis_date: str = "", report_id: str = None,
+                           stylesheet_mode: str = "inline") -> str:
         if not self.analysis_results:
             return ""
         
-        analysis_html = self.convert_to_html(self.analysis_results)
-        advice_html = self.convert_to_html(self.advice_results)
-        
-        report_generated_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        age = ""
-        if dob:
-            try:
-                birth_date = datetime.datetime.strptime(dob, "%Y-%m-%d")
-                today = datetime.datetime.today()
-                age = str(today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day)))
-            except:
-                age = "N/A"
-        
-        if not report_id:
-            report_id = f"HA{random.randint(1000,9999)}-{datetime.datetime.now().strftime('%Y%m%d')}"
-        
-        html_content = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Hair Analysis Report - {patient_name or 'Patient'}</title>
-            <style>
-                body {{
-                    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    margin: 0;
-                    padding: 0;
-                    background-color: #f9f9f9;
-                }}
-                .page {{
-                    width: 21cm;
-                    min-height: 29.7cm;
-                    margin: 1cm auto;
-                    padding: 2cm;
-                    background: white;
-                    box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
-                }}
-                header {{
-                    border-bottom: 2px solid #0066cc;
-                    padding-bottom: 20px;
-                    margin-bottom: 30px;
-                }}
-                .header-content {{
-                    display: flex;
-                    justify-content: space-between;
-                    align-items: flex-end;
-                }}
-                .logo {{
-                    max-width: 200px;
-                }}
-                .patient-info {{
-                    margin: 20px 0;
-                    background: #f0f8ff;
-                    padding: 15px;
-                    border-radius: 5px;
-                }}
-                .info-grid {{
-                    display: grid;
-                    grid-template-columns: repeat(2, 1fr);
-                    gap: 10px;
-                }}
-                .info-item strong {{
-                    display: inline-block;
-                    width: 120px;
-                }}
-                h1, h2, h3 {{
-                    color: #0066cc;
-                }}
-                h1 {{
-                    margin-top: 0;
-                }}
-                h2 {{
-                    border-bottom: 1px solid #ddd;
-                    padding-bottom: 5px;
-                    margin-top: 30px;
-                }}
-                ul {{
-                    padding-left: 20px;
-                }}
-                .footer {{
-                    margin-top: 50px;
-                    text-align: center;
-                    font-size: 0.8em;
-                    color: #666;
-                }}
-                .signature {{
-                    margin-top: 50px;
-                    display: flex;
-                    justify-content: space-between;
-                }}
-                .signature-line {{
-                    width: 200px;
-                    border-top: 1px solid #333;
-                    text-align: center;
-                    padding-top: 5px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="page">
-                <header>
-                    <div class="header-content">
-                        <div>
-                            <h1>Hair Analysis Report</h1>
-                            <p><strong>Hospital/Clinic:</strong> {hospital_name}</p>
-                        </div>
-                        <div>
-                            <p><strong>Report ID:</strong> {report_id}</p>
-                            <p><strong>Date:</strong> {analysis_date}</p>
-                        </div>
-                    </div>
-                </header>
-                
-                <div class="patient-info">
-                    <h3>Patient Information</h3>
-                    <div class="info-grid">
-                        <div class="info-item"><strong>Name:</strong> {patient_name}</div>
-                        <div class="info-item"><strong>Patient ID:</strong> {patient_id}</div>
-                        <div class="info-item"><strong>Date of Birth:</strong> {dob} (Age: {age})</div>
-                        <div class="info-item"><strong>Gender:</strong> {gender}</div>
-                        <div class="info-item"><strong>Doctor:</strong> {doctor_name}</div>
-                        <div class="info-item"><strong>Analysis Date:</strong> {analysis_date}</div>
-                    </div>
-                </div>
-                
-                <section>
-                    <h2>Hair Analysis Findings</h2>
-                    {analysis_html}
-                </section>
-                
-                <section>
-                    <h2>Treatment Recommendations</h2>
-                    {advice_html}
-                </section>
-                
-                <div class="signature">
-                    <div class="signature-line">
-                        <p>Doctor/Specialist Signature</p>
-                    </div>
-                    <div class="signature-line">
-                        <p>Date: {datetime.datetime.now().strftime('%Y-%m-%d')}</p>
-                    </div>
-                </div>
-                
-                <div class="footer">
-                    <p>Report generated on {report_generated_time} by Professional Hair Analysis System</p>
-                    <p>This report is confidential and intended for the patient and their healthcare provider only.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        return html_content
+        return engine.report_html(
+            self.analysis_results,
+            self.advice_results,
+            report_id=report_id,
+            stylesheet_mode=stylesheet_mode,
+            patient_name=patient_name,
+            patient_id=patient_id,
+            dob=dob,
+            gender=gender,
+            hospital_name=hospital_name,
+            doctor_name=doctor_name,
+            analysis_date=analysis_date
+        )
+    
+    def rendered_report(self, patient_name: str = "", patient_id: str = "", dob: str = "",
+                        gender: str = "", hospital_name: str = "", doctor_name: str = "",
+                        analysis_date: str = ""):
+        return engine.rendered_report(
+            self.analysis_results,
+            self.advice_results,
+            patient_name=patient_name,
+            patient_id=patient_id,
+            dob=dob,
+            gender=gender,
+            hospital_name=hospital_name,
+            doctor_name=doctor_name,
+            analysis_date=analysis_date
+        )
     
     def preview_report(self, patient_name: str, patient_id: str, dob: str, gender: str,
                       hospital_name: str, doctor_name: str, analysis_date: str) -> (str, str):
@@ -526,16 +158,9 @@ class ProfessionalHairAnalysisSystem:
             return "", "No analysis results to preview"
         
         try:
-            html_content = self.generate_html_report(
-                patient_name=patient_name,
-                patient_id=patient_id,
-                dob=dob,
-                gender=gender,
-                hospital_name=hospital_name,
-                doctor_name=doctor_name,
-                analysis_date=analysis_date
-            )
-            return html_content, "Preview generated successfully"
+            report = self.rendered_report(patient_name, patient_id, dob, gender,
+                                          hospital_name, doctor_name, analysis_date)
+            return report.html, "Preview generated successfully"
         except Exception as e:
             return "", f"Error generating preview: {str(e)}"
     
@@ -574,22 +199,12 @@ class ProfessionalHairAnalysisSystem:
             reports_dir = os.path.join(os.getcwd(), "hair_reports")
             os.makedirs(reports_dir, exist_ok=True)
             
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            report_filename = f"hair_report_{timestamp}.html"
-            report_path = os.path.join(reports_dir, report_filename)
-            
-            html_content = self.generate_html_report(
-                patient_name=patient_name,
-                patient_id=patient_id,
-                dob=dob,
-                gender=gender,
-                hospital_name=hospital_name,
-                doctor_name=doctor_name,
-                analysis_date=analysis_date
-            )
-            
-            with open(report_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+            report = self.rendered_report(patient_name, patient_id, dob, gender,
+                                          hospital_name, doctor_name, analysis_date)
+            # Named by content, so different patients never share a file; the same report again
+            # reuses the file when it already holds these bytes (it may be from before a restart)
+            report_path = os.path.join(reports_dir, f"hair_report_{report.key}.html")
+            report.save(report_path)
             
             # Open the report in default browser
             webbrowser.open(f"file://{report_path}")
@@ -598,33 +213,77 @@ class ProfessionalHairAnalysisSystem:
         except Exception as e:
             return None, f"Error generating report: {str(e)}"
 
-# Create an instance of the system
-hair_analysis_system = ProfessionalHairAnalysisSystem()
+def session_for(request: gr.Request) -> str:
+    # Each browser session keeps its own conversation memory
+    return request.session_hash if request is not None and request.session_hash else DEFAULT_SESSION
 
-def analyze_images(patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date, *image_files):
-    # Filter out None values from image files
-    image_paths = [file.name for file in image_files if file is not None]
+def session_system(system: Optional[ProfessionalHairAnalysisSystem],
+                   request: gr.Request = None) -> ProfessionalHairAnalysisSystem:
+    # Results live in each session's gr.State, so concurrent users never see each other's patient
+    return system if system is not None else ProfessionalHairAnalysisSystem(session_for(request))
+
+async def analyze_images(system, patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date,
+                         image1, image2, image3, image4, request: gr.Request = None):
+    system = session_system(system, request)
+    # Filter out None values from image files (type="filepath" gives plain paths)
+    image_files = (image1, image2, image3, image4)
+    image_paths = [getattr(file, "name", file) for file in image_files if file is not None]
     
     if not image_paths:
-        return "Please upload at least one image.", "", gr.Button(visible=False)
+        yield "Please upload at least one image.", "", gr.Button(visible=False), system
+        return
     
     try:
-        if len(image_paths) == 1:
-            analysis = hair_analysis_system.analyze_single_hair_image(image_paths[0])
-        else:
-            analysis = hair_analysis_system.analyze_multiple_hair_images(image_paths)
-        
-        hair_analysis_system.analysis_results = analysis
-        advice = hair_analysis_system.get_comprehensive_advice(analysis)
-        hair_analysis_system.advice_results = advice
-        
-        return analysis, advice, gr.Button(visible=True)
+        ticket = analysis_gate.admit()
+    except GateFull:
+        yield ("The analysis service is at capacity right now. Please try again in a few minutes.",
+               "", gr.Button(visible=False), system)
+        return
+    
+    try:
+        while not ticket.admitted:
+            yield (f"The analysis service is busy. You are number {ticket.position} in line; "
+                   "your analysis will start automatically.", "", gr.Button(visible=False), system)
+            await ticket.moved()
+        
+        # A new analysis starts a new patient, so drop the previous history and results
+        engine.memory_store.reset(system.session_id)
+        system.analysis_results, system.advice_results, system.structured_results = "", "", None
+        
+        # Stream findings and then the treatment plan into the textboxes as they are generated
+        analysis = ""
+        async for chunk in system.astream_analysis(image_paths, system.session_id):
+            analysis += chunk
+            yield analysis, "", gr.Button(visible=False), system
+        analysis = system.finish_analysis(analysis)
+        yield analysis, "", gr.Button(visible=False), system
+        
+        advice = ""
+        async for chunk in system.astream_comprehensive_advice(analysis, system.session_id):
+            advice += chunk
+            yield analysis, advice, gr.Button(visible=False), system
+        system.advice_results = advice
+        
+        yield analysis, advice, gr.Button(visible=True), system
     except Exception as e:
-        return f"Error during analysis: {str(e)}", "", gr.Button(visible=False)
+        yield f"Error during analysis: {str(e)}", "", gr.Button(visible=False), system
+    finally:
+        # Also runs when the browser goes away mid-analysis or while waiting in line
+        ticket.close()
+
+def preview_report(system, patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date):
+    return session_system(system).preview_report(patient_name, patient_id, dob, gender,
+                                                 hospital_name, doctor_name, analysis_date)
+
+def generate_report(system, patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date):
+    return session_system(system).generate_report(patient_name, patient_id, dob, gender,
+                                                  hospital_name, doctor_name, analysis_date)
 
 # Define Gradio interface components
 with gr.Blocks(title="Professional Hair Analysis System", theme=gr.themes.Soft()) as demo:
     gr.Markdown("# Professional Hair Analysis System")
+    # This session's ProfessionalHairAnalysisSystem, created by its first analysis
+    session_state = gr.State(None)
     
     with gr.Row():
         with gr.Column(scale=1):
@@ -670,20 +329,29 @@ with gr.Blocks(title="Professional Hair Analysis System", theme=gr.themes.Soft()
     # Event handlers
     analyze_btn.click(
         analyze_images,
-        inputs=[patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date, image1, image2, image3, image4],
-        outputs=[analysis_output, advice_output, generate_report_btn]
+        inputs=[session_state, patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date,
+                image1, image2, image3, image4],
+        outputs=[analysis_output, advice_output, generate_report_btn, session_state],
+        # No Gradio limit: every analysis reaches analysis_gate at once, which runs MAX_ANALYSES,
+        # lines up ANALYSIS_WAITING with their place shown and turns the rest away
+        concurrency_limit=None,
+        concurrency_id="analysis"
     )
     
     preview_btn.click(
-        hair_analysis_system.preview_report,
-        inputs=[patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date],
-        outputs=[report_preview, report_status]
+        preview_report,
+        inputs=[session_state, patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date],
+        outputs=[report_preview, report_status],
+        concurrency_limit=MAX_REPORTS,
+        concurrency_id="report"
     )
     
     generate_report_btn.click(
-        hair_analysis_system.generate_report,
-        inputs=[patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date],
-        outputs=[report_output, report_status]
+        generate_report,
+        inputs=[session_state, patient_name, patient_id, dob, gender, hospital_name, doctor_name, analysis_date],
+        outputs=[report_output, report_status],
+        concurrency_limit=MAX_REPORTS,
+        concurrency_id="report"
     )
     with gr.Accordion("Detailed Product Recommendations", open=False):
         budget = gr.Dropdown(label="Budget Preference", choices=["Economy", "Mid-range", "Premium"])
@@ -691,16 +359,40 @@ with gr.Blocks(title="Professional Hair Analysis System", theme=gr.themes.Soft()
             label="Primary Concerns",
             choices=["Dryness", "Breakage", "Frizz", "Scalp Issues", "Thinning", "Damage Repair"]
         )
+        narrative = gr.Checkbox(label="Add specialist notes (uses the AI model)", value=False)
         get_products_btn = gr.Button("Get Product Recommendations")
         product_recommendations = gr.Markdown()
 
 # Add event handler
+    async def get_products(system, hair_analysis, budget, concerns, narrative, request: gr.Request = None):
+        system = session_system(system, request)
+        products = system.get_product_recommendations(
+            system.hair_type_for(hair_analysis), concerns, budget
+        )
+        if not narrative or not hair_analysis:
+            return products
+        try:
+            ticket = narrative_gate.admit()
+        except GateFull:
+            return f"{products}\n\n*Specialist notes are unavailable while the service is busy; please try again shortly.*"
+        try:
+            notes = await system.aget_product_narrative(products, hair_analysis, system.session_id)
+        finally:
+            ticket.close()
+        return f"{products}\n\n{notes}"
+
     get_products_btn.click(
-        hair_analysis_system.get_detailed_product_recommendations,
-        inputs=[analysis_output, budget, concerns],
-        outputs=product_recommendations
+        get_products,
+        inputs=[session_state, analysis_output, budget, concerns, narrative],
+        outputs=product_recommendations,
+        concurrency_limit=MAX_PRODUCT_LOOKUPS,
+        concurrency_id="products"
     )
 
+demo.queue(max_size=QUEUE_SIZE)
+# Prometheus text on HAIR_METRICS_PORT, next to the UI
+metrics.serve_from_env()
+
 
 if __name__ == "__main__":
     demo.launch()
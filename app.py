@@ -1,28 +1,29 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from PIL import Image
 import os
 from dotenv import load_dotenv
-from io import BytesIO
-import base64
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Union
+import uuid
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import re
 import datetime
-import random
 import webbrowser
+import threading
+import queue
+
+from hair_analysis import metrics
+from hair_analysis.engine import BASIC_ADVICE_PROMPT, HairAnalysisEngine
+from hair_analysis.structured import HairAnalysis, structured_enabled, try_parse_analysis
 
 # Load environment variables
 load_dotenv()
 
-# Initialize model with memory
-model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=os.getenv("GEMINI_API_KEY"))
-memory = ConversationBufferMemory(memory_key="history", return_messages=True)
-conversation = ConversationChain(llm=model, memory=memory, verbose=True)
+# Prompts, model calls, caches and report rendering live in the shared engine.
+# Preview and Save share its report cache, so the saved file is the report that was previewed.
+engine = HairAnalysisEngine(advice_style="care", verbose=True)
 
 class ProfessionalHairAnalysisSystem:
+    # How often the Tk main loop checks the worker's result queue
+    POLL_INTERVAL_MS = 50
+    
     def __init__(self, root):
         self.root = root
         self.root.title("Professional Hair Analysis System")
@@ -129,15 +130,33 @@ class ProfessionalHairAnalysisSystem:
             
             self.image_labels.append(path_label)
         
-        # Analysis button
+        # Analysis button, cancel button and progress indicator
+        self.analyze_frame = ttk.Frame(self.main_frame)
+        self.analyze_frame.pack(fill=tk.X, pady=10)
+        
         self.analyze_btn = ttk.Button(
-            self.main_frame,
+            self.analyze_frame,
             text="Analyze Hair",
             command=self.analyze_images,
             state=tk.DISABLED,
             style='TButton'
         )
-        self.analyze_btn.pack(pady=10)
+        self.analyze_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.cancel_btn = ttk.Button(
+            self.analyze_frame,
+            text="Cancel",
+            command=self.cancel_analysis,
+            state=tk.DISABLED,
+            width=10
+        )
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.progress = ttk.Progressbar(self.analyze_frame, mode='indeterminate', length=200)
+        self.progress.pack(side=tk.LEFT, padx=10)
+        
+        self.status_label = ttk.Label(self.analyze_frame, text="")
+        self.status_label.pack(side=tk.LEFT, padx=5)
         
         # Results section
         self.results_frame = ttk.LabelFrame(
@@ -197,6 +216,14 @@ class ProfessionalHairAnalysisSystem:
         self.analysis_results = ""
         self.advice_results = ""
         self.temp_html_path = "temp_report.html"
+        self.previewed_report_key = None
+        
+        # Each analyzed patient gets its own conversation memory
+        self.session_id = uuid.uuid4().hex
+        
+        # Background analysis worker
+        self.worker = None
+        self.cancel_event = None
     
     def browse_image(self, index):
         filetypes = (
@@ -235,41 +262,162 @@ class ProfessionalHairAnalysisSystem:
             messagebox.showerror("Error", "Please select at least one image")
             return
         
+        self.new_session()
+        
         self.results_text.delete(1.0, tk.END)
         self.results_text.insert(tk.END, "Analyzing images... Please wait...\n")
-        self.root.update()
         
+        # Run the analysis on a worker thread; it reports back through a queue polled by root.after
+        self.cancel_event = threading.Event()
+        results = queue.Queue()
+        self.worker = threading.Thread(
+            target=self.run_analysis,
+            args=(valid_paths, self.session_id, self.cancel_event, results),
+            daemon=True
+        )
+        self.set_busy(True, "Preparing images...")
+        self.worker.start()
+        self.root.after(self.POLL_INTERVAL_MS, self.poll_results, results)
+    
+    def run_analysis(self, valid_paths: List[str], session_id: str, cancel_event: threading.Event,
+                     results: queue.Queue):
+        # Worker thread: never touches Tk widgets, only puts messages on the queue
         try:
             if len(valid_paths) == 1:
-                analysis = self.analyze_single_hair_image(valid_paths[0])
-                self.analysis_results = analysis
-                self.results_text.delete(1.0, tk.END)
-                self.results_text.insert(tk.END, "=== HAIR ANALYSIS RESULTS ===\n\n")
-                self.results_text.insert(tk.END, analysis)
-                
-                if "unclear" not in analysis.lower():
-                    self.results_text.insert(tk.END, "\n\n=== BASIC RECOMMENDATIONS ===\n\n")
-                    advice = self.get_hair_advice("Provide basic care recommendations based on this analysis")
-                    self.advice_results = advice
-                    self.results_text.insert(tk.END, advice)
-                    self.enable_report_buttons()
+                heading = "=== HAIR ANALYSIS RESULTS ===\n\n"
+                analysis_stream = self.stream_single_hair_image(valid_paths[0], session_id)
             else:
-                analysis = self.analyze_multiple_hair_images(valid_paths)
-                self.analysis_results = analysis
-                self.results_text.delete(1.0, tk.END)
-                self.results_text.insert(tk.END, "=== COMPREHENSIVE HAIR ANALYSIS ===\n\n")
-                self.results_text.insert(tk.END, analysis)
+                heading = "=== COMPREHENSIVE HAIR ANALYSIS ===\n\n"
+                analysis_stream = self.stream_multiple_hair_images(valid_paths, session_id)
+            
+            results.put(("status", "Analyzing images..."))
+            analysis = self.forward_stream(analysis_stream, cancel_event, results, heading)
+            if analysis is None:
+                results.put(("cancelled", None))
+                return
+            
+            # Structured replies are shown as Markdown, and follow-ups quote only their compact fields
+            structured = try_parse_analysis(analysis) if structured_enabled() else None
+            if structured is not None:
+                analysis = structured.to_markdown()
+                results.put(("reset", heading + analysis))
+                unclear = structured.is_unclear
+            else:
+                unclear = "unclear" in analysis.lower()
+            results.put(("analysis", analysis))
+            
+            if not unclear:
+                if len(valid_paths) == 1:
+                    results.put(("text", "\n\n=== BASIC RECOMMENDATIONS ===\n\n"))
+                    advice_stream = self.stream_hair_advice(BASIC_ADVICE_PROMPT, session_id, stage="advice")
+                else:
+                    results.put(("text", "\n\n=== DETAILED RECOMMENDATIONS ===\n\n"))
+                    advice_stream = self.stream_comprehensive_advice(structured or analysis, session_id)
                 
-                if "unclear" not in analysis.lower():
-                    self.results_text.insert(tk.END, "\n\n=== DETAILED RECOMMENDATIONS ===\n\n")
-                    advice = self.get_comprehensive_advice(analysis)
-                    self.advice_results = advice
-                    self.results_text.insert(tk.END, advice)
-                    self.enable_report_buttons()
-                    
+                results.put(("status", "Generating recommendations..."))
+                advice = self.forward_stream(advice_stream, cancel_event, results)
+                if advice is None:
+                    results.put(("cancelled", None))
+                    return
+                results.put(("advice", advice))
+            
+            results.put(("done", None))
         except Exception as e:
-            messagebox.showerror("Analysis Error", f"An error occurred during analysis:\n{str(e)}")
-            self.results_text.insert(tk.END, f"\n\nError: {str(e)}")
+            results.put(("error", str(e)))
+    
+    def forward_stream(self, chunks: Iterator[str], cancel_event: threading.Event, results: queue.Queue,
+                       heading: Optional[str] = None) -> Optional[str]:
+        # Returns the full text, or None if the user cancelled part way.
+        # The stream is read on its own thread so Cancel also works while waiting for the first chunk.
+        pending = queue.Queue()
+        threading.Thread(target=self.pump_stream, args=(chunks, cancel_event, pending), daemon=True).start()
+        parts = []
+        while True:
+            try:
+                kind, payload = pending.get(timeout=self.POLL_INTERVAL_MS / 1000)
+            except queue.Empty:
+                if cancel_event.is_set():
+                    return None
+                continue
+            if cancel_event.is_set():
+                return None
+            if kind == "end":
+                return "".join(parts)
+            if kind == "error":
+                raise payload
+            if heading is not None and not parts:
+                results.put(("reset", heading))
+            parts.append(payload)
+            results.put(("text", payload))
+    
+    def pump_stream(self, chunks: Iterator[str], cancel_event: threading.Event, pending: queue.Queue):
+        # After a cancel the model call cannot be interrupted; the stream is closed at its next chunk
+        try:
+            for chunk in chunks:
+                if cancel_event.is_set():
+                    break
+                pending.put(("text", chunk))
+            pending.put(("end", None))
+        except Exception as e:
+            pending.put(("error", e))
+        finally:
+            chunks.close()
+    
+    def poll_results(self, results: queue.Queue):
+        finished = False
+        try:
+            while True:
+                kind, payload = results.get_nowait()
+                if kind == "reset":
+                    self.results_text.delete(1.0, tk.END)
+                    self.results_text.insert(tk.END, payload)
+                elif kind == "text":
+                    self.results_text.insert(tk.END, payload)
+                    self.results_text.see(tk.END)
+                elif kind == "status":
+                    self.status_label.config(text=payload)
+                elif kind == "analysis":
+                    self.analysis_results = payload
+                elif kind == "advice":
+                    self.advice_results = payload
+                    self.enable_report_buttons()
+                elif kind == "cancelled":
+                    self.results_text.insert(tk.END, "\n\nAnalysis cancelled.")
+                    finished = True
+                elif kind == "error":
+                    messagebox.showerror("Analysis Error", f"An error occurred during analysis:\n{payload}")
+                    self.results_text.insert(tk.END, f"\n\nError: {payload}")
+                    finished = True
+                elif kind == "done":
+                    finished = True
+        except queue.Empty:
+            pass
+        
+        if finished:
+            self.set_busy(False)
+        else:
+            self.root.after(self.POLL_INTERVAL_MS, self.poll_results, results)
+    
+    def cancel_analysis(self):
+        if self.worker is not None and self.worker.is_alive():
+            self.cancel_event.set()
+            self.status_label.config(text="Cancelling...")
+            self.cancel_btn.config(state=tk.DISABLED)
+    
+    def set_busy(self, busy: bool, status: str = ""):
+        if busy:
+            self.analyze_btn.config(state=tk.DISABLED)
+            self.cancel_btn.config(state=tk.NORMAL)
+            self.progress.start(10)
+        else:
+            self.analyze_btn.config(state=tk.NORMAL if any(self.image_paths) else tk.DISABLED)
+            self.cancel_btn.config(state=tk.DISABLED)
+            self.progress.stop()
+        self.status_label.config(text=status)
+    
+    def new_session(self):
+        engine.memory_store.evict(self.session_id)
+        self.session_id = uuid.uuid4().hex
     
     def enable_report_buttons(self):
         self.save_btn.config(state=tk.NORMAL)
@@ -296,51 +444,42 @@ class ProfessionalHairAnalysisSystem:
         
         if filename:
             try:
-                report_id = f"HA{random.randint(1000, 9999)}-{datetime.datetime.now().strftime('%Y%m%d')}"
-                
-                self.save_analysis_report(
-                    self.analysis_results, 
-                    self.advice_results, 
-                    filename,
-                    patient_name=self.patient_name.get(),
-                    patient_id=self.patient_id.get(),
-                    dob=self.dob.get(),
-                    gender=self.gender.get(),
-                    hospital_name=self.hospital_name.get(),
-                    doctor_name=self.doctor_name.get(),
-                    analysis_date=self.analysis_date.get(),
-                    report_id=report_id
-                )
+                self.rendered_report().write(filename)
                 messagebox.showinfo("Success", f"Report saved successfully to:\n{filename}")
             except Exception as e:
                 messagebox.showerror("Save Error", f"Failed to save report:\n{str(e)}")
     
+    def rendered_report(self):
+        return engine.rendered_report(
+            self.analysis_results,
+            self.advice_results,
+            patient_name=self.patient_name.get(),
+            patient_id=self.patient_id.get(),
+            dob=self.dob.get(),
+            gender=self.gender.get(),
+            hospital_name=self.hospital_name.get(),
+            doctor_name=self.doctor_name.get(),
+            analysis_date=self.analysis_date.get()
+        )
+    
     def preview_report(self):
         if not self.analysis_results or not self.advice_results:
             messagebox.showerror("Error", "No analysis results to preview")
             return
         
         try:
-            report_id = f"HA{random.randint(1000, 9999)}-{datetime.datetime.now().strftime('%Y%m%d')}"
-            
-            self.save_analysis_report(
-                self.analysis_results, 
-                self.advice_results, 
-                self.temp_html_path,
-                patient_name=self.patient_name.get(),
-                patient_id=self.patient_id.get(),
-                dob=self.dob.get(),
-                gender=self.gender.get(),
-                hospital_name=self.hospital_name.get(),
-                doctor_name=self.doctor_name.get(),
-                analysis_date=self.analysis_date.get(),
-                report_id=report_id
-            )
+            report = self.rendered_report()
+            # Unchanged report: the preview file on disk is already this one
+            if report.key != self.previewed_report_key or not os.path.exists(self.temp_html_path):
+                report.write(self.temp_html_path)
+                self.previewed_report_key = report.key
             webbrowser.open(f"file://{os.path.abspath(self.temp_html_path)}")
         except Exception as e:
             messagebox.showerror("Preview Error", f"Failed to generate preview:\n{str(e)}")
     
     def clear_all(self):
+        self.cancel_analysis()
+        self.new_session()
         self.image_paths = []
         for label in self.image_labels:
             label.config(text="No image selected")
@@ -359,434 +498,75 @@ class ProfessionalHairAnalysisSystem:
         self.analysis_date.delete(0, tk.END)
         self.analysis_date.insert(0, datetime.date.today().strftime("%Y-%m-%d"))
     
-    def prepare_image(self, image_path: str) -> Dict:
-        try:
-            img = Image.open(image_path)
-            img = img.convert('RGB')
-            
-            width, height = img.size
-            if width > 1024 or height > 1024:
-                ratio = min(1024/width, 1024/height)
-                new_size = (int(width*ratio), int(height*ratio))
-                img = img.resize(new_size, Image.LANCZOS)
-            
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG", quality=90)
-            return {
-                "mime_type": "image/jpeg",
-                "data": base64.b64encode(buffered.getvalue()).decode('utf-8'),
-                "filename": os.path.basename(image_path)
-            }
-        except Exception as e:
-            raise ValueError(f"Error processing image {image_path}: {str(e)}")
+    def check_image_paths(self, image_paths: List[str]) -> Optional[str]:
+        return engine.check_image_paths(image_paths)
     
-    def analyze_single_hair_image(self, image_path: str) -> str:
+    def analyze_single_hair_image(self, image_path: str, session_id: Optional[str] = None) -> str:
+        return "".join(self.stream_single_hair_image(image_path, session_id))
+    
+    def stream_single_hair_image(self, image_path: str, session_id: Optional[str] = None) -> Iterator[str]:
         try:
             if not os.path.exists(image_path):
-                return "Error: Image file not found."
-            
-            image_data = self.prepare_image(image_path)
+                yield "Error: Image file not found."
+                return
             
-            prompt = """As a professional hair specialist, analyze this hair image in detail:
-            
-            1. Hair Characteristics:
-               - Texture (straight, wavy, curly, coily)
-               - Density (thin, medium, thick)
-               - Diameter (fine, medium, coarse)
-               - Porosity level
-            
-            2. Scalp Condition:
-               - Visible scalp health
-               - Signs of irritation or abnormalities
-            
-            3. Hair Health:
-               - Ends condition (split ends, damage)
-               - Breakage patterns
-               - Signs of chemical damage
-               - Moisture/protein balance indicators
-            
-            4. Additional Observations:
-               - Any visible scalp conditions
-               - Hairline characteristics
-               - Growth patterns
-            
-            Provide:
-            - Detailed findings with confidence levels
-            - Clear explanations of technical terms
-            - Specific areas needing closer examination
-            """
-            
-            message = [
-                {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {
-                    "url": f"data:{image_data['mime_type']};base64,{image_data['data']}",
-                    "detail": "high"
-                }}
-            ]
-            
-            response = conversation.invoke({"input": message})
-            return response["response"]
+            yield from engine.stream_analysis([image_path], session_id or self.session_id)
         
         except Exception as e:
-            return f"Error processing image: {str(e)}"
+            yield f"Error processing image: {str(e)}"
+    
+    def analyze_multiple_hair_images(self, image_paths: List[str], session_id: Optional[str] = None) -> str:
+        return "".join(self.stream_multiple_hair_images(image_paths, session_id))
     
-    def analyze_multiple_hair_images(self, image_paths: List[str]) -> str:
+    def stream_multiple_hair_images(self, image_paths: List[str], session_id: Optional[str] = None) -> Iterator[str]:
         try:
-            if not image_paths:
-                return "Error: No images provided."
-            
-            if len(image_paths) > 4:
-                return "Error: Maximum 4 images allowed for analysis."
-            
-            image_data_list = []
-            for path in image_paths:
-                if not os.path.exists(path):
-                    return f"Error: Image not found - {path}"
-                image_data_list.append(self.prepare_image(path))
-            
-            prompt = f"""As a senior hair specialist, analyze these {len(image_data_list)} images of the same patient's hair:
+            error = self.check_image_paths(image_paths)
+            if error:
+                yield error
+                return
             
-            Perform COMPREHENSIVE ANALYSIS by:
-            
-            1. Individual Image Analysis:
-               - Analyze each image separately first
-               - Note unique observations from each angle
-            
-            2. Comparative Analysis:
-               - Identify consistent characteristics across images
-               - Resolve any discrepancies between images
-               - Determine most accurate overall assessment
-            
-            3. Detailed Assessment of:
-               - Hair type and texture from all angles
-               - Scalp health from visible areas
-               - Hair density and distribution
-               - Damage patterns and severity
-               - Growth patterns and hairline
-            
-            4. Final Evaluation:
-               - Most likely hair characteristics
-               - Confidence levels for each finding
-               - Recommended additional views if needed
-            
-            Image Details: {[img['filename'] for img in image_data_list]}
-            """
-            
-            messages = [{"type": "text", "text": prompt}]
-            for img_data in image_data_list:
-                messages.append({
-                    "type": "image_url", 
-                    "image_url": {
-                        "url": f"data:{img_data['mime_type']};base64,{img_data['data']}",
-                        "detail": "high"
-                    }
-                })
-            
-            response = conversation.invoke({"input": messages})
-            return response["response"]
+            yield from engine.stream_analysis(image_paths, session_id or self.session_id)
         
         except Exception as e:
-            return f"Error processing images: {str(e)}"
+            yield f"Error processing images: {str(e)}"
     
-    def get_hair_advice(self, follow_up: str) -> str:
-        response = conversation.invoke({"input": follow_up})
-        return response["response"]
+    def get_hair_advice(self, follow_up: str, session_id: Optional[str] = None, stage: str = "ask") -> str:
+        return engine.ask(follow_up, session_id or self.session_id, stage)
     
-    def get_comprehensive_advice(self, analysis: str) -> str:
-        prompt = f"""Based on this comprehensive hair analysis:
-        {analysis}
-        
-        Provide DETAILED TREATMENT PLAN covering:
-        
-        1. Immediate Care Recommendations:
-           - Daily routine (cleansing, conditioning)
-           - Recommended products
-           - Handling instructions
-        
-        2. Professional Treatments:
-           - Recommended salon treatments
-           - Frequency
-           - Expected outcomes
-        
-        3. Long-term Maintenance:
-           - Ongoing care regimen
-           - Lifestyle adjustments
-           - Nutritional recommendations
-        
-        4. Follow-up Plan:
-           - Recommended timeline for reassessment
-           - Signs to watch for
-           - When to seek professional help
-        
-        5. Product Recommendations:
-           - Specific product types
-           - Key ingredients to look for
-           - Ingredients to avoid
-        
-        Organize by priority and provide rationale for each recommendation.
-        """
-        
-        return self.get_hair_advice(prompt)
+    def stream_hair_advice(self, follow_up: str, session_id: Optional[str] = None, stage: str = "ask") -> Iterator[str]:
+        return engine.stream_ask(follow_up, session_id or self.session_id, stage)
     
-    def convert_to_html(self, text: str) -> str:
-        lines = text.splitlines()
-        html_lines = []
-        in_list = False
-        in_table = False
-
-        for line in lines:
-            stripped = line.strip()
-
-            # Handle lists
-            if stripped.startswith(("* ", "- ")):
-                if not in_list:
-                    html_lines.append("<ul>")
-                    in_list = True
-                item = stripped[2:]
-                item = re.sub(r"\*\*(.*?)\*\*", r"<strong>\1</strong>", item)
-                html_lines.append(f"<li>{item}</li>")
-            else:
-                if in_list:
-                    html_lines.append("</ul>")
-                    in_list = False
-                
-                # Convert bold text
-                line = re.sub(r"\*\*(.*?)\*\*", r"<strong>\1</strong>", line)
-                
-                # Handle paragraphs
-                if line.strip():
-                    html_lines.append(f"<p>{line}</p>")
-
-        if in_list:
-            html_lines.append("</ul>")
-
-        return "\n".join(html_lines)
+    def comprehensive_advice_prompt(self, analysis: Union[str, HairAnalysis]) -> str:
+        return engine.advice_prompt(analysis)
+    
+    def get_comprehensive_advice(self, analysis: Union[str, HairAnalysis], session_id: Optional[str] = None) -> str:
+        return self.get_hair_advice(self.comprehensive_advice_prompt(analysis), session_id, stage="advice")
+    
+    def stream_comprehensive_advice(self, analysis: Union[str, HairAnalysis], session_id: Optional[str] = None) -> Iterator[str]:
+        return self.stream_hair_advice(self.comprehensive_advice_prompt(analysis), session_id, stage="advice")
     
     def save_analysis_report(self, analysis: str, advice: str, output_path: str, 
                            patient_name: str = "", patient_id: str = "", dob: str = "",
                            gender: str = "", hospital_name: str = "", doctor_name: str = "",
                            analysis_date: str = "", report_id: str = ""):
-        analysis_html = self.convert_to_html(analysis)
-        advice_html = self.convert_to_html(advice)
+        html_content = engine.report_html(
+            analysis,
+            advice,
+            report_id=report_id,
+            patient_name=patient_name,
+            patient_id=patient_id,
+            dob=dob,
+            gender=gender,
+            hospital_name=hospital_name,
+            doctor_name=doctor_name,
+            analysis_date=analysis_date
+        )
         
-        report_generated_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        age = ""
-        if dob:
-            try:
-                birth_date = datetime.datetime.strptime(dob, "%Y-%m-%d")
-                today = datetime.datetime.today()
-                age = str(today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day)))
-            except:
-                age = "N/A"
-        
-        html_content = f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Hair Analysis Report - {patient_name or 'Patient'}</title>
-            <style>
-                body {{
-                    font-family: 'Arial', sans-serif;
-                    margin: 0;
-                    padding: 0;
-                    color: #333;
-                    line-height: 1.6;
-                }}
-                .page {{
-                    width: 21cm;
-                    min-height: 29.7cm;
-                    margin: 1cm auto;
-                    padding: 1.5cm;
-                    box-sizing: border-box;
-                    background: white;
-                    box-shadow: 0 0 10px rgba(0,0,0,0.1);
-                }}
-                .letterhead {{
-                    border-bottom: 3px double #5A189A;
-                    padding-bottom: 15px;
-                    margin-bottom: 25px;
-                    text-align: center;
-                }}
-                .hospital-name {{
-                    font-size: 24px;
-                    font-weight: bold;
-                    color: #5A189A;
-                    margin-bottom: 5px;
-                }}
-                .contact-info {{
-                    font-size: 12px;
-                    color: #666;
-                }}
-                .report-header {{
-                    display: flex;
-                    justify-content: space-between;
-                    margin: 25px 0;
-                }}
-                .patient-info, .report-info {{
-                    width: 48%;
-                }}
-                .info-box {{
-                    border: 1px solid #ddd;
-                    padding: 15px;
-                    margin-bottom: 20px;
-                    border-radius: 5px;
-                }}
-                .info-box h3 {{
-                    margin-top: 0;
-                    color: #5A189A;
-                    border-bottom: 1px solid #eee;
-                    padding-bottom: 5px;
-                }}
-                .info-grid {{
-                    display: grid;
-                    grid-template-columns: 1fr 1fr;
-                    gap: 10px;
-                }}
-                .info-item {{
-                    margin-bottom: 8px;
-                }}
-                .info-label {{
-                    font-weight: bold;
-                    color: #555;
-                }}
-                .section {{
-                    margin: 30px 0;
-                }}
-                .section-title {{
-                    background-color: #5A189A;
-                    color: white;
-                    padding: 8px 15px;
-                    border-radius: 5px;
-                    font-size: 18px;
-                    margin-bottom: 15px;
-                }}
-                ul {{
-                    padding-left: 25px;
-                }}
-                li {{
-                    margin-bottom: 8px;
-                }}
-                .signature-area {{
-                    margin-top: 50px;
-                    text-align: right;
-                }}
-                .signature-line {{
-                    display: inline-block;
-                    border-top: 1px solid #333;
-                    width: 250px;
-                    margin-top: 40px;
-                    padding-top: 5px;
-                    text-align: center;
-                }}
-                .footer {{
-                    margin-top: 50px;
-                    font-size: 11px;
-                    color: #777;
-                    text-align: center;
-                    border-top: 1px solid #eee;
-                    padding-top: 10px;
-                }}
-                .report-id {{
-                    background-color: #f0f0f0;
-                    padding: 3px 8px;
-                    border-radius: 3px;
-                    font-family: monospace;
-                    font-size: 14px;
-                }}
-                @media print {{
-                    body {{
-                        background: none;
-                    }}
-                    .page {{
-                        width: auto;
-                        margin: 0;
-                        padding: 2cm;
-                        box-shadow: none;
-                    }}
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="page">
-                <div class="letterhead">
-                    <div class="hospital-name">{hospital_name or 'Hair Analysis Center'}</div>
-                    <div class="contact-info">
-                        123 Dermatology Street, Medical City | Tel: (123) 456-7890 | Email: contact@hairclinic.com
-                    </div>
-                </div>
-                
-                <div class="report-header">
-                    <div class="info-box patient-info">
-                        <h3>Patient Information</h3>
-                        <div class="info-grid">
-                            <div class="info-item">
-                                <span class="info-label">Name:</span> {patient_name or 'Not specified'}
-                            </div>
-                            <div class="info-item">
-                                <span class="info-label">Patient ID:</span> {patient_id or 'N/A'}
-                            </div>
-                            <div class="info-item">
-                                <span class="info-label">Date of Birth:</span> {dob or 'N/A'}
-                            </div>
-                            <div class="info-item">
-                                <span class="info-label">Age:</span> {age}
-                            </div>
-                            <div class="info-item">
-                                <span class="info-label">Gender:</span> {gender or 'N/A'}
-                            </div>
-                            <div class="info-item">
-                                <span class="info-label">Doctor:</span> {doctor_name or 'Not specified'}
-                            </div>
-                        </div>
-                    </div>
-                    
-                    <div class="info-box report-info">
-                        <h3>Report Information</h3>
-                        <div class="info-grid">
-                            <div class="info-item">
-                                <span class="info-label">Report ID:</span> <span class="report-id">{report_id or 'N/A'}</span>
-                            </div>
-                            <div class="info-item">
-                                <span class="info-label">Analysis Date:</span> {analysis_date or 'N/A'}
-                            </div>
-                            <div class="info-item">
-                                <span class="info-label">Report Generated:</span> {report_generated_time}
-                            </div>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="section">
-                    <div class="section-title">HAIR ANALYSIS FINDINGS</div>
-                    {analysis_html}
-                </div>
-                
-                <div class="section">
-                    <div class="section-title">TREATMENT PLAN & RECOMMENDATIONS</div>
-                    {advice_html}
-                </div>
-                
-                <div class="signature-area">
-                    <div class="signature-line">
-                        {doctor_name or 'Hair Specialist'}
-                    </div>
-                </div>
-                
-                <div class="footer">
-                    <p>This report was generated by the Professional Hair Analysis System. Confidential - For medical use only.</p>
-                    <p>© {datetime.datetime.now().year} {hospital_name or 'Hair Analysis Center'}. All rights reserved.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
+        with metrics.span("report.write"), open(output_path, 'w', encoding='utf-8') as f:
             f.write(html_content)
 
 if __name__ == "__main__":
+    metrics.serve_from_env()
     root = tk.Tk()
     app = ProfessionalHairAnalysisSystem(root)
     root.mainloop()
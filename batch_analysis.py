@@ -0,0 +1,158 @@
+"""Headless batch analysis of a whole clinic day of patients.
+
+Reads a CSV or JSON manifest with the same fields the GUI collects plus image
+paths, and for every patient runs image preparation -> analysis -> advice ->
+HTML report on the headless engine (hair_analysis.engine), with up to
+--workers patients in flight at once. Reports are written to the output
+directory together with a shared report.css and a summary.json of throughput,
+failures and per-stage timings. Each report is named after its manifest row
+and the patient ID (or name), e.g. hair_report_0007_P123.html, so duplicate
+IDs or names never overwrite each other; --skip-existing checks the same name.
+
+CSV manifests use the columns patient_name, patient_id, dob, gender,
+hospital_name, doctor_name, analysis_date and either an ``images`` column
+(paths separated by ';') or image1..image4. JSON manifests are a list of
+objects with the same keys and ``images`` as a list.
+
+    python batch_analysis.py manifest.csv --output-dir reports --workers 8
+
+Add ``--backend stub`` to time the pipeline offline against the simulated model.
+With HAIR_METRICS_PORT set, per-stage histograms are served for Prometheus
+while the batch runs (see hair_analysis.metrics).
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+from hair_analysis import metrics
+from hair_analysis.engine import PATIENT_FIELDS, HairAnalysisEngine, PatientResult
+from hair_analysis.ratelimit import default_limiter
+from hair_analysis.report import write_stylesheet
+
+STAGES = ("prepare", "analysis", "advice", "report")
+
+
+def load_manifest(path: str) -> List[Dict]:
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+
+    patients = []
+    for row in rows:
+        images = row.get("images") or []
+        if isinstance(images, str):
+            images = images.split(";")
+        images = list(images) + [row.get(f"image{i}") for i in range(1, 5)]
+        images = [p.strip() for p in images if p and p.strip()]
+        patient = {field: (row.get(field) or "").strip() for field in PATIENT_FIELDS}
+        # Relative image paths are resolved against the manifest's folder
+        patient["images"] = [p if os.path.isabs(p) else os.path.join(base_dir, p) for p in images]
+        patients.append(patient)
+    return patients
+
+
+def report_filename(patient: Dict, index: int) -> str:
+    # The manifest row keeps names unique; the ID or name only makes them readable
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', patient["patient_id"] or patient["patient_name"])
+    return f"hair_report_{index + 1:04d}_{name}.html" if name else f"hair_report_{index + 1:04d}.html"
+
+
+def summarize(results: List[Dict], failures: List[Dict], elapsed: float, engine: HairAnalysisEngine) -> Dict:
+    stages = {}
+    for stage in STAGES:
+        values = sorted(r["timings"][stage] for r in results if stage in r["timings"])
+        if not values:
+            continue
+        stages[stage] = {
+            "mean": statistics.fmean(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1],
+            "total": sum(values),
+        }
+    done = len(results)
+    return {
+        "patients": done + len(failures),
+        "succeeded": done,
+        "failed": len(failures),
+        "elapsed_seconds": elapsed,
+        "patients_per_minute": done / elapsed * 60 if elapsed else 0.0,
+        "stages": stages,
+        "failures": failures,
+        "backend": engine.backend.name,
+        "rate_limiter": default_limiter().metrics(),
+        "single_flight": engine.memory_store.flights.stats(),
+    }
+
+
+def run_batch(patients: List[Dict], output_dir: str, workers: int = 4, skip_existing: bool = False,
+              engine: Optional[HairAnalysisEngine] = None, backend: Optional[str] = None) -> Dict:
+    engine = engine or HairAnalysisEngine(backend=backend)
+    os.makedirs(output_dir, exist_ok=True)
+    # Reports link one shared stylesheet instead of each inlining it
+    write_stylesheet(output_dir)
+    todo = [(index, patient) for index, patient in enumerate(patients)
+            if not (skip_existing and os.path.exists(os.path.join(output_dir, report_filename(patient, index))))]
+    results, failures = [], []
+
+    def finished(result: PatientResult):
+        index, patient = todo[result.index]
+        label = patient["patient_id"] or patient["patient_name"] or f"#{index + 1}"
+        if not result.ok:
+            failures.append({"patient": label, "error": result.error})
+            print(f"[failed] {label}: {result.error}", file=sys.stderr)
+            return
+        start = time.perf_counter()
+        report_path = os.path.join(output_dir, report_filename(patient, index))
+        with metrics.span("report.write"), open(report_path, "w", encoding="utf-8") as f:
+            f.write(result.report_html)
+        timings = dict(result.timings, report=result.timings["report"] + time.perf_counter() - start)
+        results.append({"report": report_path, "timings": timings})
+        print(f"[ok] {label} -> {report_path}")
+
+    start = time.perf_counter()
+    engine.analyze_many([patient for _, patient in todo], concurrency=workers, stylesheet_mode="external",
+                        on_result=finished)
+    return summarize(results, failures, time.perf_counter() - start, engine)
+
+
+def print_summary(summary: Dict):
+    print(f"\nProcessed {summary['patients']} patients in {summary['elapsed_seconds']:.1f}s "
+          f"({summary['patients_per_minute']:.1f}/min): {summary['succeeded']} ok, {summary['failed']} failed")
+    for stage, stats in summary["stages"].items():
+        print(f"  {stage:<9} mean {stats['mean']:.2f}s  p50 {stats['p50']:.2f}s  "
+              f"p95 {stats['p95']:.2f}s  max {stats['max']:.2f}s")
+    for failure in summary["failures"]:
+        print(f"  failed: {failure['patient']}: {failure['error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run hair analysis reports for a manifest of patients.")
+    parser.add_argument("manifest", help="CSV or JSON manifest of patients")
+    parser.add_argument("--output-dir", default="hair_reports", help="Directory for reports and summary.json")
+    parser.add_argument("--workers", type=int, default=4, help="Patients processed concurrently")
+    parser.add_argument("--skip-existing", action="store_true", help="Skip patients whose report already exists")
+    parser.add_argument("--backend", help="Model backend, e.g. 'stub' for an offline run (default: HAIR_LLM_BACKEND)")
+    args = parser.parse_args(argv)
+
+    metrics.serve_from_env()
+    patients = load_manifest(args.manifest)
+    summary = run_batch(patients, args.output_dir, args.workers, args.skip_existing, backend=args.backend)
+    with open(os.path.join(args.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    print_summary(summary)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Measure product catalog load time and recommendation query latency.
+
+Loads the bundled catalog plus a synthetic one of --products entries, from
+JSON and from SQLite, then times recommendation queries against each, first
+against a cold memo and then repeated.
+
+    python benchmarks/bench_catalog.py --products 20000 --queries 20000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hair_analysis.catalog import CATEGORIES, CONCERN_ALIASES, HAIR_TYPES, TIERS, ProductCatalog
+
+CONCERNS = sorted(set(CONCERN_ALIASES.values()))
+BUDGETS = ("Economy", "Mid-range", "Premium")
+
+
+def synthetic_records(count: int, rng: random.Random):
+    for i in range(count):
+        yield {
+            "name": f"Product {i}", "brand": f"Brand {i % 97}",
+            "category": rng.choice(CATEGORIES), "tier": rng.choice(TIERS),
+            "hair_types": rng.sample(HAIR_TYPES, rng.randint(1, 4)),
+            "concerns": rng.sample(CONCERNS, rng.randint(1, 3)),
+            "ingredients": ["water", f"active {i % 31}"], "where_to_buy": "Online", "price": f"${5 + i % 60}",
+        }
+
+
+def write_sqlite(path: str, records):
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE products (name TEXT, brand TEXT, category TEXT, tier TEXT, hair_types TEXT, "
+               "concerns TEXT, ingredients TEXT, where_to_buy TEXT, price TEXT)")
+    db.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+        (r["name"], r["brand"], r["category"], r["tier"], ",".join(r["hair_types"]), ",".join(r["concerns"]),
+         ",".join(r["ingredients"]), r["where_to_buy"], r["price"]) for r in records
+    ])
+    db.commit()
+    db.close()
+
+
+def time_queries(catalog: ProductCatalog, queries) -> float:
+    start = time.perf_counter()
+    for concerns, budget, hair_type in queries:
+        catalog.recommend(concerns, budget, hair_type)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    queries = [(rng.sample(["Dryness", "Breakage", "Frizz", "Scalp Issues", "Thinning", "Damage Repair"],
+                           rng.randint(0, 3)), rng.choice(BUDGETS), rng.choice(HAIR_TYPES + (None,)))
+               for _ in range(args.queries)]
+    records = list(synthetic_records(args.products, rng))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "products.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(records, f)
+        sqlite_path = os.path.join(tmp, "products.sqlite3")
+        write_sqlite(sqlite_path, records)
+
+        print(f"{args.queries} queries per catalog")
+        print(f"{'catalog':<16} {'products':>9} {'load':>9} {'first pass':>11} {'repeat':>9}")
+        for label, path in (("bundled", None), ("synthetic json", json_path), ("synthetic sqlite", sqlite_path)):
+            start = time.perf_counter()
+            catalog = ProductCatalog.load(path)
+            load = time.perf_counter() - start
+            # The first pass fills the memo; repeats of the same query are lookups
+            first = time_queries(catalog, queries)
+            repeat = time_queries(catalog, queries)
+            print(f"{label:<16} {len(catalog.products):>9} {load * 1e3:>7.1f}ms {first * 1e6:>9.1f}us "
+                  f"{repeat * 1e6:>7.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compare peak memory of the old full-resolution decode with the draft/reduce path.
+
+Each strategy runs in a fresh subprocess so its peak RSS can be read from
+getrusage without interference.
+
+    python benchmarks/bench_decode_memory.py --megapixels 48
+"""
+import argparse
+import base64
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def legacy_prepare(image_path: str) -> str:
+    # The original prepare_image: full decode and RGB convert before downsizing
+    img = Image.open(image_path)
+    img = img.convert('RGB')
+    width, height = img.size
+    if width > 1024 or height > 1024:
+        ratio = min(1024/width, 1024/height)
+        img = img.resize((int(width*ratio), int(height*ratio)), Image.LANCZOS)
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=90)
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def child(strategy: str, image_path: str):
+    from hair_analysis.imaging import prepare_image
+
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    if strategy == "legacy":
+        legacy_prepare(image_path)
+        reported = ""
+    else:
+        reported = f"{prepare_image(image_path, use_cache=False)['peak_bitmap_bytes'] / 1e6:.1f}"
+    elapsed = time.perf_counter() - start
+    print(f"{peak_rss_mb() - baseline:.1f} {elapsed:.3f} {reported}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=48)
+    parser.add_argument("--child", nargs=2, metavar=("STRATEGY", "IMAGE"), help=argparse.SUPPRESS)
+    parser.add_argument("--make", metavar="IMAGE", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(*args.child)
+        return
+    if args.make:
+        width = int((args.megapixels * 1_000_000 * 4 / 3) ** 0.5)
+        Image.effect_noise((width, width * 3 // 4), 50).convert("RGB").save(args.make, quality=92)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Linux children inherit the parent's peak RSS, so keep this process small
+        # and build the test photo in a subprocess too
+        path = os.path.join(tmp, "photo.jpg")
+        subprocess.run([sys.executable, __file__, "--megapixels", str(args.megapixels), "--make", path], check=True)
+
+        print(f"{args.megapixels:g} MP JPEG")
+        print(f"{'strategy':<10} {'peak RSS +MB':>13} {'time':>8} {'reported bitmap MB':>19}")
+        for strategy in ("legacy", "draft"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", strategy, path],
+                env=dict(os.environ, HAIR_CACHE_DIR=os.path.join(tmp, "cache")),
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            reported = out[2] if len(out) > 2 else "-"
+            print(f"{strategy:<10} {float(out[0]):>13.1f} {float(out[1]):>7.3f}s {reported:>19}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Concurrent load test of the Gradio app against the stub model.
+
+Starts V2/appv2.py in a subprocess with HAIR_LLM_BACKEND=stub (or targets a
+running server with --url), then for each --users level runs that many
+virtual users for --duration seconds. Each user has its own Gradio session and
+repeats a clinic visit: upload 1-4 photos and analyze them, preview the
+report, generate it, and look up products (with specialist notes every other
+visit), pausing --think seconds between clicks.
+
+For every endpoint it reports throughput, p50/p95/p99 latency, error and
+shed rates (turned away by the queue or an admission gate) and queue wait:
+the time in Gradio's queue plus, for analyses, in the app's waiting line (up
+to the first findings, so it includes that call's time to first chunk).
+"first out" is the time until an analysis showed any output. Server RSS is
+sampled throughout each level. Stub timing and the app's limits can be tuned
+with --server-env, e.g. HAIR_STUB_LATENCY=lognormal:1,3 HAIR_MAX_ANALYSES=8.
+
+    python benchmarks/bench_gradio_load.py --users 1 4 16 32 --duration 60
+    python benchmarks/bench_gradio_load.py --url http://127.0.0.1:7860/ --pid 12345 --users 8
+
+To see the admission gate shed overflow (the "shed" column of analyze_images):
+
+    python benchmarks/bench_gradio_load.py --users 8 --duration 30 \
+        --server-env HAIR_MAX_ANALYSES=1 HAIR_ANALYSIS_WAITING=1 HAIR_STUB_LATENCY=fixed:1.5
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("analyze_images", "preview_report", "generate_report", "get_products")
+PATIENT = ("Jane Doe", "P1", "1990-01-01", "Female", "City Clinic", "Dr. Smith", "2024-01-01")
+# Replies the app gives instead of raising when it is out of capacity or fails
+SHED_MARKERS = ("at capacity", "while the service is busy")
+BUSY_MARKER = "You are number"
+ERROR_MARKERS = ("Error", "No analysis results")
+POLL_INTERVAL = 0.01
+
+
+@dataclass(frozen=True, slots=True)
+class Sample:
+    endpoint: str
+    latency: float
+    wait: float
+    first_output: Optional[float]
+    # "ok", "error" or "shed"
+    outcome: str
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid: Optional[int], interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[float] = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while self.pid and not self._stop_event.is_set():
+            value = rss_mb(self.pid)
+            if value is not None:
+                self.samples.append(value)
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> List[float]:
+        self._stop_event.set()
+        self.join()
+        return self.samples
+
+
+def make_photos(directory: str, count: int, megapixels: float) -> List[str]:
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    paths = []
+    for i in range(count):
+        noise = Image.effect_noise((width // 8, width * 3 // 32), 40 + i)
+        img = Image.merge("RGB", (noise, noise.point(lambda v: v * 3 // 4), noise.point(lambda v: v // 2)))
+        path = os.path.join(directory, f"photo_{i}.jpg")
+        img.resize((width, width * 3 // 4), Image.BICUBIC).save(path, quality=88)
+        paths.append(path)
+    return paths
+
+
+def classify(text: str) -> str:
+    if any(marker in text for marker in SHED_MARKERS):
+        return "shed"
+    if text.startswith(ERROR_MARKERS):
+        return "error"
+    return "ok"
+
+
+def first_text(output) -> str:
+    value = output[0] if isinstance(output, (list, tuple)) else output
+    return value if isinstance(value, str) else ""
+
+
+def run_job(client, endpoint: str, args, streaming: bool = False) -> Sample:
+    from gradio_client.utils import Status
+
+    finished: List[float] = []
+    submitted = datetime.now()
+    start = time.perf_counter()
+    job = client.submit(*args, api_name=f"/{endpoint}")
+    job.add_done_callback(lambda _: finished.append(time.perf_counter()))
+    queued = first_output = in_line = None
+    line_wait = 0.0
+    while not job.done():
+        now = time.perf_counter()
+        status = job.status()
+        if queued is None and status.code in (Status.PROCESSING, Status.ITERATING):
+            # Stamped when the client received it, so the poll interval does not count
+            queued = (status.time - submitted).total_seconds() if status.time else now - start
+        if streaming:
+            outputs = job.outputs()
+            if outputs and first_output is None:
+                first_output = now - start
+            # Analyses waiting for a slot stream their place in line until the first real output
+            busy = bool(outputs) and BUSY_MARKER in first_text(outputs[-1])
+            if busy and in_line is None:
+                in_line = now
+            elif outputs and not busy and in_line is not None and not line_wait:
+                line_wait = now - in_line
+        time.sleep(POLL_INTERVAL)
+    end = finished[0] if finished else time.perf_counter()
+    try:
+        outcome = classify(first_text(job.result()))
+    except Exception as e:
+        # Gradio rejects jobs outright when its queue is full
+        outcome = "shed" if "queue is full" in str(e).lower() else "error"
+    wait = (queued if queued is not None else end - start) + line_wait
+    return Sample(endpoint, end - start, wait, first_output, outcome)
+
+
+def virtual_user(url: str, photos: List[str], deadline: float, think: float, rng: random.Random,
+                 samples: List[Sample], lock: threading.Lock):
+    from gradio_client import Client, handle_file
+
+    def pause():
+        time.sleep(think * rng.uniform(0.5, 1.5))
+
+    client = Client(url, verbose=False, analytics_enabled=False, download_files=False, max_workers=2)
+    visit = 0
+    while time.perf_counter() < deadline:
+        images = [handle_file(path) for path in rng.sample(photos, rng.randint(1, 4))]
+        steps = [
+            ("analyze_images", PATIENT + tuple(images + [None] * (4 - len(images))), True),
+            ("preview_report", PATIENT, False),
+            ("generate_report", PATIENT, False),
+            ("get_products", ("Texture: wavy, dry ends", "Mid-range", ["Dryness", "Frizz"], visit % 2 == 0), False),
+        ]
+        for endpoint, args, streaming in steps:
+            sample = run_job(client, endpoint, args, streaming)
+            with lock:
+                samples.append(sample)
+            # A failed analysis leaves nothing to report on
+            if sample.outcome != "ok" and endpoint == "analyze_images":
+                break
+            pause()
+        visit += 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(samples: List[Sample], elapsed: float, rss: List[float]) -> Dict:
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        rows = [s for s in samples if s.endpoint == endpoint]
+        if not rows:
+            continue
+        ok = [s.latency for s in rows if s.outcome == "ok"]
+        waits = [s.wait for s in rows]
+        firsts = [s.first_output for s in rows if s.first_output is not None]
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "ok": len(ok),
+            "error_rate": sum(s.outcome == "error" for s in rows) / len(rows),
+            "shed_rate": sum(s.outcome == "shed" for s in rows) / len(rows),
+            "throughput": len(ok) / elapsed,
+            "p50": percentile(ok, 0.50), "p95": percentile(ok, 0.95), "p99": percentile(ok, 0.99),
+            "wait_p50": percentile(waits, 0.50), "wait_p95": percentile(waits, 0.95),
+            "first_output_p50": percentile(firsts, 0.50) if firsts else None,
+        }
+    return {"elapsed": elapsed, "endpoints": endpoints,
+            "rss_start_mb": rss[0] if rss else None, "rss_peak_mb": max(rss) if rss else None,
+            "rss_end_mb": rss[-1] if rss else None}
+
+
+def run_level(url: str, pid: Optional[int], users: int, duration: float, think: float, photos: List[str],
+              seed: int) -> Dict:
+    samples: List[Sample] = []
+    lock = threading.Lock()
+    sampler = RSSSampler(pid)
+    sampler.start()
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = [threading.Thread(target=virtual_user, daemon=True,
+                                args=(url, photos, deadline, think, random.Random(seed + n), samples, lock))
+               for n in range(users)]
+    for thread in threads:
+        thread.start()
+    # Visits in progress at the deadline are allowed to finish
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - start, sampler.stop())
+
+
+def start_server(port: int, server_env: List[str], workdir: str) -> subprocess.Popen:
+    # The app writes hair_reports/ into its working directory and caches under HAIR_CACHE_DIR; keep both in workdir
+    env = dict(os.environ, HAIR_LLM_BACKEND="stub", HAIR_CACHE_DIR=os.path.join(workdir, "cache"),
+               GRADIO_SERVER_PORT=str(port), GRADIO_ANALYTICS_ENABLED="False", PYTHONWARNINGS="ignore")
+    # Measure the app, not the Gemini quota
+    env.setdefault("HAIR_RATE_RPM", "0")
+    env.setdefault("HAIR_RATE_TPM", "0")
+    env.setdefault("HAIR_STUB_LATENCY", "lognormal:1.5,4")
+    for item in server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "V2", "appv2.py")], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_up(url: str, server: Optional[subprocess.Popen], timeout: float = 180):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"The app exited with status {server.returncode} before it was ready")
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"The app did not answer on {url} within {timeout:.0f}s")
+
+
+def print_level(users: int, summary: Dict):
+    rss = summary["rss_peak_mb"]
+    print(f"\n{users} users, {summary['elapsed']:.0f}s" + (f", server RSS {summary['rss_start_mb']:.0f} -> "
+                                                           f"peak {rss:.0f} MB" if rss else ""))
+    print(f"  {'endpoint':<16} {'reqs':>5} {'req/s':>6} {'err':>5} {'shed':>5} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'wait p50':>9} {'wait p95':>9} {'first out':>9}")
+    for endpoint, stats in summary["endpoints"].items():
+        first = stats["first_output_p50"]
+        print(f"  {endpoint:<16} {stats['requests']:>5} {stats['throughput']:>6.2f} {stats['error_rate']:>5.0%} "
+              f"{stats['shed_rate']:>5.0%} {stats['p50']:>6.2f}s {stats['p95']:>6.2f}s {stats['p99']:>6.2f}s "
+              f"{stats['wait_p50']:>8.2f}s {stats['wait_p95']:>8.2f}s "
+              f"{f'{first:.2f}s' if first is not None else '-':>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16], help="Concurrency levels to run")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds per level")
+    parser.add_argument("--think", type=float, default=1.0, help="Mean pause between a user's clicks")
+    parser.add_argument("--photos", type=int, default=16, help="Size of the photo pool users upload from")
+    parser.add_argument("--megapixels", type=float, default=3, help="Size of each photo")
+    parser.add_argument("--url", help="Load an already running app instead of starting one")
+    parser.add_argument("--pid", type=int, help="Process to sample RSS from when using --url")
+    parser.add_argument("--port", type=int, default=7870)
+    parser.add_argument("--server-env", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="Environment for the started app, e.g. HAIR_STUB_ERROR_RATE=0.05")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    server = server_dir = None
+    url, pid = args.url, args.pid
+    if url is None:
+        server_dir = tempfile.mkdtemp(prefix="hair_load_")
+        server = start_server(args.port, args.server_env, server_dir)
+        url, pid = f"http://127.0.0.1:{args.port}/", server.pid
+    results = {}
+    try:
+        wait_until_up(url, server)
+        with tempfile.TemporaryDirectory() as tmp:
+            photos = make_photos(tmp, args.photos, args.megapixels)
+            for users in args.users:
+                results[users] = run_level(url, pid, users, args.duration, args.think, photos, args.seed)
+                print_level(users, results[users])
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+            shutil.rmtree(server_dir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
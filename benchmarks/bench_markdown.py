@@ -0,0 +1,117 @@
+"""Benchmark Markdown-to-HTML conversion on large model responses.
+
+Compares the old per-line ``re.sub`` converter with the single-pass renderer,
+both on whole responses and fed in small streaming chunks, at several sizes
+to show the cost grows linearly. The "long line" column streams one
+paragraph with no newline of the same size, which must cost no more than
+the rest. The legacy converter handles only lists and bold, so it is a floor
+rather than a like-for-like figure; the renderer is slightly behind it on
+table-heavy text and ahead on plain paragraphs.
+
+    python benchmarks/bench_markdown.py --kilobytes 100 400 1600
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hair_analysis.markdown import MarkdownRenderer, markdown_to_html
+
+SECTION = """## {n}. Scalp Assessment
+**Hair type:** 2B waves with *fine* strand diameter and _moderate_ porosity.
+
+1. Crown density
+   - Miniaturised follicles in **{n} zones**
+   - Visible scalp under direct light
+2. Hairline
+   - Stable temporal points
+
+| Product Type | Brand/Name | Key Ingredients | Where to Buy | Price |
+|---|---|---|:---:|---:|
+| Shampoo | **Gentle Clarify** | Zinc pyrithione, `ketoconazole` | Pharmacy | $14 |
+| Serum | Density Boost | Minoxidil 5%, caffeine | Online | $32 |
+
+* Avoid heavy silicones
+* Limit heat styling to twice a week
+
+"""
+
+
+def legacy_convert(text: str) -> str:
+    # The converter both apps shipped before
+    lines = text.splitlines()
+    html_lines = []
+    in_list = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith(("* ", "- ")):
+            if not in_list:
+                html_lines.append("<ul>")
+                in_list = True
+            item = re.sub(r"\*\*(.*?)\*\*", r"<strong>\1</strong>", stripped[2:])
+            html_lines.append(f"<li>{item}</li>")
+        else:
+            if in_list:
+                html_lines.append("</ul>")
+                in_list = False
+            line = re.sub(r"\*\*(.*?)\*\*", r"<strong>\1</strong>", line)
+            if line.strip():
+                html_lines.append(f"<p>{line}</p>")
+    if in_list:
+        html_lines.append("</ul>")
+    return "\n".join(html_lines)
+
+
+def make_response(kilobytes: int) -> str:
+    parts, size, n = [], 0, 0
+    while size < kilobytes * 1024:
+        n += 1
+        section = SECTION.format(n=n)
+        parts.append(section)
+        size += len(section)
+    return "".join(parts)
+
+
+def streamed(text: str, chunk_size: int) -> str:
+    renderer = MarkdownRenderer()
+    out = []
+    for i in range(0, len(text), chunk_size):
+        out.append(renderer.feed(text[i:i + chunk_size]))
+    out.append(renderer.close())
+    return "\n".join(part for part in out if part)
+
+
+def best_of(repeat: int, fn, *args) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kilobytes", type=int, nargs="+", default=[100, 400, 1600])
+    parser.add_argument("--chunk-size", type=int, default=64, help="Characters per streamed chunk")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"best of {args.repeat}; streamed in {args.chunk_size}-char chunks")
+    print(f"{'size':>7} {'legacy':>9} {'single':>9} {'stream':>9} {'long line':>10} {'MB/s':>7}")
+    for kilobytes in args.kilobytes:
+        text = make_response(kilobytes)
+        line = " ".join(text.split())
+        assert streamed(text, args.chunk_size) == markdown_to_html(text)
+        legacy = best_of(args.repeat, legacy_convert, text)
+        single = best_of(args.repeat, markdown_to_html, text)
+        stream = best_of(args.repeat, streamed, text, args.chunk_size)
+        long_line = best_of(args.repeat, streamed, line, args.chunk_size)
+        print(f"{len(text) // 1024:>5}KB {legacy * 1e3:>7.1f}ms {single * 1e3:>7.1f}ms {stream * 1e3:>7.1f}ms "
+              f"{long_line * 1e3:>8.1f}ms {len(text) / single / 1e6:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
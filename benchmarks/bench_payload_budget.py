@@ -0,0 +1,68 @@
+"""Report payload bytes saved by the encoding policy versus fixed 1024 px / JPEG q90.
+
+Uses a mix of detailed close-up photos and smoother full-head photos, or your
+own files when paths are given.
+
+    python benchmarks/bench_payload_budget.py [--budget 1200000] [image ...]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import random
+
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hair_analysis.imaging import EncodingPolicy, payload_report
+
+
+def make_photos(tmp: str) -> list:
+    rng = random.Random(0)
+    size = (4000, 3000)
+    paths = []
+    for i in range(4):
+        noise = Image.effect_noise(size, 30)
+        photo = Image.merge("RGB", (noise, Image.linear_gradient("L").resize(size), noise))
+        draw = ImageDraw.Draw(photo)
+        if i % 2 == 0:
+            # Close-up: thousands of thin strands
+            for _ in range(3000):
+                x, y = rng.randrange(size[0]), rng.randrange(size[1])
+                draw.line((x, y, x + rng.randint(-200, 200), y + rng.randint(200, 800)),
+                          fill=(rng.randint(0, 90),) * 3, width=rng.randint(3, 6))
+        else:
+            # Full-head view: large smooth shapes
+            draw.ellipse((1000, 400, 3000, 2800), fill=(70, 50, 40))
+            photo = photo.filter(ImageFilter.GaussianBlur(8))
+        name = "closeup" if i % 2 == 0 else "head"
+        path = os.path.join(tmp, f"{name}_{i}.jpg")
+        photo.save(path, quality=92)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    # The apps keep the fixed encoding unless HAIR_PAYLOAD_BUDGET is set, so show a typical budget
+    parser.add_argument("--budget", type=int, default=int(os.getenv("HAIR_PAYLOAD_BUDGET") or 1200000),
+                        help="Total base64 bytes per request")
+    parser.add_argument("images", nargs="*")
+    args = parser.parse_args(argv)
+    policy = EncodingPolicy(budget_bytes=args.budget)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = args.images or make_photos(tmp)
+        print(f"budget {policy.budget_bytes:,} base64 bytes per request, formats {policy.formats}")
+        for count in range(1, len(paths) + 1):
+            report = payload_report(paths[:count], policy)
+            print(f"\n{count} image(s): {report['legacy_bytes']:,} -> {report['bytes']:,} bytes "
+                  f"(saved {report['saved_bytes']:,})")
+            for image in report["images"]:
+                print(f"  {image['filename']:<14} {image['view']:<9} {image['format']:<5} q{image['quality']:<3} "
+                      f"{image['size'][0]}x{image['size'][1]:<5} {image['legacy_bytes']:>9,} -> {image['bytes']:>9,}")
+
+
+if __name__ == "__main__":
+    main()
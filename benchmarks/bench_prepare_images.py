@@ -0,0 +1,69 @@
+"""Benchmark serial vs parallel image preparation on 1 to 4 large photos.
+
+The prepared-payload cache is bypassed (and pointed at a temporary directory),
+so every pass decodes and encodes the photos again.
+
+    python benchmarks/bench_prepare_images.py --megapixels 24 --repeat 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hair_analysis.imaging import prepare_image, prepare_images
+
+
+def make_photo(path: str, megapixels: float, seed: int):
+    # Noise + gradient so the JPEG encoder does real work, like a phone photo
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    noise = Image.effect_noise((width, height), 40 + seed)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    Image.merge("RGB", (noise, gradient, noise.transpose(Image.FLIP_LEFT_RIGHT))).save(path, quality=92)
+
+
+def best_of(repeat: int, fn, *args, **kwargs) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["HAIR_CACHE_DIR"] = os.path.join(tmp, "cache")
+        paths = []
+        for i in range(4):
+            path = os.path.join(tmp, f"photo_{i}.jpg")
+            make_photo(path, args.megapixels, i)
+            paths.append(path)
+
+        # Warm up the pools so start-up cost is not counted
+        prepare_images(paths[:2], max_workers=2, executor="thread", use_cache=False)
+        prepare_images(paths[:2], max_workers=2, executor="process", use_cache=False)
+
+        print(f"{args.megapixels:g} MP photos, best of {args.repeat}")
+        print(f"{'images':>6} {'serial':>9} {'threads':>9} {'processes':>10} {'speedup':>8}")
+        for count in range(1, 5):
+            batch = paths[:count]
+            serial = best_of(args.repeat, lambda: [prepare_image(p, use_cache=False) for p in batch])
+            threads = best_of(args.repeat, prepare_images, batch, args.workers, "thread", use_cache=False)
+            processes = best_of(args.repeat, prepare_images, batch, args.workers, "process", use_cache=False)
+            print(f"{count:>6} {serial:>8.3f}s {threads:>8.3f}s {processes:>9.3f}s "
+                  f"{serial / min(threads, processes):>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Throughput against a quota-enforcing fake model, with and without the limiter.
+
+The fake API accepts --rpm requests per rolling minute (scaled down by
+--speedup so the run takes seconds) and raises a 429-style error beyond
+that, like Gemini. Unthrottled workers lose every rejected call; the limiter
+paces them at the quota and retries the few that still bounce.
+
+    python benchmarks/bench_rate_limit.py --workers 16 --calls 20 --rpm 60 --speedup 20
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hair_analysis.ratelimit import RateLimiter
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class QuotaAPI:
+    def __init__(self, per_window: int, window: float, latency: float):
+        self.per_window = per_window
+        self.window = window
+        self.latency = latency
+        self.accepted = deque()
+        self.lock = threading.Lock()
+
+    def call(self) -> str:
+        now = time.monotonic()
+        with self.lock:
+            while self.accepted and now - self.accepted[0] > self.window:
+                self.accepted.popleft()
+            if len(self.accepted) >= self.per_window:
+                raise ResourceExhausted("429 Resource has been exhausted (e.g. check quota).")
+            self.accepted.append(now)
+        time.sleep(self.latency)
+        return "analysis"
+
+
+def run(workers: int, calls: int, api: QuotaAPI, limiter) -> dict:
+    done, lost = [0], [0]
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(calls):
+            try:
+                if limiter is None:
+                    api.call()
+                else:
+                    limiter.call(api.call, tokens=1)
+                with lock:
+                    done[0] += 1
+            except ResourceExhausted:
+                with lock:
+                    lost[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(workers):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - start
+    return {"done": done[0], "lost": lost[0], "elapsed": elapsed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--calls", type=int, default=20, help="Calls per worker")
+    parser.add_argument("--rpm", type=int, default=60)
+    parser.add_argument("--speedup", type=float, default=20, help="Compress a minute into 60/speedup seconds")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per successful call")
+    args = parser.parse_args(argv)
+
+    window = 60 / args.speedup
+    quota_rate = args.rpm / window
+    print(f"{args.workers} workers x {args.calls} calls, quota {quota_rate:.1f} calls/s")
+    print(f"{'mode':<12} {'done':>6} {'lost':>6} {'elapsed':>9} {'calls/s':>8}")
+    for mode in ("unthrottled", "limiter"):
+        api = QuotaAPI(args.rpm, window, args.latency)
+        limiter = None
+        if mode == "limiter":
+            # Same quota expressed per real minute; a small burst keeps the rolling window happy
+            limiter = RateLimiter(rpm=args.rpm * args.speedup, tpm=0, base_delay=window / 10,
+                                  max_delay=window, max_retries=8, burst=max(1, args.rpm // 4))
+        result = run(args.workers, args.calls, api, limiter)
+        print(f"{mode:<12} {result['done']:>6} {result['lost']:>6} {result['elapsed']:>8.2f}s "
+              f"{result['done'] / result['elapsed']:>8.1f}")
+        if limiter is not None:
+            metrics = limiter.metrics()
+            print(f"  limiter: {metrics['retries']} retries, max queue depth {metrics['max_queue_depth']}, "
+                  f"p95 wait {metrics['p95_wait']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
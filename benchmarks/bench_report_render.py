@@ -0,0 +1,81 @@
+"""Measure HTML report render time against the cost of writing it to disk.
+
+Compares the old per-call f-string report with the precompiled shared
+template, inline and with an external stylesheet.
+
+    python benchmarks/bench_report_render.py --reports 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hair_analysis.report import render_report, stylesheet
+
+PATIENT = dict(patient_name="Jane Doe", patient_id="P-0042", dob="1987-04-12", gender="Female",
+               hospital_name="Riverside Dermatology", doctor_name="Dr. Smith", analysis_date="2026-10-17",
+               report_id="HA1234-20261017")
+
+
+def sample_section(paragraphs: int) -> str:
+    parts = []
+    for i in range(paragraphs):
+        parts.append(f"<p><strong>Finding {i}:</strong> moderate thinning at the crown with miniaturised follicles.</p>")
+        parts.append("<ul>\n<li>Density: reduced</li>\n<li>Scalp: mild erythema</li>\n</ul>")
+    return "\n".join(parts)
+
+
+def legacy_render(analysis_html: str, advice_html: str, **fields) -> str:
+    # Stand-in for the old per-call f-string: rebuilds the whole document,
+    # stylesheet included, on every call
+    css = stylesheet().replace("{", "{{").replace("}", "}}")
+    template = ("<!DOCTYPE html><html><head><title>Hair Analysis Report - {patient_name}</title><style>" + css +
+                "</style></head><body><div class=\"page\"><div class=\"hospital-name\">{hospital_name}</div>"
+                "<span>{patient_id}</span><span>{dob}</span><span>{gender}</span><span>{doctor_name}</span>"
+                "<span>{report_id}</span><span>{analysis_date}</span>{analysis_html}{advice_html}</div></body></html>")
+    return template.format(analysis_html=analysis_html, advice_html=advice_html, **fields)
+
+
+def time_per_call(count: int, fn) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=2000)
+    parser.add_argument("--paragraphs", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    analysis_html = sample_section(args.paragraphs)
+    advice_html = sample_section(args.paragraphs // 2)
+    render_report(analysis_html, advice_html, **PATIENT)  # compile the template
+
+    strategies = {
+        "f-string": lambda: legacy_render(analysis_html, advice_html, **PATIENT),
+        "template": lambda: render_report(analysis_html, advice_html, **PATIENT),
+        "external": lambda: render_report(analysis_html, advice_html, stylesheet_mode="external", **PATIENT),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{args.reports} reports, {args.paragraphs} findings each")
+        print(f"{'strategy':<10} {'render':>10} {'write':>10} {'size':>9}")
+        for name, fn in strategies.items():
+            render = time_per_call(args.reports, fn)
+            content = fn()
+            counter = iter(range(args.reports))
+
+            def write():
+                with open(os.path.join(tmp, f"{name}_{next(counter)}.html"), "w", encoding="utf-8") as f:
+                    f.write(content)
+
+            write_time = time_per_call(args.reports, write)
+            print(f"{name:<10} {render * 1e6:>8.1f}us {write_time * 1e6:>8.1f}us {len(content) / 1024:>7.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
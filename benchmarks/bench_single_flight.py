@@ -0,0 +1,67 @@
+"""Upstream model calls for bursts of identical analysis requests.
+
+Simulates users double-clicking "Analyze Hair" or opening the same photos in
+several tabs: --clients concurrent sessions stream the same image prompt
+through SessionMemoryStore backed by a slow fake model, with single-flight
+sharing on and off. Reports how many model calls were made and how long the
+burst took.
+
+    python benchmarks/bench_single_flight.py --clients 2 4 8 --megabytes 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from hair_analysis.memory import SessionMemoryStore
+from hair_analysis.ratelimit import RateLimiter
+from hair_analysis.singleflight import SingleFlight
+
+RESPONSE = "## Findings\n- Wavy texture, medium density\n- Mild dryness at the ends\n"
+
+
+class CountingModel(FakeListChatModel):
+    async def _astream(self, *args, **kwargs):
+        self.calls[0] += 1
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+
+async def burst(clients: int, megabytes: float, shared: bool, latency: float):
+    model = CountingModel(responses=[RESPONSE], sleep=latency / len(RESPONSE))
+    object.__setattr__(model, "calls", [0])
+    store = SessionMemoryStore(model, limiter=RateLimiter(rpm=0, tpm=0), flights=SingleFlight(enabled=shared))
+    image = "data:image/jpeg;base64," + "A" * int(megabytes * 1024 * 1024)
+    message = [{"type": "text", "text": "Analyze this hair image. Image Details: ['crown.jpg']"},
+               {"type": "image_url", "image_url": {"url": image}}]
+
+    async def client(n: int) -> str:
+        return "".join([chunk async for chunk in store.astream(f"session-{n}", message)])
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client(n) for n in range(clients)))
+    elapsed = time.perf_counter() - start
+    assert all(result == RESPONSE for result in results)
+    return model.calls[0], elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--megabytes", type=float, default=2, help="Size of the image payload")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds the fake model takes per response")
+    args = parser.parse_args(argv)
+
+    print(f"{'clients':>7} {'mode':<13} {'model calls':>11} {'elapsed':>9}")
+    for clients in args.clients:
+        for shared in (False, True):
+            calls, elapsed = asyncio.run(burst(clients, args.megabytes, shared, args.latency))
+            print(f"{clients:>7} {'single-flight' if shared else 'separate':<13} {calls:>11} {elapsed:>8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Startup time of the entry points and shared modules.
+
+Each target is imported in a fresh interpreter (--repeat times, median
+reported) together with the list of heavy packages it pulled in. The
+"deferred" row is what the first analysis pays instead: LangChain, the
+Gemini client and the conversation chain. With a display available the Tk
+row times until the main window has been drawn.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("PIL.Image", "tkinter", "gradio", "langchain_core", "langchain", "langchain_google_genai")
+
+TARGETS = {
+    "report": "import hair_analysis.report",
+    "memory": "import hair_analysis.memory",
+    "engine": "import hair_analysis.engine",
+    "tk_app": "import app",
+    "gradio_app": "import appv2",
+    "deferred": "import langchain.chains, langchain.memory, langchain_google_genai",
+}
+TK_WINDOW = """
+import tkinter as tk
+import app
+root = tk.Tk()
+app.ProfessionalHairAnalysisSystem(root)
+root.update()
+"""
+
+PROBE = """
+import sys, time, warnings
+warnings.filterwarnings("ignore")
+start = time.perf_counter()
+exec(compile({code!r}, "<target>", "exec"))
+elapsed = time.perf_counter() - start
+print(elapsed, ",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def measure(code: str, repeat: int):
+    # Apps open their caches at import; keep them out of ~/.cache
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, "V2")]),
+               HAIR_CACHE_DIR=tempfile.mkdtemp())
+    times, loaded = [], ""
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", PROBE.format(code=code, heavy=HEAVY)], cwd=ROOT, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        elapsed, _, loaded = result.stdout.strip().splitlines()[-1].partition(" ")
+        times.append(float(elapsed))
+    return statistics.median(times), loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS))
+    args = parser.parse_args(argv)
+
+    targets = {name: TARGETS[name] for name in args.targets}
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        targets["tk_window"] = TK_WINDOW
+    print(f"{'target':<12} {'median':>9}  heavy modules loaded")
+    for name, code in targets.items():
+        elapsed, loaded = measure(code, args.repeat)
+        if elapsed is None:
+            print(f"{name:<12} {'failed':>9}  {loaded}")
+        else:
+            print(f"{name:<12} {elapsed * 1e3:>7.0f}ms  {loaded or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Micro-benchmark suite for the image, text and report hot paths, with stored baselines.
+
+Cases:
+
+- ``prepare_image/<format>-<size>``: JPEG, PNG and WebP photos at 0.3, 3 and
+  12 megapixels, bypassing the prepared-image cache
+- ``convert_to_html/small|large``: one canned analysis and a 128 KB response
+- ``report/generate_html_report`` and ``report/generate_html_report_large``
+  (V2 app) and ``report/save_analysis_report`` (Tk app, rendered and written)
+- ``analyze_images/1-image|4-images``: the Gradio handler end to end against
+  the stub backend with no simulated latency, new photos on every run so the
+  caches are cold
+
+Each case runs in a fresh interpreter: one warm-up run, then --repeat timed
+runs (best and median reported), and the peak RSS growth over the process's
+footprint before the first run. Results are compared with the baseline file:
+a case whose best run is slower by more than --time-tolerance (default 25%),
+or whose peak is bigger by more than --memory-tolerance (default 20%, and
+never less than 2 MB), is flagged and the exit status is 1.
+
+benchmarks/baseline.json is a reference recorded on a 1-CPU Linux x86-64
+machine with Python 3.11 (its ``machine``, ``cpus`` and ``python`` fields say
+so). Timings only compare within the tolerances on similar hardware, so on
+other machines keep a local baseline and pass it with --baseline. CI records
+one from the target branch on the same runner before timing the change.
+Short cases on a busy machine can miss by more than 25% once; re-run a
+flagged case with --cases before treating it as a regression.
+
+    git checkout main && python benchmarks/bench_suite.py --save --baseline /tmp/base.json
+    git checkout - && python benchmarks/bench_suite.py --baseline /tmp/base.json
+    python benchmarks/bench_suite.py --cases 'prepare_image/*' --repeat 7
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+IMAGE_FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+IMAGE_SIZES = (0.3, 3, 12)
+LARGE_TEXT_BYTES = 128 * 1024
+# RSS moves in pages and allocator arenas; smaller growth is noise
+MEMORY_FLOOR_MB = 2.0
+
+CASES = {}
+
+
+def proc_status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise OSError(f"{field} not in /proc/self/status")
+
+
+def reset_peak() -> bool:
+    # Linux keeps ru_maxrss across exec, so the parent's footprint would leak into it; clear_refs
+    # resets this process's own high-water mark (VmHWM) instead
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    try:
+        return proc_status_mb("VmHWM")
+    except OSError:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def current_rss_mb() -> float:
+    try:
+        return proc_status_mb("VmRSS")
+    except OSError:
+        return peak_rss_mb()
+
+
+def case(name: str, number: int = 1, images=lambda repeat: ()):
+    """Register a benchmark. ``images(repeat)`` lists the (format, megapixels, variant)
+    photos it needs; they are made up front so their decode is not measured.
+    The decorated setup returns ``run(i)``, which is timed ``number`` times per run."""
+    def register(setup):
+        CASES[name] = (setup, number, images)
+        return setup
+    return register
+
+
+def image_path(fixtures: str, fmt: str, megapixels: float, variant: int = 0) -> str:
+    return os.path.join(fixtures, f"{fmt}-{megapixels:g}mp-{variant}.{fmt}")
+
+
+def make_image(path: str, fmt: str, megapixels: float, variant: int):
+    # Smooth, photo-like texture: noise at 1/8 scale blown up, so PNG sizes stay realistic
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    noise = Image.effect_noise((max(1, width // 8), max(1, height // 8)), 60 + variant)
+    img = Image.merge("RGB", (noise, noise.point(lambda v: v * 3 // 4), noise.point(lambda v: v // 2)))
+    img.resize((width, height), Image.BICUBIC).save(path, IMAGE_FORMATS[fmt], quality=90)
+
+
+def sample_texts():
+    from hair_analysis.stub_model import load_responses
+
+    responses = load_responses()
+    profile = responses["profiles"][0]
+    small = profile["analysis"]
+    large, parts = [], [p[key] for p in responses["profiles"] for key in ("analysis", "plan")]
+    while sum(map(len, large)) < LARGE_TEXT_BYTES:
+        large.extend(parts)
+    return small, profile["plan"], "\n\n".join(large)
+
+
+def prepare_case(fmt: str, size: float):
+    def setup(fixtures, repeat):
+        from hair_analysis.imaging import prepare_image
+        path = image_path(fixtures, fmt, size)
+        return lambda i: prepare_image(path, use_cache=False)
+    case(f"prepare_image/{fmt}-{size:g}mp", images=lambda repeat: [(fmt, size, 0)])(setup)
+
+
+for fmt in IMAGE_FORMATS:
+    for size in IMAGE_SIZES:
+        prepare_case(fmt, size)
+
+
+@case("convert_to_html/small", number=200)
+def convert_small(fixtures, repeat):
+    from hair_analysis.engine import HairAnalysisEngine
+    text = sample_texts()[0]
+    engine = HairAnalysisEngine()
+    return lambda i: engine.convert_to_html(text)
+
+
+@case("convert_to_html/large", number=5)
+def convert_large(fixtures, repeat):
+    from hair_analysis.engine import HairAnalysisEngine
+    text = sample_texts()[2]
+    engine = HairAnalysisEngine()
+    return lambda i: engine.convert_to_html(text)
+
+
+def _v2_report(large: bool):
+    import appv2
+    analysis, advice, large_text = sample_texts()
+    system = appv2.ProfessionalHairAnalysisSystem()
+    system.analysis_results = large_text if large else analysis
+    system.advice_results = advice
+    return lambda i: system.generate_html_report("Jane Doe", f"P{i}", "1990-01-01", "Female",
+                                                 "City Clinic", "Dr. Smith", "2024-01-01")
+
+
+@case("report/generate_html_report", number=50)
+def report_small(fixtures, repeat):
+    return _v2_report(large=False)
+
+
+@case("report/generate_html_report_large", number=2)
+def report_large(fixtures, repeat):
+    return _v2_report(large=True)
+
+
+@case("report/save_analysis_report", number=20)
+def report_save(fixtures, repeat):
+    import app
+    analysis, advice, _ = sample_texts()
+    # The method only needs the engine, not a Tk window
+    system = app.ProfessionalHairAnalysisSystem.__new__(app.ProfessionalHairAnalysisSystem)
+    output = os.path.join(tempfile.mkdtemp(), "report.html")
+    return lambda i: system.save_analysis_report(analysis, advice, output, "Jane Doe", f"P{i}", "1990-01-01",
+                                                 "Female", "City Clinic", "Dr. Smith", "2024-01-01")
+
+
+def _analyze_setup(fixtures, repeat, count: int):
+    import asyncio
+
+    import appv2
+
+    async def analyze(paths):
+        outputs = [out async for out in appv2.analyze_images(
+            None, "Jane Doe", "P1", "1990-01-01", "Female", "City Clinic", "Dr. Smith", "2024-01-01",
+            *(paths + [None] * (4 - len(paths))))]
+        if outputs[-1][0].startswith("Error"):
+            raise RuntimeError(outputs[-1][0])
+
+    def run(i):
+        asyncio.run(analyze([image_path(fixtures, "jpeg", 3, i * count + n) for n in range(count)]))
+    return run
+
+
+@case("analyze_images/1-image", images=lambda repeat: [("jpeg", 3, v) for v in range(repeat + 1)])
+def analyze_one(fixtures, repeat):
+    return _analyze_setup(fixtures, repeat, 1)
+
+
+@case("analyze_images/4-images", images=lambda repeat: [("jpeg", 3, v) for v in range(4 * (repeat + 1))])
+def analyze_four(fixtures, repeat):
+    return _analyze_setup(fixtures, repeat, 4)
+
+
+def child(name: str, fixtures: str, repeat: int):
+    setup, number, _ = CASES[name]
+    run = setup(fixtures, repeat)
+    reset_peak()
+    baseline = current_rss_mb()
+    times = []
+    # Run 0 warms up imports, chains and template caches
+    for i in range(repeat + 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run(i)
+        times.append((time.perf_counter() - start) / number)
+    print(json.dumps({"best_seconds": min(times[1:]), "median_seconds": statistics.median(times[1:]),
+                      "peak_mb": max(0.0, peak_rss_mb() - baseline)}))
+
+
+def measure(name: str, fixtures: str, repeat: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, "V2")]),
+               PYTHONWARNINGS="ignore", HAIR_CACHE_DIR=tempfile.mkdtemp(), HAIR_LLM_BACKEND="stub",
+               HAIR_STUB_LATENCY="fixed:0", HAIR_STUB_CHUNK_RATE="0", HAIR_STUB_ERROR_RATE="0",
+               HAIR_RATE_RPM="0", HAIR_RATE_TPM="0")
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name, fixtures, str(repeat)],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": (result.stderr.strip().splitlines() or ["exit status %d" % result.returncode])[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(result: dict, base: dict, time_tolerance: float, memory_tolerance: float) -> str:
+    if "error" in result:
+        return "FAILED"
+    if not base:
+        return "new"
+    flags = []
+    # Best-of-N is compared: scheduler noise only ever adds time, so it is the steadier figure
+    if result["best_seconds"] > base["best_seconds"] * (1 + time_tolerance):
+        flags.append("time")
+    if result["peak_mb"] - base["peak_mb"] > max(MEMORY_FLOOR_MB, base["peak_mb"] * memory_tolerance):
+        flags.append("memory")
+    return f"REGRESSION ({', '.join(flags)})" if flags else "ok"
+
+
+def change(now: float, then: float) -> str:
+    return f"{(now - then) / then * 100:+.0f}%" if then else "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", nargs="+", default=["*"], help="Case names or glob patterns")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case, after one warm-up")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file to compare with")
+    parser.add_argument("--save", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--time-tolerance", type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--memory-tolerance", type=float, default=0.20, help="Allowed peak memory growth")
+    parser.add_argument("--list", action="store_true", help="List the cases and exit")
+    parser.add_argument("--child", nargs=3, metavar=("CASE", "FIXTURES", "REPEAT"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child[0], args.child[1], int(args.child[2]))
+        return 0
+    names = [name for name in CASES if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)]
+    if args.list or not names:
+        print("\n".join(CASES) if args.list else f"No cases match {args.cases}")
+        return 0 if args.list else 2
+
+    baseline = {"cases": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if (baseline.get("machine"), baseline.get("cpus")) != (platform.node(), os.cpu_count()):
+            print(f"note: baseline was recorded on {baseline.get('machine')} with {baseline.get('cpus')} CPUs, "
+                  f"not this machine; pass --baseline with a local one to compare timings")
+
+    results, regressed = {}, False
+    print(f"{'case':<36} {'best':>10} {'baseline':>10} {'change':>7} {'median':>10} {'peak MB':>8} "
+          f"{'baseline':>8} {'change':>7}  status")
+    with tempfile.TemporaryDirectory() as fixtures:
+        for name in names:
+            for fmt, size, variant in CASES[name][2](args.repeat):
+                path = image_path(fixtures, fmt, size, variant)
+                if not os.path.exists(path):
+                    make_image(path, fmt, size, variant)
+            result = results[name] = measure(name, fixtures, args.repeat)
+            base = baseline["cases"].get(name, {})
+            status = compare(result, base, args.time_tolerance, args.memory_tolerance)
+            regressed |= status.startswith(("REGRESSION", "FAILED"))
+            if "error" in result:
+                print(f"{name:<36} {'failed':>10}  {result['error']}")
+                continue
+            best, base_best = result["best_seconds"], base.get("best_seconds", 0)
+            print(f"{name:<36} {best * 1e3:>8.2f}ms {base_best * 1e3:>8.2f}ms {change(best, base_best):>7} "
+                  f"{result['median_seconds'] * 1e3:>8.2f}ms {result['peak_mb']:>8.1f} {base.get('peak_mb', 0):>8.1f} "
+                  f"{change(result['peak_mb'], base.get('peak_mb', 0)):>7}  {status}")
+
+    if args.save:
+        baseline["cases"].update({name: result for name, result in results.items() if "error" not in result})
+        baseline.update(machine=platform.node(), cpus=os.cpu_count(), python=platform.python_version(),
+                        recorded=time.strftime("%Y-%m-%d %H:%M:%S"))
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
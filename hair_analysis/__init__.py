@@ -0,0 +1 @@
+"""Shared building blocks for the Tkinter (app.py) and Gradio (V2/appv2.py) apps."""
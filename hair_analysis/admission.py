@@ -0,0 +1,102 @@
+"""Admission control for long-running UI requests.
+
+An AdmissionGate lets ``limit`` requests run at once and queues up to
+``max_waiting`` more in arrival order. Queued requests hold a Ticket that
+reports their current position, so a handler can tell the user "busy, you are
+number N in line" while it waits. Requests beyond the waiting room are
+turned away at once with GateFull instead of piling up until everyone times
+out.
+
+Gates are meant for coroutines on a single event loop (the Gradio app).
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class GateFull(RuntimeError):
+    """The gate is running at its limit and its waiting room is full."""
+
+
+class Ticket:
+    def __init__(self, gate: "AdmissionGate", future: Optional[asyncio.Future]):
+        self.gate = gate
+        # None when admitted straight away; resolved when a running request hands over its slot
+        self._future = future
+        self._closed = False
+
+    @property
+    def admitted(self) -> bool:
+        return self._future is None or self._future.done()
+
+    @property
+    def position(self) -> int:
+        """1-based place in the waiting line, 0 once admitted."""
+        return 0 if self.admitted else self.gate._queue.index(self) + 1
+
+    async def moved(self):
+        """Wait until this ticket is admitted or the line moves."""
+        if not self.admitted:
+            await asyncio.wait({self._future, self.gate._moved()}, return_when=asyncio.FIRST_COMPLETED)
+
+    def close(self):
+        """Give the slot back, or leave the line if still waiting. Safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+        if self.admitted:
+            self.gate._release()
+        else:
+            self.gate._queue.remove(self)
+            self.gate._signal()
+
+
+class AdmissionGate:
+    def __init__(self, name: str, limit: int, max_waiting: int = 0):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_waiting = max(0, max_waiting)
+        self.active = 0
+        self._queue: Deque[Ticket] = deque()
+        self._move: Optional[asyncio.Future] = None
+        self._counters = {"admitted": 0, "queued": 0, "shed": 0, "max_waiting_seen": 0}
+
+    def admit(self) -> Ticket:
+        """Take a slot or a place in line; raises GateFull when both are taken.
+
+        Always close the returned ticket, typically in a ``finally`` block.
+        """
+        if self.active < self.limit and not self._queue:
+            self.active += 1
+            self._counters["admitted"] += 1
+            return Ticket(self, None)
+        if len(self._queue) >= self.max_waiting:
+            self._counters["shed"] += 1
+            raise GateFull(f"{self.name} is at capacity ({self.limit} running, {len(self._queue)} waiting)")
+        ticket = Ticket(self, asyncio.get_running_loop().create_future())
+        self._queue.append(ticket)
+        self._counters["queued"] += 1
+        self._counters["max_waiting_seen"] = max(self._counters["max_waiting_seen"], len(self._queue))
+        return ticket
+
+    def _release(self):
+        if self._queue:
+            # Hand the slot straight to the next in line, so late arrivals cannot jump it
+            self._queue.popleft()._future.set_result(None)
+            self._counters["admitted"] += 1
+        else:
+            self.active -= 1
+        self._signal()
+
+    def _moved(self) -> asyncio.Future:
+        if self._move is None or self._move.done():
+            self._move = asyncio.get_running_loop().create_future()
+        return self._move
+
+    def _signal(self):
+        if self._move is not None and not self._move.done():
+            self._move.set_result(None)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._counters, active=self.active, waiting=len(self._queue),
+                    limit=self.limit, max_waiting=self.max_waiting)
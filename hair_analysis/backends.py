@@ -0,0 +1,65 @@
+"""Chat model backends, chosen by configuration.
+
+HAIR_LLM_BACKEND picks the model every session talks to:
+
+- ``gemini`` (default): Google's Gemini through langchain_google_genai
+- ``stub``: StubChatModel (see stub_model), canned replies with simulated
+  latency, streaming rate and errors, for load tests and offline runs
+
+Each backend names the model it serves, which goes into analysis cache keys so
+stub replies are never served in place of real analyses. Other backends can be
+added with ``register_backend``. Nothing here imports LangChain; a backend's
+client is imported when its model is first built.
+"""
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+GEMINI_MODEL = "gemini-2.0-flash"
+DEFAULT_BACKEND = "gemini"
+
+
+@dataclass(frozen=True, slots=True)
+class Backend:
+    name: str
+    # Model identifier, used in cache keys
+    model: str
+    factory: Callable[[], Any]
+
+    def build(self):
+        return self.factory()
+
+
+def _gemini():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    # The RateLimiter is the only retry layer (see ratelimit); the client's own retries would multiply it
+    return ChatGoogleGenerativeAI(model=GEMINI_MODEL, google_api_key=os.getenv("GEMINI_API_KEY"), max_retries=0)
+
+
+def _stub():
+    from hair_analysis.stub_model import StubChatModel
+    return StubChatModel.from_env()
+
+
+_backends: Dict[str, Backend] = {
+    "gemini": Backend("gemini", GEMINI_MODEL, _gemini),
+    "stub": Backend("stub", "hair-stub", _stub),
+}
+
+
+def register_backend(name: str, model: str, factory: Callable[[], Any]):
+    """Make ``factory`` selectable as HAIR_LLM_BACKEND=<name>."""
+    _backends[name.lower()] = Backend(name.lower(), model, factory)
+
+
+def get_backend(name: Optional[str] = None) -> Backend:
+    name = (name or os.getenv("HAIR_LLM_BACKEND", DEFAULT_BACKEND)).lower()
+    try:
+        return _backends[name]
+    except KeyError:
+        raise ValueError(f"Unknown LLM backend '{name}', expected one of {tuple(_backends)}") from None
+
+
+def build_model(name: Optional[str] = None):
+    """The chat model of the configured backend."""
+    return get_backend(name).build()
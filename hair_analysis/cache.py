@@ -0,0 +1,290 @@
+"""Content-addressed caches for model analysis results and prepared images.
+
+AnalysisCache: results are keyed by the SHA-256 of the prepared (normalized) image bytes
+plus the prompt version and model name, so re-running an analysis on the same
+photos never pays for another model round trip. There are two tiers:
+
+- an in-memory LRU (``memory_entries`` results)
+- a SQLite file shared by every app on the machine, trimmed by age
+  (``max_age`` seconds) and total size (``max_bytes``)
+
+PreparedImageCache: encoded image payloads, so an unchanged photo is never
+decoded, resized and re-encoded twice. Files are recognised by
+(path, size, mtime) and, failing that (e.g. a fresh Gradio upload of the same
+photo), by the SHA-256 of their bytes. Both tiers are bounded by total bytes
+with LRU eviction.
+
+The files live in HAIR_CACHE_DIR (default ~/.cache/hair_analysis).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hair_analysis")
+
+
+def image_digest(data: str) -> str:
+    """SHA-256 of a prepared image's base64 payload."""
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    def __init__(self, path: Optional[str] = None, memory_entries: int = 128,
+                 max_bytes: int = 64 * 1024 * 1024, max_age: float = 30 * 24 * 3600):
+        if path is None:
+            cache_dir = os.getenv("HAIR_CACHE_DIR", DEFAULT_CACHE_DIR)
+            path = os.path.join(cache_dir, "analysis_cache.sqlite3")
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS analysis_cache (
+                   key TEXT PRIMARY KEY,
+                   value TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   created REAL NOT NULL,
+                   accessed REAL NOT NULL
+               )"""
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(image_digests: Iterable[str], prompt_version: str, model_name: str) -> str:
+        parts = [str(prompt_version), model_name, *image_digests]
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return value
+
+            now = time.time()
+            row = self._db.execute(
+                "SELECT value FROM analysis_cache WHERE key = ? AND created >= ?", (key, now - self.max_age)
+            ).fetchone()
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            self._db.execute("UPDATE analysis_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._counters["disk_hits"] += 1
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value)
+            self._db.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._counters["writes"] += 1
+            self._evict(now)
+            self._db.commit()
+
+    def _remember(self, key: str, value: str):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        removed = self._db.execute("DELETE FROM analysis_cache WHERE created < ?", (now - self.max_age,)).rowcount
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
+        if total > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM analysis_cache ORDER BY accessed").fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                total -= size
+                removed += 1
+        self._counters["evictions"] += removed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM analysis_cache")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+        return stats
+
+
+class PreparedImageCache:
+    def __init__(self, path: Optional[str] = None, memory_bytes: int = 64 * 1024 * 1024,
+                 max_bytes: int = 512 * 1024 * 1024, max_aliases: int = 10000):
+        if path is None:
+            cache_dir = os.getenv("HAIR_CACHE_DIR", DEFAULT_CACHE_DIR)
+            path = os.path.join(cache_dir, "prepared_images.sqlite3")
+        self.path = path
+        self.memory_bytes = memory_bytes
+        self.max_bytes = max_bytes
+        self.max_aliases = max_aliases
+
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._memory_size = 0
+        # (path, size, mtime) -> content key, LRU-bounded by max_aliases like the table
+        self._aliases: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "identity_hits": 0, "content_hashes": 0, "evictions": 0}
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS prepared_images (
+                   key TEXT PRIMARY KEY,
+                   value TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   accessed REAL NOT NULL
+               )"""
+        )
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS image_aliases (
+                   identity TEXT PRIMARY KEY,
+                   content_key TEXT NOT NULL,
+                   accessed REAL NOT NULL
+               )"""
+        )
+        self._db.commit()
+
+    def content_key(self, image_path: str) -> str:
+        """SHA-256 of the file's bytes, skipping the read when (path, size, mtime) is known."""
+        stat = os.stat(image_path)
+        identity = f"{os.path.abspath(image_path)}\x00{stat.st_size}\x00{stat.st_mtime_ns}"
+        with self._lock:
+            content_key = self._aliases.get(identity)
+            if content_key is None:
+                row = self._db.execute(
+                    "SELECT content_key FROM image_aliases WHERE identity = ?", (identity,)
+                ).fetchone()
+                content_key = row[0] if row else None
+            if content_key is not None:
+                self._remember_alias(identity, content_key)
+                self._counters["identity_hits"] += 1
+                return content_key
+
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        content_key = digest.hexdigest()
+
+        with self._lock:
+            self._counters["content_hashes"] += 1
+            self._remember_alias(identity, content_key)
+            self._db.execute(
+                "INSERT OR REPLACE INTO image_aliases (identity, content_key, accessed) VALUES (?, ?, ?)",
+                (identity, content_key, time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM image_aliases WHERE identity NOT IN "
+                "(SELECT identity FROM image_aliases ORDER BY accessed DESC LIMIT ?)",
+                (self.max_aliases,),
+            )
+            self._db.commit()
+        return content_key
+
+    def _remember_alias(self, identity: str, content_key: str):
+        self._aliases[identity] = content_key
+        self._aliases.move_to_end(identity)
+        while len(self._aliases) > self.max_aliases:
+            self._aliases.popitem(last=False)
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256("\x00".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._counters["hits"] += 1
+                return value
+
+            row = self._db.execute("SELECT value FROM prepared_images WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            self._db.execute("UPDATE prepared_images SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            value = json.loads(row[0])
+            if "size" in value:
+                # JSON turns the (width, height) tuple into a list; hand back what the memory tier does
+                value["size"] = tuple(value["size"])
+            self._counters["hits"] += 1
+            self._remember(key, value)
+            return value
+
+    def put(self, key: str, value: Dict):
+        encoded = json.dumps(value)
+        with self._lock:
+            self._remember(key, value)
+            self._db.execute(
+                "INSERT OR REPLACE INTO prepared_images (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, encoded, len(encoded), time.time()),
+            )
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM prepared_images").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in self._db.execute(
+                    "SELECT key, size FROM prepared_images ORDER BY accessed"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM prepared_images WHERE key = ?", (old_key,))
+                    total -= size
+                    self._counters["evictions"] += 1
+            self._db.commit()
+
+    def _remember(self, key: str, value: Dict):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key).get("data", ""))
+        self._memory[key] = value
+        self._memory_size += len(value.get("data", ""))
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted.get("data", ""))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            self._aliases.clear()
+            self._db.execute("DELETE FROM prepared_images")
+            self._db.execute("DELETE FROM image_aliases")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_size
+            stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM prepared_images").fetchone()[0]
+            stats["aliases"] = len(self._aliases)
+        return stats
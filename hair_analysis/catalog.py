@@ -0,0 +1,198 @@
+"""Local product catalog for recommendations without a model round trip.
+
+The catalog is loaded once, from HAIR_PRODUCT_CATALOG if set (a ``.json``
+list of products or a SQLite database with a ``products`` table), otherwise
+from the sample data/products.json. Each product names its category
+(shampoo, conditioner, treatment, styling), budget tier (low, medium, high),
+the hair types it suits ("all" for any) and the concerns it addresses.
+
+Products are indexed by (category, tier, hair type, concern) and (category,
+tier, hair type), and answers are memoized, so a recommendation query is a
+few dict lookups.
+
+SQLite catalogs store the list fields as comma-separated text:
+
+    CREATE TABLE products (name TEXT, brand TEXT, category TEXT, tier TEXT,
+                           hair_types TEXT, concerns TEXT, ingredients TEXT,
+                           where_to_buy TEXT, price TEXT)
+"""
+import heapq
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "products.json")
+CATEGORIES = ("shampoo", "conditioner", "treatment", "styling")
+TIERS = ("low", "medium", "high")
+HAIR_TYPES = ("straight", "wavy", "curly", "coily")
+
+# Budget and concern labels used by the apps, mapped onto catalog terms
+BUDGET_ALIASES = {
+    "economy": "low", "budget": "low", "low": "low",
+    "mid-range": "medium", "midrange": "medium", "mid": "medium", "medium": "medium",
+    "premium": "high", "luxury": "high", "high": "high",
+}
+CONCERN_ALIASES = {
+    "dryness": "dry", "dry": "dry",
+    "breakage": "breakage",
+    "frizz": "frizz",
+    "scalp issues": "scalp", "scalp": "scalp", "dandruff": "scalp",
+    "thinning": "thinning", "hair loss": "thinning",
+    "damage repair": "damaged", "damage": "damaged", "damaged": "damaged",
+}
+_HAIR_TYPE_PATTERN = re.compile(r"\b(straight|wavy|curly|coily)\b", re.IGNORECASE)
+
+
+@dataclass(frozen=True, slots=True)
+class Product:
+    name: str
+    brand: str
+    category: str
+    tier: str
+    hair_types: Tuple[str, ...]
+    concerns: Tuple[str, ...]
+    ingredients: Tuple[str, ...]
+    where_to_buy: str
+    price: str
+
+    def suits(self, hair_type: Optional[str]) -> bool:
+        return hair_type is None or "all" in self.hair_types or hair_type in self.hair_types
+
+
+def _items(value) -> Tuple[str, ...]:
+    # JSON catalogs use lists, SQLite ones comma-separated text
+    if isinstance(value, str):
+        value = value.split(",")
+    return tuple(str(item).strip() for item in value or () if str(item).strip())
+
+
+def _terms(value) -> Tuple[str, ...]:
+    return tuple(item.lower() for item in _items(value))
+
+
+def _product(record: Dict) -> Product:
+    category = str(record["category"]).strip().lower()
+    tier = BUDGET_ALIASES.get(str(record["tier"]).strip().lower())
+    if category not in CATEGORIES or tier is None:
+        raise ValueError(f"bad category/tier for {record.get('name')!r}: {record['category']}/{record['tier']}")
+    return Product(
+        name=str(record["name"]).strip(),
+        brand=str(record.get("brand", "")).strip(),
+        category=category,
+        tier=tier,
+        hair_types=_terms(record.get("hair_types")) or ("all",),
+        concerns=tuple(CONCERN_ALIASES.get(term, term) for term in _terms(record.get("concerns"))),
+        ingredients=_items(record.get("ingredients")),
+        where_to_buy=str(record.get("where_to_buy", "")).strip(),
+        price=str(record.get("price", "")).strip(),
+    )
+
+
+def normalize_budget(budget: Optional[str]) -> str:
+    return BUDGET_ALIASES.get((budget or "").strip().lower(), "medium")
+
+
+def normalize_concerns(concerns: Optional[Iterable[str]]) -> List[str]:
+    normalized = []
+    for concern in concerns or ():
+        term = CONCERN_ALIASES.get(concern.strip().lower(), concern.strip().lower())
+        if term and term not in normalized:
+            normalized.append(term)
+    return normalized
+
+
+def detect_hair_type(analysis: str) -> Optional[str]:
+    """First hair texture named in a free-text analysis, if any."""
+    match = _HAIR_TYPE_PATTERN.search(analysis or "")
+    return match.group(1).lower() if match else None
+
+
+class ProductCatalog:
+    def __init__(self, products: Sequence[Product], max_memo: int = 4096):
+        self.products = tuple(products)
+        self.max_memo = max_memo
+        # Buckets hold product indices in catalog order; hair type None matches any product
+        self._by_concern: Dict[Tuple, List[int]] = defaultdict(list)
+        self._by_tier: Dict[Tuple, List[int]] = defaultdict(list)
+        self._memo: Dict[Tuple, Tuple[Product, ...]] = {}
+        for index, product in enumerate(self.products):
+            for hair_type in (None,) + HAIR_TYPES:
+                if not product.suits(hair_type):
+                    continue
+                self._by_tier[(product.category, product.tier, hair_type)].append(index)
+                for concern in product.concerns:
+                    self._by_concern[(product.category, product.tier, hair_type, concern)].append(index)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "ProductCatalog":
+        path = path or os.getenv("HAIR_PRODUCT_CATALOG") or DEFAULT_CATALOG_PATH
+        if path.lower().endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                records = json.load(f)
+        else:
+            db = sqlite3.connect(path)
+            try:
+                db.row_factory = sqlite3.Row
+                records = [dict(row) for row in db.execute("SELECT * FROM products")]
+            finally:
+                db.close()
+        return cls([_product(record) for record in records])
+
+    def recommend(self, concerns: Optional[Iterable[str]] = None, budget: str = "medium",
+                  hair_type: Optional[str] = None, categories: Sequence[str] = CATEGORIES,
+                  per_category: int = 1) -> List[Product]:
+        """Best matches per category: most concerns covered, then catalog order."""
+        hair_type = hair_type.lower() if hair_type and hair_type.lower() in HAIR_TYPES else None
+        key = (normalize_budget(budget), frozenset(normalize_concerns(concerns)), hair_type,
+               tuple(categories), per_category)
+        picks = self._memo.get(key)
+        if picks is None:
+            picks = self._recommend(*key)
+            if len(self._memo) >= self.max_memo:
+                self._memo.clear()
+            self._memo[key] = picks
+        return list(picks)
+
+    def _recommend(self, tier: str, concerns: FrozenSet[str], hair_type: Optional[str],
+                   categories: Tuple[str, ...], per_category: int) -> Tuple[Product, ...]:
+        picks = []
+        for category in categories:
+            scores: Dict[int, int] = {}
+            for concern in concerns:
+                for index in self._by_concern.get((category, tier, hair_type, concern), ()):
+                    scores[index] = scores.get(index, 0) + 1
+            if scores:
+                ranked = heapq.nsmallest(per_category, scores, key=lambda index: (-scores[index], index))
+            else:
+                # Nothing for these concerns in this tier: any product that suits the hair type
+                ranked = self._by_tier.get((category, tier, hair_type), [])[:per_category]
+            picks.extend(self.products[index] for index in ranked)
+        return tuple(picks)
+
+
+def products_markdown(products: Sequence[Product]) -> str:
+    if not products:
+        return "No specific product recommendations available based on current analysis."
+    rows = ["| Product Type | Brand/Name | Key Ingredients | Where to Buy | Price |",
+            "|---|---|---|---|---|"]
+    for product in products:
+        rows.append(f"| {product.category.capitalize()} | {product.brand} {product.name} | "
+                    f"{', '.join(product.ingredients)} | {product.where_to_buy} | {product.price} |")
+    return "\n".join(rows)
+
+
+_catalog: Optional[ProductCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def default_catalog() -> ProductCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ProductCatalog.load()
+        return _catalog
@@ -0,0 +1,569 @@
+"""Headless hair analysis engine shared by the apps and batch runs.
+
+HairAnalysisEngine holds everything that is not UI: image preparation, the
+analysis and follow-up prompts, cached and streamed model calls, product
+lookup and report rendering. The Tk app (app.py), the Gradio app
+(V2/appv2.py) and batch_analysis.py are front-ends over it, and a worker
+process can import this module without tkinter or gradio.
+
+Every call takes an explicit session id, and the engine keeps no per-patient
+state. ``analyze_many`` runs whole patients (prepare -> analysis -> advice ->
+report) concurrently on an event loop, so one patient's model calls overlap
+another's image preparation and model calls.
+
+The chat model comes from the configured backend (HAIR_LLM_BACKEND, see
+backends); the ``stub`` backend runs the whole pipeline offline.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from hair_analysis import metrics
+from hair_analysis.backends import Backend, get_backend
+from hair_analysis.cache import AnalysisCache, image_digest
+from hair_analysis.catalog import default_catalog, products_markdown
+from hair_analysis.imaging import prepare_images
+from hair_analysis.markdown import MarkdownRenderer, markdown_to_html
+from hair_analysis.memory import SessionMemoryStore
+from hair_analysis.report import RenderedReport, ReportCache, new_report_id, render_report
+from hair_analysis.structured import (JSON_INSTRUCTIONS, HairAnalysis, analysis_context, structured_enabled,
+                                      try_parse_analysis)
+
+# Bump when the analysis prompts change so cached results are not reused
+ANALYSIS_PROMPT_VERSION = 1
+MAX_IMAGES = 4
+PATIENT_FIELDS = ("patient_name", "patient_id", "dob", "gender", "hospital_name", "doctor_name", "analysis_date")
+BASIC_ADVICE_PROMPT = "Provide basic care recommendations based on this analysis"
+# "treatment": treatment plan with budget/premium product picks; "care": care plan with a follow-up schedule
+ADVICE_STYLES = ("treatment", "care")
+# Streamed answers whose HTML is kept for the report
+STREAMED_HTML_ENTRIES = 32
+
+
+@dataclass(frozen=True, slots=True)
+class PatientResult:
+    index: int
+    patient: Dict
+    analysis: str = ""
+    advice: str = ""
+    structured: Optional[HairAnalysis] = None
+    report_html: str = ""
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class HairAnalysisEngine:
+    def __init__(self, memory_store: Optional[SessionMemoryStore] = None,
+                 analysis_cache: Optional[AnalysisCache] = None, report_cache: Optional[ReportCache] = None,
+                 advice_style: str = "treatment", verbose: bool = False, backend: Optional[str] = None):
+        if advice_style not in ADVICE_STYLES:
+            raise ValueError(f"Unknown advice style '{advice_style}', expected one of {ADVICE_STYLES}")
+        # HAIR_LLM_BACKEND unless given; the model itself is built on first use
+        self.backend: Backend = get_backend(backend)
+        self.memory_store = memory_store or SessionMemoryStore(llm_factory=self.backend.build, verbose=verbose)
+        self.analysis_cache = analysis_cache or AnalysisCache()
+        self.report_cache = report_cache or ReportCache()
+        self.advice_style = advice_style
+        # Streamed text -> its HTML, rendered chunk by chunk while it arrived
+        self._streamed_html: "OrderedDict[str, str]" = OrderedDict()
+        self._streamed_html_lock = threading.Lock()
+
+    # Images and analysis prompts
+
+    def prepare_images(self, image_paths: List[str]) -> List[Dict]:
+        # Decode/resize/encode the images in parallel
+        return prepare_images(image_paths)
+
+    def single_image_message(self, image_data: Dict) -> List[Dict]:
+        prompt = """As a professional hair specialist, analyze this hair image in detail:
+        
+        1. Hair Characteristics:
+           - Texture (straight, wavy, curly, coily)
+           - Density (thin, medium, thick)
+           - Diameter (fine, medium, coarse)
+           - Porosity level
+        
+        2. Scalp Condition:
+           - Visible scalp health
+           - Signs of irritation or abnormalities
+        
+        3. Hair Health:
+           - Ends condition (split ends, damage)
+           - Breakage patterns
+           - Signs of chemical damage
+           - Moisture/protein balance indicators
+        
+        4. Additional Observations:
+           - Any visible scalp conditions
+           - Hairline characteristics
+           - Growth patterns
+        
+        Provide:
+        - Detailed findings with confidence levels
+        - Clear explanations of technical terms
+        - Specific areas needing closer examination
+        """
+        if structured_enabled():
+            prompt += JSON_INSTRUCTIONS
+        
+        return [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {
+                "url": f"data:{image_data['mime_type']};base64,{image_data['data']}",
+                "detail": "high"
+            }}
+        ]
+    
+    def multiple_images_message(self, image_data_list: List[Dict]) -> List[Dict]:
+        prompt = f"""As a senior hair specialist, analyze these {len(image_data_list)} images of the same patient's hair:
+        
+        Perform COMPREHENSIVE ANALYSIS by:
+        
+        1. Individual Image Analysis:
+           - Analyze each image separately first
+           - Note unique observations from each angle
+        
+        2. Comparative Analysis:
+           - Identify consistent characteristics across images
+           - Resolve any discrepancies between images
+           - Determine most accurate overall assessment
+        
+        3. Detailed Assessment of:
+           - Hair type and texture from all angles
+           - Scalp health from visible areas
+           - Hair density and distribution
+           - Damage patterns and severity
+           - Growth patterns and hairline
+        
+        4. Final Evaluation:
+           - Most likely hair characteristics
+           - Confidence levels for each finding
+           - Recommended additional views if needed
+        
+        Image Details: {[img['filename'] for img in image_data_list]}
+        """
+        if structured_enabled():
+            prompt += JSON_INSTRUCTIONS
+        
+        messages = [{"type": "text", "text": prompt}]
+        for img_data in image_data_list:
+            messages.append({
+                "type": "image_url", 
+                "image_url": {
+                    "url": f"data:{img_data['mime_type']};base64,{img_data['data']}",
+                    "detail": "high"
+                }
+            })
+        return messages
+    
+    def check_image_paths(self, image_paths: List[str]) -> Optional[str]:
+        if not image_paths:
+            return "Error: No images provided."
+        
+        if len(image_paths) > MAX_IMAGES:
+            return f"Error: Maximum {MAX_IMAGES} images allowed for analysis."
+        
+        for path in image_paths:
+            if not os.path.exists(path):
+                return f"Error: Image not found - {path}"
+        return None
+
+    def analysis_message(self, image_data_list: List[Dict]) -> Tuple[List[Dict], str]:
+        """The prompt for these images and its cache kind ("single" or "multiple")."""
+        if len(image_data_list) == 1:
+            return self.single_image_message(image_data_list[0]), "single"
+        return self.multiple_images_message(image_data_list), "multiple"
+
+    def analysis_cache_key(self, image_data_list: List[Dict], kind: str) -> str:
+        if structured_enabled():
+            kind += "-json"
+        return self.analysis_cache.key(
+            [image_digest(img["data"]) for img in image_data_list],
+            f"{kind}-v{ANALYSIS_PROMPT_VERSION}",
+            self.backend.model
+        )
+
+    def finish_analysis(self, analysis: str) -> Tuple[str, Optional[HairAnalysis]]:
+        """The text to show for a completed analysis, and its parsed form in structured mode."""
+        result = try_parse_analysis(analysis) if structured_enabled() else None
+        if result is not None:
+            return result.to_markdown(), result
+        return analysis, None
+
+    # Model calls. Analyses are answered from the analysis cache when the same images were seen before.
+
+    def _cached(self, cache_key: str) -> Optional[str]:
+        cached = self.analysis_cache.get(cache_key)
+        metrics.count("analysis_cache", result="miss" if cached is None else "hit")
+        return cached
+
+    # The async paths query and commit the SQLite cache on a worker thread, off the event loop
+
+    async def _acached(self, cache_key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._cached, cache_key)
+
+    async def _aput(self, cache_key: str, analysis: str):
+        await asyncio.to_thread(self.analysis_cache.put, cache_key, analysis)
+
+    def cached_analysis(self, message: List[Dict], image_data_list: List[Dict], kind: str, session_id: str) -> str:
+        cache_key = self.analysis_cache_key(image_data_list, kind)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            self.memory_store.record(session_id, message, cached)
+            return cached
+
+        with metrics.span("analysis"):
+            analysis = self.memory_store.invoke(session_id, message)
+        self.analysis_cache.put(cache_key, analysis)
+        return analysis
+
+    async def acached_analysis(self, message: List[Dict], image_data_list: List[Dict], kind: str,
+                               session_id: str) -> str:
+        cache_key = self.analysis_cache_key(image_data_list, kind)
+        cached = await self._acached(cache_key)
+        if cached is not None:
+            await self.memory_store.arecord(session_id, message, cached)
+            return cached
+
+        with metrics.span("analysis"):
+            analysis = await self.memory_store.ainvoke(session_id, message)
+        await self._aput(cache_key, analysis)
+        return analysis
+
+    def stream_cached_analysis(self, message: List[Dict], image_data_list: List[Dict], kind: str,
+                               session_id: str) -> Iterator[str]:
+        cache_key = self.analysis_cache_key(image_data_list, kind)
+        cached = self._cached(cache_key)
+        if cached is not None:
+            self.memory_store.record(session_id, message, cached)
+            yield cached
+            return
+
+        chunks = []
+        for chunk in metrics.timed_iter("analysis", self.memory_store.stream(session_id, message)):
+            chunks.append(chunk)
+            yield chunk
+        self.analysis_cache.put(cache_key, "".join(chunks))
+
+    async def astream_cached_analysis(self, message: List[Dict], image_data_list: List[Dict], kind: str,
+                                      session_id: str) -> AsyncIterator[str]:
+        cache_key = self.analysis_cache_key(image_data_list, kind)
+        cached = await self._acached(cache_key)
+        if cached is not None:
+            await self.memory_store.arecord(session_id, message, cached)
+            yield cached
+            return
+
+        chunks = []
+        async for chunk in metrics.atimed_iter("analysis", self.memory_store.astream(session_id, message)):
+            chunks.append(chunk)
+            yield chunk
+        await self._aput(cache_key, "".join(chunks))
+
+    def _checked(self, image_paths: List[str]) -> List[str]:
+        error = self.check_image_paths(image_paths)
+        if error:
+            raise ValueError(error)
+        return image_paths
+
+    def analyze(self, image_paths: List[str], session_id: str) -> str:
+        """Analyze one patient's images; raises ValueError for missing or too many images."""
+        image_data_list = self.prepare_images(self._checked(image_paths))
+        message, kind = self.analysis_message(image_data_list)
+        return self.cached_analysis(message, image_data_list, kind, session_id)
+
+    async def aanalyze(self, image_paths: List[str], session_id: str) -> str:
+        # Image preparation is CPU-bound, keep it off the event loop
+        image_data_list = await asyncio.to_thread(self.prepare_images, self._checked(image_paths))
+        message, kind = self.analysis_message(image_data_list)
+        return await self.acached_analysis(message, image_data_list, kind, session_id)
+
+    def stream_analysis(self, image_paths: List[str], session_id: str) -> Iterator[str]:
+        image_data_list = self.prepare_images(self._checked(image_paths))
+        message, kind = self.analysis_message(image_data_list)
+        chunks = self.stream_cached_analysis(message, image_data_list, kind, session_id)
+        # Structured analyses stream JSON; the report shows their Markdown rendering instead
+        yield from chunks if structured_enabled() else self.render_streamed(chunks)
+
+    async def astream_analysis(self, image_paths: List[str], session_id: str) -> AsyncIterator[str]:
+        image_data_list = await asyncio.to_thread(self.prepare_images, self._checked(image_paths))
+        message, kind = self.analysis_message(image_data_list)
+        chunks = self.astream_cached_analysis(message, image_data_list, kind, session_id)
+        async for chunk in chunks if structured_enabled() else self.arender_streamed(chunks):
+            yield chunk
+
+    # Follow-up questions in the patient's conversation; ``stage`` names the call in the metrics
+
+    def ask(self, prompt: str, session_id: str, stage: str = "ask") -> str:
+        with metrics.span(stage):
+            return self.memory_store.invoke(session_id, prompt)
+
+    async def aask(self, prompt: str, session_id: str, stage: str = "ask") -> str:
+        with metrics.span(stage):
+            return await self.memory_store.ainvoke(session_id, prompt)
+
+    def stream_ask(self, prompt: str, session_id: str, stage: str = "ask") -> Iterator[str]:
+        return self.render_streamed(metrics.timed_iter(stage, self.memory_store.stream(session_id, prompt)))
+
+    def astream_ask(self, prompt: str, session_id: str, stage: str = "ask") -> AsyncIterator[str]:
+        return self.arender_streamed(metrics.atimed_iter(stage, self.memory_store.astream(session_id, prompt)))
+
+    def advice_prompt(self, analysis: Union[str, HairAnalysis]) -> str:
+        if self.advice_style == "care":
+            return self.care_plan_prompt(analysis)
+        return self.treatment_plan_prompt(analysis)
+
+    def treatment_plan_prompt(self, analysis: Union[str, HairAnalysis]) -> str:
+        prompt = f"""Based on this comprehensive hair analysis:
+        {analysis_context(analysis)}
+        
+        Provide DETAILED TREATMENT PLAN including:
+        
+        1. Immediate Care Recommendations:
+            - Daily routine with specific product types
+            - Key ingredients to look for
+            - Application techniques
+        
+        2. Professional Treatments:
+            - Recommended salon treatments
+            - Frequency
+            - Expected outcomes
+        
+        3. Product Recommendations:
+            - For each recommended product type, suggest:
+                - 1 budget option
+                - 1 premium option
+                - Key benefits of each
+                - Where to purchase
+        
+        4. Lifestyle Adjustments:
+            - Dietary suggestions
+            - Protective styling advice
+            - Environmental protection
+        
+        Format the recommendations clearly with headings for each category.
+        """
+        return prompt
+
+    def care_plan_prompt(self, analysis: Union[str, HairAnalysis]) -> str:
+        prompt = f"""Based on this comprehensive hair analysis:
+        {analysis_context(analysis)}
+        
+        Provide DETAILED TREATMENT PLAN covering:
+        
+        1. Immediate Care Recommendations:
+           - Daily routine (cleansing, conditioning)
+           - Recommended products
+           - Handling instructions
+        
+        2. Professional Treatments:
+           - Recommended salon treatments
+           - Frequency
+           - Expected outcomes
+        
+        3. Long-term Maintenance:
+           - Ongoing care regimen
+           - Lifestyle adjustments
+           - Nutritional recommendations
+        
+        4. Follow-up Plan:
+           - Recommended timeline for reassessment
+           - Signs to watch for
+           - When to seek professional help
+        
+        5. Product Recommendations:
+           - Specific product types
+           - Key ingredients to look for
+           - Ingredients to avoid
+        
+        Organize by priority and provide rationale for each recommendation.
+        """
+        return prompt
+
+    def advise(self, analysis: Union[str, HairAnalysis], session_id: str) -> str:
+        return self.ask(self.advice_prompt(analysis), session_id, stage="advice")
+
+    async def aadvise(self, analysis: Union[str, HairAnalysis], session_id: str) -> str:
+        return await self.aask(self.advice_prompt(analysis), session_id, stage="advice")
+
+    def stream_advice(self, analysis: Union[str, HairAnalysis], session_id: str) -> Iterator[str]:
+        return self.stream_ask(self.advice_prompt(analysis), session_id, stage="advice")
+
+    def astream_advice(self, analysis: Union[str, HairAnalysis], session_id: str) -> AsyncIterator[str]:
+        return self.astream_ask(self.advice_prompt(analysis), session_id, stage="advice")
+
+    # Products
+
+    def recommend_products(self, hair_type: Optional[str], concerns: List[str], budget: str = "medium") -> str:
+        # Served from the local catalog, no model call
+        return products_markdown(default_catalog().recommend(concerns, budget, hair_type))
+
+    def product_recommendations_prompt(self, hair_analysis: Union[str, HairAnalysis], budget: str = "medium", concerns: List[str] = None) -> str:
+        """
+        Extract key characteristics from analysis and generate detailed product recommendations
+        with budget and specific concerns taken into account.
+        """
+        if concerns is None:
+            concerns = []
+            
+        prompt = f"""From this hair analysis:
+        {analysis_context(hair_analysis)}
+        
+        Identify the following characteristics:
+        1. Hair type (straight, wavy, curly, coily)
+        2. Primary concerns: {', '.join(concerns) if concerns else 'Not specified'}
+        3. Current condition (damaged, color-treated, etc.)
+        
+        Then provide specific product recommendations for a {budget} budget including:
+        - 3 shampoo options at different price points
+        - 3 conditioner options
+        - 2 treatment products
+        - 1 styling product
+        For each product include:
+        - Brand and product name
+        - Key beneficial ingredients
+        - Where to purchase (e.g., Ulta, Sephora, drugstore)
+        - Price range
+        
+        Format as a clear table with columns: Product Type, Brand/Name, Key Ingredients, Where to Buy, Price.
+        """
+        return prompt
+
+    def product_narrative_prompt(self, products: str, hair_analysis: Union[str, HairAnalysis]) -> str:
+        prompt = f"""From this hair analysis:
+        {analysis_context(hair_analysis)}
+        
+        These products were selected for the patient:
+        {products}
+        
+        In a short paragraph per product, explain why it suits this patient and how to use it.
+        Do not suggest other products.
+        """
+        return prompt
+
+    # Reports
+
+    def convert_to_html(self, text: str) -> str:
+        with metrics.span("convert_to_html"):
+            with self._streamed_html_lock:
+                html = self._streamed_html.get(text)
+            return html if html is not None else markdown_to_html(text)
+
+    def render_streamed(self, chunks: Iterator[str]) -> Iterator[str]:
+        """Pass chunks through, rendering them to HTML as they go.
+
+        When the stream completes, convert_to_html of its full text is a
+        lookup; a stream that is abandoned part way is not kept.
+        """
+        renderer, parts, html = MarkdownRenderer(), [], []
+        for chunk in chunks:
+            parts.append(chunk)
+            html.append(renderer.feed(chunk))
+            yield chunk
+        html.append(renderer.close())
+        self._remember_html("".join(parts), html)
+
+    async def arender_streamed(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        renderer, parts, html = MarkdownRenderer(), [], []
+        async for chunk in chunks:
+            parts.append(chunk)
+            html.append(renderer.feed(chunk))
+            yield chunk
+        html.append(renderer.close())
+        self._remember_html("".join(parts), html)
+
+    def _remember_html(self, text: str, html: List[str]):
+        with self._streamed_html_lock:
+            self._streamed_html[text] = "\n".join(part for part in html if part)
+            self._streamed_html.move_to_end(text)
+            while len(self._streamed_html) > STREAMED_HTML_ENTRIES:
+                self._streamed_html.popitem(last=False)
+
+    def report_html(self, analysis: str, advice: str, report_id: Optional[str] = None,
+                    stylesheet_mode: str = "inline", **fields: str) -> str:
+        """A freshly rendered report; ``fields`` are the PATIENT_FIELDS."""
+        return render_report(
+            self.convert_to_html(analysis),
+            self.convert_to_html(advice),
+            report_id=report_id or new_report_id(),
+            stylesheet_mode=stylesheet_mode,
+            **fields
+        )
+
+    def rendered_report(self, analysis: str, advice: str, **fields: str) -> RenderedReport:
+        """The report for these results, rendered once and reused while nothing changes."""
+        return self.report_cache.render(analysis, advice, self.convert_to_html, **fields)
+
+    # Whole patients
+
+    async def aanalyze_patient(self, patient: Dict, index: int = 0, stylesheet_mode: str = "inline") -> PatientResult:
+        """Prepare, analyze, advise and render one patient; failures are returned, not raised."""
+        session_id = f"batch-{index}-{patient.get('patient_id', '')}"
+        timings = {}
+        try:
+            start = time.perf_counter()
+            image_data_list = await asyncio.to_thread(self.prepare_images, self._checked(patient["images"]))
+            timings["prepare"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            message, kind = self.analysis_message(image_data_list)
+            analysis, structured = self.finish_analysis(
+                await self.acached_analysis(message, image_data_list, kind, session_id)
+            )
+            timings["analysis"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            advice = await self.aadvise(structured or analysis, session_id)
+            timings["advice"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            report_html = self.report_html(analysis, advice, stylesheet_mode=stylesheet_mode,
+                                           **{name: patient.get(name, "") for name in PATIENT_FIELDS})
+            timings["report"] = time.perf_counter() - start
+            return PatientResult(index, patient, analysis, advice, structured, report_html, timings)
+        except Exception as e:
+            return PatientResult(index, patient, timings=timings, error=str(e))
+        finally:
+            self.memory_store.evict(session_id)
+
+    async def astream_many(self, patients: Sequence[Dict], concurrency: int = 4,
+                           stylesheet_mode: str = "inline") -> AsyncIterator[PatientResult]:
+        """Run up to ``concurrency`` patients at once, yielding results as they complete."""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(index: int, patient: Dict) -> PatientResult:
+            async with semaphore:
+                return await self.aanalyze_patient(patient, index, stylesheet_mode)
+
+        tasks = [asyncio.ensure_future(run(index, patient)) for index, patient in enumerate(patients)]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def analyze_many(self, patients: Sequence[Dict], concurrency: int = 4, stylesheet_mode: str = "inline",
+                     on_result: Optional[Callable[[PatientResult], None]] = None) -> List[PatientResult]:
+        """Blocking analyze-all for scripts: results in input order, ``on_result`` called as each finishes.
+
+        Each patient is a dict of PATIENT_FIELDS plus ``images`` (a list of paths).
+        Must not be called from a running event loop; use astream_many there.
+        """
+        async def collect() -> List[PatientResult]:
+            results: List[Optional[PatientResult]] = [None] * len(patients)
+            async for result in self.astream_many(patients, concurrency, stylesheet_mode):
+                results[result.index] = result
+                if on_result is not None:
+                    on_result(result)
+            return results
+
+        return asyncio.run(collect())
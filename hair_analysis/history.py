@@ -0,0 +1,94 @@
+"""Conversation history that keeps images as references (see image_refs), and
+the token-bounded memories built on it.
+
+Kept apart from image_refs so that module stays free of the LangChain import.
+
+LangChain's token and summary buffer memories ask the model to count tokens
+(``get_num_tokens_from_messages``) after every turn and again for every
+message they drop: a network call per message on Gemini, outside the rate
+limiter, and an ImportError on models without a local tokenizer. The
+memories here trim with the same local estimate the RateLimiter charges
+(``estimate_tokens``), in one pass.
+"""
+from typing import Any, List, Sequence
+
+from langchain.memory import ConversationSummaryBufferMemory, ConversationTokenBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+from hair_analysis.image_refs import ImageRefStore
+from hair_analysis.ratelimit import estimate_tokens
+
+
+class CompactChatMessageHistory(BaseChatMessageHistory):
+    """Chat history that stores image parts as references instead of payloads."""
+
+    def __init__(self, refs: ImageRefStore):
+        self.refs = refs
+        self.messages: List[BaseMessage] = []
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        for message in messages:
+            if isinstance(message.content, list):
+                message = message.model_copy(update={"content": self.refs.compact(message.content)})
+            self.messages.append(message)
+
+    def clear(self) -> None:
+        self.messages = []
+
+
+def trim_to_tokens(messages: List[BaseMessage], max_tokens: int) -> List[BaseMessage]:
+    """Drop the oldest messages in place until the rest fit ``max_tokens``; returns the dropped ones."""
+    sizes = [estimate_tokens([message]) for message in messages]
+    total, dropped = sum(sizes), 0
+    while total > max_tokens and dropped < len(messages):
+        total -= sizes[dropped]
+        dropped += 1
+    pruned = messages[:dropped]
+    del messages[:dropped]
+    return pruned
+
+
+class LocalTokenBufferMemory(ConversationTokenBufferMemory):
+    """ConversationTokenBufferMemory that counts tokens locally, on both the sync and async paths."""
+
+    def save_context(self, inputs: dict, outputs: dict) -> None:
+        BaseChatMemory.save_context(self, inputs, outputs)
+        trim_to_tokens(self.chat_memory.messages, self.max_token_limit)
+
+    async def asave_context(self, inputs: dict, outputs: dict) -> None:
+        await BaseChatMemory.asave_context(self, inputs, outputs)
+        trim_to_tokens(self.chat_memory.messages, self.max_token_limit)
+
+
+class LocalSummaryBufferMemory(ConversationSummaryBufferMemory):
+    """ConversationSummaryBufferMemory that counts tokens locally.
+
+    The summaries themselves are model calls; with a ``limiter`` they are
+    throttled and retried like every other call.
+    """
+
+    limiter: Any = None
+
+    def prune(self) -> None:
+        pruned = trim_to_tokens(self.chat_memory.messages, self.max_token_limit)
+        if pruned:
+            self.moving_summary_buffer = self.predict_new_summary(pruned, self.moving_summary_buffer)
+
+    async def aprune(self) -> None:
+        pruned = trim_to_tokens(self.chat_memory.messages, self.max_token_limit)
+        if pruned:
+            self.moving_summary_buffer = await self.apredict_new_summary(pruned, self.moving_summary_buffer)
+
+    def predict_new_summary(self, messages: List[BaseMessage], existing_summary: str) -> str:
+        summarize = super().predict_new_summary
+        if self.limiter is None:
+            return summarize(messages, existing_summary)
+        return self.limiter.call(lambda: summarize(messages, existing_summary), estimate_tokens(messages))
+
+    async def apredict_new_summary(self, messages: List[BaseMessage], existing_summary: str) -> str:
+        summarize = super().apredict_new_summary
+        if self.limiter is None:
+            return await summarize(messages, existing_summary)
+        return await self.limiter.acall(lambda: summarize(messages, existing_summary), estimate_tokens(messages))
@@ -0,0 +1,103 @@
+"""Content-hash references for images kept in conversation history.
+
+Once a turn is done, ``image_url`` parts carrying ``data:...;base64`` payloads
+are swapped for a short text reference such as
+``[image crown.jpg sha256:9f2c...]``. The payload stays in an
+``ImageRefStore`` and is attached again only when a later prompt asks for it,
+either with an ``{"type": "image_ref", "sha256": ...}`` part or by quoting the
+reference text.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Union
+
+REF_PATTERN = re.compile(r"\[image (?P<filename>[^\]]*?) ?sha256:(?P<digest>[0-9a-f]{64})\]")
+
+Content = Union[str, List]
+
+
+class ImageRefStore:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._images: "OrderedDict[str, Dict]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, url: str, filename: str = "", detail: str = "high") -> str:
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        with self._lock:
+            if digest in self._images:
+                self._images.move_to_end(digest)
+                return digest
+            self._images[digest] = {"url": url, "filename": filename, "detail": detail}
+            self._bytes += len(url)
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= len(evicted["url"])
+        return digest
+
+    def get(self, digest: str) -> Optional[Dict]:
+        with self._lock:
+            image = self._images.get(digest)
+            if image is not None:
+                self._images.move_to_end(digest)
+            return image
+
+    def reference(self, digest: str, filename: str = "") -> str:
+        return f"[image {filename + ' ' if filename else ''}sha256:{digest}]"
+
+    def compact(self, content: Content) -> Content:
+        """Replace inline image parts with reference text."""
+        if not isinstance(content, list):
+            return content
+        filenames = self._filenames(content)
+        compacted = []
+        image_index = 0
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                image_url = part["image_url"]
+                url = image_url if isinstance(image_url, str) else image_url.get("url", "")
+                detail = "high" if isinstance(image_url, str) else image_url.get("detail", "high")
+                filename = filenames[image_index] if image_index < len(filenames) else ""
+                image_index += 1
+                digest = self.put(url, filename, detail)
+                compacted.append({"type": "text", "text": self.reference(digest, filename)})
+            else:
+                compacted.append(part)
+        return compacted
+
+    def expand(self, content: Content) -> Content:
+        """Attach the original image bytes for every reference the prompt asks for."""
+        if isinstance(content, str):
+            if not REF_PATTERN.search(content):
+                return content
+            content = [{"type": "text", "text": content}]
+        expanded = []
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "image_ref":
+                image = self.get(part["sha256"])
+                if image is not None:
+                    expanded.append(self._image_part(image))
+                continue
+            expanded.append(part)
+            if isinstance(part, dict) and part.get("type") == "text":
+                for match in REF_PATTERN.finditer(part["text"]):
+                    image = self.get(match.group("digest"))
+                    if image is not None:
+                        expanded.append(self._image_part(image))
+        return expanded
+
+    def _image_part(self, image: Dict) -> Dict:
+        return {"type": "image_url", "image_url": {"url": image["url"], "detail": image["detail"]}}
+
+    def _filenames(self, content: Sequence) -> List[str]:
+        # The analysis prompts list the filenames in the same order as the images
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "text":
+                match = re.search(r"Image Details: \[(.*?)\]", part.get("text", ""))
+                if match:
+                    return [name.strip(" '\"") for name in match.group(1).split(",")]
+        return []
+
@@ -0,0 +1,349 @@
+"""Image preparation shared by both apps.
+
+``prepare_image`` turns a photo into the base64 payload sent to the model.
+``prepare_images`` does the same for several photos at once on a shared
+pool: Pillow releases the GIL while decoding, resampling and encoding, so
+threads scale across cores; a process pool can be chosen instead with
+``HAIR_IMAGE_EXECUTOR=process``. The worker count comes from
+HAIR_IMAGE_WORKERS (default: one per image, capped at the CPU count).
+
+Decoding never materialises the full-resolution bitmap for JPEGs: ``draft``
+lets libjpeg scale by 1/2, 1/4 or 1/8 while decoding, EXIF orientation is
+applied to that small image, and ``thumbnail`` does an integer ``reduce``
+before the final LANCZOS pass. The largest bitmap held while preparing an
+image is returned as ``peak_bitmap_bytes``.
+
+Encoding follows an ``EncodingPolicy``. By default every image is sent at
+the fixed 1024 px / JPEG q90 encoding. Setting HAIR_PAYLOAD_BUDGET (base64
+bytes per request, e.g. 1200000) opts in to a shared budget instead:
+close-up scalp shots get a larger share and a finer starting resolution
+than full-head views, and each image walks down a quality/resolution
+ladder in JPEG or WebP until it fits. This changes what the model sees, so
+check analysis quality before turning it on.
+
+Prepared payloads are memoized in a PreparedImageCache (HAIR_PAYLOAD_CACHE=0
+disables it), so re-analysing or re-previewing unchanged photos skips all of
+the above.
+"""
+import base64
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageFilter, ImageOps, ImageStat, features
+
+from hair_analysis.cache import PreparedImageCache
+from hair_analysis import metrics
+
+MAX_DIMENSION = 1024
+JPEG_QUALITY = 90
+# thumbnail() reduces by an integer factor until within this multiple of the target, then resamples
+REDUCING_GAP = 3.0
+
+VIEW_CLOSEUP = "closeup"
+VIEW_OVERVIEW = "overview"
+# Filenames that mark a close-up of the scalp or strands
+CLOSEUP_HINTS = ("scalp", "closeup", "close-up", "close_up", "macro", "parting", "crown", "hairline", "strand")
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+_executors: Dict[str, Executor] = {}
+_executors_lock = threading.Lock()
+
+
+class EncodingPolicy:
+    def __init__(self, budget_bytes: Optional[int] = None, formats: Optional[Sequence[str]] = None,
+                 closeup_dimension: int = MAX_DIMENSION, overview_dimension: int = 768,
+                 min_dimension: int = 512, qualities: Sequence[int] = (90, 82, 75, 65),
+                 closeup_weight: float = 1.5, detail_threshold: float = 7.0):
+        if budget_bytes is None:
+            budget_bytes = int(os.getenv("HAIR_PAYLOAD_BUDGET", "0"))
+        if formats is None:
+            formats = os.getenv("HAIR_IMAGE_FORMATS", "JPEG,WEBP").split(",")
+        self.budget_bytes = budget_bytes
+        self.formats = [f.strip().upper() for f in formats
+                        if f.strip().upper() == "JPEG" or (f.strip().upper() == "WEBP" and features.check("webp"))]
+        self.closeup_dimension = closeup_dimension
+        self.overview_dimension = overview_dimension
+        self.min_dimension = min_dimension
+        self.qualities = tuple(qualities)
+        self.closeup_weight = closeup_weight
+        # Mean edge strength (0-255) above which a photo is treated as a close-up
+        self.detail_threshold = detail_threshold
+
+    def signature(self) -> str:
+        """Identifies the settings that affect the encoded output, for cache keys."""
+        return repr((self.budget_bytes, self.formats, self.closeup_dimension, self.overview_dimension,
+                     self.min_dimension, self.qualities, self.closeup_weight, self.detail_threshold))
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    def decode_dimension(self) -> int:
+        if not self.enabled:
+            return MAX_DIMENSION
+        return max(self.closeup_dimension, self.overview_dimension)
+
+    def allocate(self, views: Sequence[str]) -> List[Optional[int]]:
+        """Split the request budget between images, weighting close-ups higher."""
+        if not self.enabled:
+            return [None] * len(views)
+        weights = [self.closeup_weight if view == VIEW_CLOSEUP else 1.0 for view in views]
+        total = sum(weights)
+        return [int(self.budget_bytes * weight / total) for weight in weights]
+
+    def ladder(self, view: str) -> List[Tuple[int, int]]:
+        """(max dimension, quality) rungs from best to smallest."""
+        if not self.enabled:
+            return [(MAX_DIMENSION, JPEG_QUALITY)]
+        dimension = self.closeup_dimension if view == VIEW_CLOSEUP else self.overview_dimension
+        dimensions = []
+        while dimension >= self.min_dimension:
+            dimensions.append(dimension)
+            dimension = int(dimension * 0.75)
+        dimensions = dimensions or [self.min_dimension]
+        return [(d, q) for d in dimensions for q in self.qualities]
+
+
+_default_policy = None
+
+
+def default_policy() -> EncodingPolicy:
+    global _default_policy
+    if _default_policy is None:
+        _default_policy = EncodingPolicy()
+    return _default_policy
+
+
+def bitmap_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+def base64_size(num_bytes: int) -> int:
+    return (num_bytes + 2) // 3 * 4
+
+
+def load_image(image_path: str, max_dimension: int = MAX_DIMENSION):
+    """Decode an image no larger than needed for max_dimension, upright and in RGB.
+
+    Returns the image and the size in bytes of the largest bitmap held on the way.
+    """
+    with metrics.span("image.decode"), Image.open(image_path) as img:
+        if img.format == "JPEG":
+            # Only the DCT scale is changed; the result is still at least max_dimension on its long side
+            img.draft("RGB", (max_dimension, max_dimension))
+        img.load()
+        img = ImageOps.exif_transpose(img)
+    peak = bitmap_bytes(img)
+
+    with metrics.span("image.resize"):
+        if img.mode in ("P", "1"):
+            # Palette images can only be resized with NEAREST, so expand them first
+            img = img.convert("RGB")
+            peak = max(peak, bitmap_bytes(img))
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS, reducing_gap=REDUCING_GAP)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+    return img, max(peak, bitmap_bytes(img))
+
+
+def classify_view(img: Image.Image, filename: str = "", policy: Optional[EncodingPolicy] = None) -> str:
+    policy = policy or default_policy()
+    if any(hint in filename.lower() for hint in CLOSEUP_HINTS):
+        return VIEW_CLOSEUP
+    # Close-ups are dominated by individual strands, i.e. a lot of fine edge energy
+    with metrics.span("image.classify"):
+        small = img.convert("L")
+        small.thumbnail((512, 512))
+        detail = ImageStat.Stat(small.filter(ImageFilter.FIND_EDGES)).mean[0]
+    return VIEW_CLOSEUP if detail >= policy.detail_threshold else VIEW_OVERVIEW
+
+
+def encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buffered = BytesIO()
+    with metrics.span("image.encode"):
+        if fmt == "WEBP":
+            img.save(buffered, format="WEBP", quality=quality, method=4)
+        else:
+            img.save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def decode_for_policy(image_path: str, policy: EncodingPolicy) -> Dict:
+    img, peak = load_image(image_path, policy.decode_dimension())
+    filename = os.path.basename(image_path)
+    view = classify_view(img, filename, policy) if policy.enabled else VIEW_CLOSEUP
+    return {"image": img, "peak_bitmap_bytes": peak, "filename": filename, "view": view}
+
+
+def encode_for_budget(decoded: Dict, budget: Optional[int], policy: EncodingPolicy) -> Dict:
+    """Encode at the best rung of the view's ladder whose base64 payload fits the budget."""
+    img = decoded["image"]
+    formats = policy.formats if policy.enabled else ["JPEG"]
+    fmt = formats[0]
+    encoded = None
+    for dimension, quality in policy.ladder(decoded["view"]):
+        scaled = img
+        if max(img.size) > dimension:
+            with metrics.span("image.resize"):
+                scaled = img.copy()
+                scaled.thumbnail((dimension, dimension), Image.LANCZOS, reducing_gap=REDUCING_GAP)
+        if encoded is None and len(formats) > 1:
+            # Pick the format once, at the top rung, by whichever is smaller
+            candidates = [(encode(scaled, f, quality), f) for f in formats]
+            encoded, fmt = min(candidates, key=lambda c: len(c[0]))
+        else:
+            encoded = encode(scaled, fmt, quality)
+        size = scaled.size
+        if budget is None or base64_size(len(encoded)) <= budget:
+            break
+
+    with metrics.span("image.base64"):
+        data = base64.b64encode(encoded).decode('utf-8')
+    return {
+        "mime_type": MIME_TYPES[fmt],
+        "data": data,
+        "filename": decoded["filename"],
+        "peak_bitmap_bytes": decoded["peak_bitmap_bytes"],
+        "view": decoded["view"],
+        "format": fmt,
+        "quality": quality,
+        "size": size,
+        "encoded_bytes": len(encoded)
+    }
+
+
+def prepare_image(image_path: str, policy: Optional[EncodingPolicy] = None, use_cache: bool = True) -> Dict:
+    return prepare_images([image_path], max_workers=1, policy=policy, use_cache=use_cache)[0]
+
+
+def default_workers() -> int:
+    return int(os.getenv("HAIR_IMAGE_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def _executor(kind: str, workers: int) -> Executor:
+    # Pools are created once and reused; process start-up is far too slow to pay per request
+    key = f"{kind}:{workers}"
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            if kind == "process":
+                executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prepare-image")
+            _executors[key] = executor
+        return executor
+
+
+def _decode(image_path: str, policy: EncodingPolicy) -> Dict:
+    try:
+        return decode_for_policy(image_path, policy)
+    except Exception as e:
+        raise ValueError(f"Error processing image {image_path}: {str(e)}")
+
+
+def _map(fn, workers: int, executor: Optional[str], *iterables) -> List:
+    items = list(zip(*iterables))
+    if min(workers, len(items)) <= 1:
+        return [fn(*args) for args in items]
+    pool = _executor((executor or os.getenv("HAIR_IMAGE_EXECUTOR", "thread")).lower(), min(workers, len(items)))
+    return list(pool.map(fn, *zip(*items)))
+
+
+def prepare_images(image_paths: List[str], max_workers: Optional[int] = None, executor: Optional[str] = None,
+                   policy: Optional[EncodingPolicy] = None, use_cache: bool = True) -> List[Dict]:
+    """Prepare several images in parallel, returning payloads in input order.
+
+    All images are classified first so the payload budget can be split between
+    them before encoding. Payloads and classifications already in the prepared
+    image cache are reused, so only new or changed photos are decoded.
+    """
+    with metrics.span("prepare_images"):
+        return _prepare_images(image_paths, max_workers, executor, policy, use_cache)
+
+
+def _prepare_images(image_paths: List[str], max_workers: Optional[int], executor: Optional[str],
+                    policy: Optional[EncodingPolicy], use_cache: bool) -> List[Dict]:
+    policy = policy or default_policy()
+    workers = max_workers or default_workers()
+    cache = default_payload_cache() if use_cache else None
+    count = len(image_paths)
+
+    content_keys = [None] * count
+    views = [None] * count
+    if cache is not None:
+        for i, path in enumerate(image_paths):
+            try:
+                content_keys[i] = cache.content_key(path)
+            except OSError as e:
+                raise ValueError(f"Error processing image {path}: {str(e)}")
+            cached_view = cache.get(cache.key("view", content_keys[i], policy.signature()))
+            views[i] = cached_view["view"] if cached_view else None
+
+    decoded = {}
+    unknown = [i for i in range(count) if views[i] is None]
+    for i, result in zip(unknown, _map(_decode, workers, executor, [image_paths[i] for i in unknown], [policy] * len(unknown))):
+        decoded[i] = result
+        views[i] = result["view"]
+        if cache is not None:
+            cache.put(cache.key("view", content_keys[i], policy.signature()), {"view": result["view"]})
+
+    budgets = policy.allocate(views)
+    payloads = [None] * count
+    if cache is not None:
+        for i in range(count):
+            payloads[i] = cache.get(cache.key("payload", content_keys[i], policy.signature(), budgets[i]))
+
+    missing = [i for i in range(count) if payloads[i] is None]
+    if cache is not None:
+        metrics.count("image_cache", count - len(missing), result="hit")
+        metrics.count("image_cache", len(missing), result="miss")
+    undecoded = [i for i in missing if i not in decoded]
+    for i, result in zip(undecoded, _map(_decode, workers, executor, [image_paths[i] for i in undecoded], [policy] * len(undecoded))):
+        decoded[i] = result
+    encoded = _map(encode_for_budget, workers, executor,
+                   [decoded[i] for i in missing], [budgets[i] for i in missing], [policy] * len(missing))
+    for i, payload in zip(missing, encoded):
+        payloads[i] = payload
+        if cache is not None:
+            cache.put(cache.key("payload", content_keys[i], policy.signature(), budgets[i]), payload)
+
+    # The same photo may have been cached under another name
+    return [dict(payload, filename=os.path.basename(path)) for payload, path in zip(payloads, image_paths)]
+
+
+_default_payload_cache = None
+_default_payload_cache_lock = threading.Lock()
+
+
+def default_payload_cache() -> Optional[PreparedImageCache]:
+    """Process-wide prepared image cache, or None when HAIR_PAYLOAD_CACHE=0."""
+    global _default_payload_cache
+    if os.getenv("HAIR_PAYLOAD_CACHE", "1") == "0":
+        return None
+    with _default_payload_cache_lock:
+        if _default_payload_cache is None:
+            _default_payload_cache = PreparedImageCache()
+        return _default_payload_cache
+
+
+def payload_report(image_paths: List[str], policy: Optional[EncodingPolicy] = None) -> Dict:
+    """Compare the policy's payload with the fixed 1024 px / JPEG q90 encoding."""
+    policy = policy or default_policy()
+    legacy = prepare_images(image_paths, max_workers=1, policy=EncodingPolicy(budget_bytes=0), use_cache=False)
+    current = prepare_images(image_paths, max_workers=1, policy=policy, use_cache=False)
+    legacy_bytes = sum(len(p["data"]) for p in legacy)
+    current_bytes = sum(len(p["data"]) for p in current)
+    return {
+        "images": [
+            {"filename": c["filename"], "view": c["view"], "format": c["format"], "quality": c["quality"],
+             "size": c["size"], "legacy_bytes": len(l["data"]), "bytes": len(c["data"])}
+            for l, c in zip(legacy, current)
+        ],
+        "budget_bytes": policy.budget_bytes,
+        "legacy_bytes": legacy_bytes,
+        "bytes": current_bytes,
+        "saved_bytes": legacy_bytes - current_bytes,
+    }
@@ -0,0 +1,252 @@
+"""Streaming Markdown-to-HTML conversion for model output.
+
+Covers the subset Gemini actually produces in analyses and advice: ATX
+headings, bullet and numbered lists (nested by indentation), pipe tables,
+horizontal rules, paragraphs, and inline bold, italics and code. Text is
+HTML-escaped before inline markup is applied.
+
+``MarkdownRenderer`` works line by line in a single pass, so chunks can be
+fed as they stream in; only the new chunk is scanned, so a long line costs
+the same however it is split. Every pattern is precompiled, and inline
+patterns never cross a delimiter, which keeps the work linear in the input
+size.
+
+    renderer = MarkdownRenderer()
+    parts = [renderer.feed(chunk) for chunk in chunks] + [renderer.close()]
+    html = "\n".join(part for part in parts if part)
+
+The engine renders streamed answers this way while they arrive (see
+HairAnalysisEngine.render_streamed). ``markdown_to_html`` converts a
+complete (or partial) response in one call.
+"""
+import re
+from typing import List, Optional, Tuple
+
+_HEADING = re.compile(r"(#{1,6})\s+(.*)$")
+_RULE = re.compile(r"(?:-\s*){3,}$|(?:\*\s*){3,}$|(?:_\s*){3,}$")
+_LIST_ITEM = re.compile(r"([ \t]*)(?:([-*+])|(\d{1,9})[.)])\s+(.*)$")
+_TABLE_SEPARATOR = re.compile(r"\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)*\|?\s*$")
+
+
+def _inline_pattern(stop: str) -> "re.Pattern":
+    # Spans never cross a character in ``stop``. Every alternative starts with its
+    # delimiter (the "_" lookbehind comes after it), so the regex engine can skip
+    # ahead to the next `, * or _ instead of trying each position.
+    return re.compile(
+        rf"`([^`{stop}]+)`"
+        rf"|\*\*([^*{stop}]+)\*\*"
+        rf"|__([^_{stop}]+)__"
+        rf"|\*([^*\s{stop}][^*{stop}]*?)\*"
+        rf"|_(?<!\w_)([^_\s{stop}][^_{stop}]*?)_(?![\w])"
+    )
+
+
+_INLINE = _inline_pattern(r"\n")
+# Table rows are marked up whole, before they are split into cells
+_ROW_INLINE = _inline_pattern(r"\n|")
+# Plain text with none of these needs neither escaping nor inline markup
+_SPECIAL = re.compile(r"[&<>*_`]")
+_EMPHASIS = re.compile(r"(?<![\w])_([^_\s][^_\n]*?)_(?![\w])|\*([^*\s][^*\n]*?)\*")
+
+
+def _inline_match(match: re.Match) -> str:
+    code, bold, bold_alt, em, em_alt = match.groups()
+    if code is not None:
+        return f"<code>{code}</code>"
+    if bold is not None or bold_alt is not None:
+        inner = bold or bold_alt
+        if "*" in inner or "_" in inner:
+            inner = _EMPHASIS.sub(lambda m: f"<em>{m.group(1) or m.group(2)}</em>", inner)
+        return f"<strong>{inner}</strong>"
+    return f"<em>{em or em_alt}</em>"
+
+
+def render_inline(text: str, pattern: "re.Pattern" = _INLINE) -> str:
+    if not _SPECIAL.search(text):
+        return text
+    # html.escape(text, quote=False), without the call
+    return pattern.sub(_inline_match, text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
+
+
+def _indent_width(prefix: str) -> int:
+    return len(prefix.expandtabs(4)) if "\t" in prefix else len(prefix)
+
+
+def _split_row(row: str) -> List[str]:
+    # ``row`` is already stripped
+    if row.startswith("|"):
+        row = row[1:]
+    if row.endswith("|") and not row.endswith("\\|"):
+        row = row[:-1]
+    return [cell.strip() for cell in row.split("|")]
+
+
+def _alignment(spec: str) -> str:
+    if spec.endswith(":"):
+        return ' style="text-align: center"' if spec.startswith(":") else ' style="text-align: right"'
+    return ""
+
+
+# First characters a heading, rule or list item can start with; other lines skip those patterns
+_RULE_START = frozenset("-*_")
+_LIST_START = frozenset("-*+0123456789")
+
+
+class MarkdownRenderer:
+    def __init__(self):
+        # The unfinished last line, as the pieces it arrived in
+        self._tail: List[str] = []
+        # Open lists as (indent, tag), innermost last; each has an open <li>
+        self._lists: List[Tuple[int, str]] = []
+        # A possible table header row waiting for its separator line
+        self._pending_row: Optional[str] = None
+        self._table_columns = 0
+        # Format string for a body row of the open table
+        self._table_row = ""
+
+    def feed(self, chunk: str) -> str:
+        """Consume a chunk and return the HTML for every line it completed."""
+        # Only the new chunk is searched, so a long line costs the same however it is split
+        end = chunk.rfind("\n")
+        if end < 0:
+            if chunk:
+                self._tail.append(chunk)
+            return ""
+        text = chunk[:end]
+        if self._tail:
+            self._tail.append(text)
+            text = "".join(self._tail)
+        self._tail = [chunk[end + 1:]] if end + 1 < len(chunk) else []
+        lines = text.split("\n")
+        if "\r" in text:
+            lines = [line.rstrip("\r") for line in lines]
+        out: List[str] = []
+        render_line = self._line
+        for line in lines:
+            render_line(line, out)
+        return "\n".join(out)
+
+    def close(self) -> str:
+        """Flush the unterminated last line and close any open blocks."""
+        out: List[str] = []
+        if self._tail:
+            self._line("".join(self._tail).rstrip("\r"), out)
+            self._tail = []
+        self._flush_pending(out)
+        self._close_table(out)
+        self._close_lists(out)
+        return "\n".join(out)
+
+    def _line(self, line: str, out: List[str]):
+        stripped = line.strip()
+
+        if self._pending_row is not None:
+            header, self._pending_row = self._pending_row, None
+            if "|" in stripped and _TABLE_SEPARATOR.match(stripped) and len(_split_row(stripped)) == len(_split_row(header)):
+                cells = _split_row(render_inline(header, _ROW_INLINE))
+                align = [_alignment(spec) for spec in _split_row(stripped)]
+                # Each row is then a single format call
+                self._table_row = "<tr>" + "".join(f"<td{a}>{{}}</td>" for a in align) + "</tr>"
+                self._table_columns = len(cells)
+                self._close_lists(out)
+                header_row = "<tr>" + "".join(f"<th{a}>{{}}</th>" for a in align) + "</tr>"
+                out.append("<table>\n<thead>\n" + header_row.format(*cells)
+                           + "\n</thead>\n<tbody>")
+                return
+            self._paragraph(header, out)
+
+        if self._table_columns:
+            if "|" in stripped:
+                cells = _split_row(render_inline(stripped, _ROW_INLINE))
+                if len(cells) != self._table_columns:
+                    cells = (cells + [""] * self._table_columns)[:self._table_columns]
+                out.append(self._table_row.format(*cells))
+                return
+            self._close_table(out)
+
+        if not stripped:
+            # Blank lines end paragraphs only; a list carries on across them
+            return
+
+        first = stripped[0]
+        if first == "|":
+            self._pending_row = stripped
+            return
+
+        if first == "#":
+            heading = _HEADING.match(stripped)
+            if heading:
+                self._close_lists(out)
+                level = len(heading.group(1))
+                # Closing #s are optional; trimmed here rather than by a backtracking pattern
+                text = heading.group(2).rstrip().rstrip("#").rstrip()
+                out.append(f"<h{level}>{render_inline(text)}</h{level}>")
+                return
+
+        # A rule needs three of its character; "- item" is rejected without the regex
+        if first in _RULE_START and stripped.count(first) >= 3 and _RULE.match(stripped):
+            self._close_lists(out)
+            out.append("<hr>")
+            return
+
+        if first in _LIST_START:
+            item = _LIST_ITEM.match(line)
+            if item:
+                indent, _, number, text = item.groups()
+                self._list_item(_indent_width(indent), "ol" if number else "ul", number, text, out)
+                return
+
+        if self._lists and line[:1] in (" ", "\t"):
+            # Indented continuation of the open list item
+            out.append(f"<br>{render_inline(stripped)}")
+            return
+
+        if self._lists:
+            self._close_lists(out)
+        out.append(f"<p>{render_inline(stripped)}</p>")
+
+    def _paragraph(self, text: str, out: List[str]):
+        if self._lists:
+            self._close_lists(out)
+        out.append(f"<p>{render_inline(text)}</p>")
+
+    def _list_item(self, indent: int, tag: str, number: Optional[str], text: str, out: List[str]):
+        lists = self._lists
+        if lists and lists[-1] == (indent, tag):
+            # The next item of the innermost list, by far the most common case
+            out.append("</li>")
+            out.append(f"<li>{render_inline(text)}")
+            return
+        while lists and lists[-1][0] > indent:
+            out.append(f"</li></{lists.pop()[1]}>")
+        if lists and lists[-1][0] == indent:
+            if lists[-1][1] == tag:
+                out.append("</li>")
+            else:
+                out.append(f"</li></{lists.pop()[1]}>")
+        if not lists or lists[-1][0] < indent:
+            start = f' start="{int(number)}"' if tag == "ol" and number and int(number) != 1 else ""
+            out.append(f"<{tag}{start}>")
+            lists.append((indent, tag))
+        out.append(f"<li>{render_inline(text)}")
+
+    def _close_lists(self, out: List[str]):
+        while self._lists:
+            out.append(f"</li></{self._lists.pop()[1]}>")
+
+    def _close_table(self, out: List[str]):
+        if self._table_columns:
+            out.append("</tbody>\n</table>")
+            self._table_columns = 0
+
+    def _flush_pending(self, out: List[str]):
+        if self._pending_row is not None:
+            row, self._pending_row = self._pending_row, None
+            self._paragraph(row, out)
+
+
+def markdown_to_html(text: str) -> str:
+    renderer = MarkdownRenderer()
+    head = renderer.feed(text)
+    tail = renderer.close()
+    return f"{head}\n{tail}" if head and tail else head or tail
@@ -0,0 +1,292 @@
+"""Per-session conversation memory.
+
+Every patient/UI session gets its own bounded LangChain memory instead of one
+global ConversationBufferMemory, so the size of a request depends only on the
+current session and the configured policy:
+
+- ``window``:  keep the last N turns (ConversationBufferWindowMemory)
+- ``tokens``:  keep as many recent turns as fit a token cap (ConversationTokenBufferMemory)
+- ``summary``: roll older turns into a running summary (ConversationSummaryBufferMemory)
+
+Token caps are checked with a local estimate, never by asking the model (see history).
+
+The policy and limits can be set with HAIR_MEMORY_POLICY, HAIR_MEMORY_WINDOW,
+HAIR_MEMORY_MAX_TOKENS, HAIR_MEMORY_MAX_SESSIONS and HAIR_MEMORY_IDLE_TTL.
+
+Image payloads never stay in history: they are stored as content-hash
+references (see image_refs) and re-attached only when a prompt asks for them.
+
+Every model call goes through the process-wide RateLimiter (see ratelimit),
+which throttles to the configured quota and retries transient errors.
+Identical concurrent turns (same history and prompt) share one model call
+through SingleFlight (see singleflight); each session still records the turn.
+
+LangChain is imported, and the model built (when given as ``llm_factory``), only
+when the first conversation is started, so the apps open without waiting for it.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Union
+
+from hair_analysis.image_refs import ImageRefStore
+from hair_analysis.ratelimit import RateLimiter, default_limiter, estimate_tokens
+from hair_analysis.singleflight import FlightAbandoned, SingleFlight
+
+if TYPE_CHECKING:
+    from langchain.chains import ConversationChain
+
+MEMORY_POLICIES = ("window", "tokens", "summary")
+DEFAULT_SESSION = "default"
+
+
+def _total_tokens(chunk) -> Optional[int]:
+    usage = getattr(chunk, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+class SessionMemoryStore:
+    def __init__(self, llm=None, policy: Optional[str] = None, window_turns: Optional[int] = None,
+                 max_tokens: Optional[int] = None, max_sessions: Optional[int] = None,
+                 idle_ttl: Optional[float] = None, verbose: bool = False,
+                 refs: Optional[ImageRefStore] = None, limiter: Optional[RateLimiter] = None,
+                 flights: Optional[SingleFlight] = None, llm_factory: Optional[Callable[[], Any]] = None):
+        if llm is None and llm_factory is None:
+            raise ValueError("SessionMemoryStore needs an llm or an llm_factory")
+        self._llm = llm
+        self._llm_factory = llm_factory
+        self.refs = refs or ImageRefStore()
+        self.limiter = limiter or default_limiter()
+        self.flights = flights or SingleFlight()
+        self.policy = (policy or os.getenv("HAIR_MEMORY_POLICY", "window")).lower()
+        if self.policy not in MEMORY_POLICIES:
+            raise ValueError(f"Unknown memory policy '{self.policy}', expected one of {MEMORY_POLICIES}")
+        self.window_turns = window_turns if window_turns is not None else int(os.getenv("HAIR_MEMORY_WINDOW", "4"))
+        self.max_tokens = max_tokens if max_tokens is not None else int(os.getenv("HAIR_MEMORY_MAX_TOKENS", "4000"))
+        self.max_sessions = max_sessions if max_sessions is not None else int(os.getenv("HAIR_MEMORY_MAX_SESSIONS", "64"))
+        # Seconds a session may sit unused before it is dropped (0 disables)
+        self.idle_ttl = idle_ttl if idle_ttl is not None else float(os.getenv("HAIR_MEMORY_IDLE_TTL", "3600"))
+        self.verbose = verbose
+
+        self._sessions: "OrderedDict[str, ConversationChain]" = OrderedDict()
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._llm_lock = threading.Lock()
+
+    @property
+    def llm(self):
+        """The chat model, built by ``llm_factory`` on first use."""
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    self._llm = self._llm_factory()
+        return self._llm
+
+    def _build_memory(self):
+        from langchain.memory import ConversationBufferWindowMemory
+
+        from hair_analysis.history import CompactChatMessageHistory, LocalSummaryBufferMemory, LocalTokenBufferMemory
+
+        history = CompactChatMessageHistory(self.refs)
+        if self.policy == "window":
+            return ConversationBufferWindowMemory(
+                k=self.window_turns, chat_memory=history, memory_key="history", return_messages=True
+            )
+        if self.policy == "tokens":
+            return LocalTokenBufferMemory(
+                llm=self.llm, max_token_limit=self.max_tokens, chat_memory=history,
+                memory_key="history", return_messages=True
+            )
+        return LocalSummaryBufferMemory(
+            llm=self.llm, max_token_limit=self.max_tokens, chat_memory=history,
+            memory_key="history", return_messages=True, limiter=self.limiter
+        )
+
+    def _expire_idle(self, now: float):
+        if not self.idle_ttl:
+            return
+        for session_id in [s for s, used in self._last_used.items() if now - used > self.idle_ttl]:
+            self._sessions.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+
+    def conversation(self, session_id: str = DEFAULT_SESSION) -> "ConversationChain":
+        """Return the conversation chain for a session, creating it on first use."""
+        from langchain.chains import ConversationChain
+
+        now = time.monotonic()
+        with self._lock:
+            self._expire_idle(now)
+            chain = self._sessions.get(session_id)
+            if chain is None:
+                chain = ConversationChain(llm=self.llm, memory=self._build_memory(), verbose=self.verbose)
+                self._sessions[session_id] = chain
+                while len(self._sessions) > self.max_sessions:
+                    oldest, _ = self._sessions.popitem(last=False)
+                    self._last_used.pop(oldest, None)
+            else:
+                self._sessions.move_to_end(session_id)
+            self._last_used[session_id] = now
+            return chain
+
+    def _history(self, chain: "ConversationChain") -> List:
+        return chain.memory.load_memory_variables({}).get("history", [])
+
+    def _flight_key(self, history: List, content: Union[str, List[Dict]]) -> str:
+        # Images are keyed by their content hash (the same reference history uses), not their bytes
+        digest = hashlib.sha256()
+        for message in history:
+            digest.update(f"{message.type}\x00{message.content}\x00".encode("utf-8"))
+        digest.update(json.dumps(self.refs.compact(content), sort_keys=True, default=str).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _share(self, chain: "ConversationChain", flight, content: Union[str, List[Dict]], response: str) -> str:
+        # The leader records the turn in its own session; followers in other sessions record it too
+        if flight.owner is not chain:
+            chain.memory.save_context({"input": content}, {"response": response})
+        return response
+
+    async def _ashare(self, chain: "ConversationChain", flight, content: Union[str, List[Dict]], response: str) -> str:
+        if flight.owner is not chain:
+            await chain.memory.asave_context({"input": content}, {"response": response})
+        return response
+
+    def invoke(self, session_id: str, content: Union[str, List[Dict]]) -> str:
+        """Run one turn, attaching any image references the prompt asks for."""
+        chain = self.conversation(session_id)
+        inputs = chain.prep_inputs({"input": self.refs.expand(content)})
+        key = self._flight_key(inputs["history"], inputs["input"])
+        while True:
+            flight, leading = self.flights.join(key, chain)
+            if leading:
+                break
+            try:
+                return self._share(chain, flight, inputs["input"], "".join(flight.follow()))
+            except FlightAbandoned:
+                continue
+        # The model is called directly, like stream, so its reported usage can settle the estimate
+        prompts, stop = chain.prep_prompts([inputs])
+        tokens = estimate_tokens(prompts[0].to_messages())
+        with flight:
+            message = self.limiter.call(lambda: self.llm.invoke(prompts[0], stop=stop), tokens)
+            flight.publish(message.content)
+        self.limiter.settle(tokens, _total_tokens(message))
+        chain.memory.save_context({"input": inputs["input"]}, {"response": message.content})
+        return message.content
+
+    async def ainvoke(self, session_id: str, content: Union[str, List[Dict]]) -> str:
+        """Async version of invoke, for event-loop based front-ends."""
+        chain = self.conversation(session_id)
+        inputs = await chain.aprep_inputs({"input": self.refs.expand(content)})
+        key = self._flight_key(inputs["history"], inputs["input"])
+        while True:
+            flight, leading = self.flights.join(key, chain, asynchronous=True)
+            if leading:
+                break
+            try:
+                response = "".join([chunk async for chunk in flight.afollow()])
+            except FlightAbandoned:
+                continue
+            return await self._ashare(chain, flight, inputs["input"], response)
+        prompts, stop = await chain.aprep_prompts([inputs])
+        tokens = estimate_tokens(prompts[0].to_messages())
+        with flight:
+            message = await self.limiter.acall(lambda: self.llm.ainvoke(prompts[0], stop=stop), tokens)
+            flight.publish(message.content)
+        self.limiter.settle(tokens, _total_tokens(message))
+        await chain.memory.asave_context({"input": inputs["input"]}, {"response": message.content})
+        return message.content
+
+    def stream(self, session_id: str, content: Union[str, List[Dict]]) -> Iterator[str]:
+        """Run one turn like invoke, yielding the response text as it is generated."""
+        chain = self.conversation(session_id)
+        inputs = chain.prep_inputs({"input": self.refs.expand(content)})
+        key = self._flight_key(inputs["history"], inputs["input"])
+        while True:
+            flight, leading = self.flights.join(key, chain)
+            if leading:
+                break
+            chunks = []
+            try:
+                for chunk in flight.follow():
+                    chunks.append(chunk)
+                    yield chunk
+            except FlightAbandoned:
+                # Start over only if nothing of the abandoned response was shown
+                if chunks:
+                    raise
+                continue
+            self._share(chain, flight, inputs["input"], "".join(chunks))
+            return
+
+        prompts, stop = chain.prep_prompts([inputs])
+        tokens = estimate_tokens(prompts[0].to_messages())
+        chunks, used = [], None
+        with flight:
+            for chunk in self.limiter.stream(lambda: self.llm.stream(prompts[0], stop=stop), tokens):
+                used = _total_tokens(chunk) or used
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    flight.publish(chunk.content)
+                    yield chunk.content
+        self.limiter.settle(tokens, used)
+        chain.memory.save_context({"input": inputs["input"]}, {"response": "".join(chunks)})
+
+    async def astream(self, session_id: str, content: Union[str, List[Dict]]) -> AsyncIterator[str]:
+        chain = self.conversation(session_id)
+        inputs = await chain.aprep_inputs({"input": self.refs.expand(content)})
+        key = self._flight_key(inputs["history"], inputs["input"])
+        while True:
+            flight, leading = self.flights.join(key, chain, asynchronous=True)
+            if leading:
+                break
+            chunks = []
+            try:
+                async for chunk in flight.afollow():
+                    chunks.append(chunk)
+                    yield chunk
+            except FlightAbandoned:
+                if chunks:
+                    raise
+                continue
+            await self._ashare(chain, flight, inputs["input"], "".join(chunks))
+            return
+
+        prompts, stop = await chain.aprep_prompts([inputs])
+        tokens = estimate_tokens(prompts[0].to_messages())
+        chunks, used = [], None
+        with flight:
+            async for chunk in self.limiter.astream(lambda: self.llm.astream(prompts[0], stop=stop), tokens):
+                used = _total_tokens(chunk) or used
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    flight.publish(chunk.content)
+                    yield chunk.content
+        self.limiter.settle(tokens, used)
+        await chain.memory.asave_context({"input": inputs["input"]}, {"response": "".join(chunks)})
+
+    def record(self, session_id: str, content: Union[str, List[Dict]], response: str):
+        """Add a turn answered elsewhere (e.g. from the analysis cache) to a session's history."""
+        self.conversation(session_id).memory.save_context({"input": content}, {"response": response})
+
+    async def arecord(self, session_id: str, content: Union[str, List[Dict]], response: str):
+        await self.conversation(session_id).memory.asave_context({"input": content}, {"response": response})
+
+    def reset(self, session_id: str = DEFAULT_SESSION):
+        """Clear a session's history but keep the session around."""
+        with self._lock:
+            chain = self._sessions.get(session_id)
+        if chain is not None:
+            chain.memory.clear()
+
+    def evict(self, session_id: str = DEFAULT_SESSION):
+        """Forget a session entirely."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+
+    def sessions(self) -> List[str]:
+        with self._lock:
+            return list(self._sessions)
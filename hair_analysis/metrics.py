@@ -0,0 +1,267 @@
+"""Per-stage timing spans and counters, exported for Prometheus and as JSON lines.
+
+Instrumented code wraps each stage in ``span(stage)`` (or ``timed_iter`` /
+``atimed_iter`` for streamed model output) and bumps counters with
+``count(name, **labels)``. The stages recorded are:
+
+- ``prepare_images`` and, per image, ``image.decode``, ``image.resize``,
+  ``image.classify``, ``image.encode`` and ``image.base64``
+- ``analysis`` and ``advice`` (model calls; other follow-ups are ``ask``)
+- ``convert_to_html``, ``report.render`` and ``report.write``
+
+Everything is off by default. HAIR_METRICS=1 turns recording on;
+HAIR_METRICS_JSONL=<path> also appends one JSON object per finished span to
+that file, and HAIR_METRICS_PORT=<port> serves the Prometheus text format at
+http://127.0.0.1:<port>/metrics once an app calls ``serve_from_env``. Either
+of the last two implies the first. Disabled, ``span`` returns a shared no-op
+context manager and ``count`` returns at once, so instrumented code pays a
+function call and a global lookup per stage.
+
+Spans recorded inside worker processes (HAIR_IMAGE_EXECUTOR=process) stay in
+those processes and are not exported.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+# Upper bounds in seconds, from a cached base64 step to a slow model call
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        # counts[i] is for buckets[i-1] < value <= buckets[i]; the extra slot is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs: Tuple[Tuple[str, str], ...]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS, jsonl_path: Optional[str] = None):
+        self.buckets = buckets
+        self.jsonl_path = jsonl_path
+        self._histograms: Dict[str, Histogram] = {}
+        self._errors: Dict[str, int] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+        self._jsonl = None
+        self._jsonl_lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if error:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+        if self.jsonl_path:
+            self._write_line({"ts": round(time.time(), 6), "stage": stage, "seconds": round(seconds, 6),
+                              "error": error, "thread": threading.current_thread().name})
+
+    def inc(self, name: str, amount: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def _write_line(self, record: Dict):
+        line = json.dumps(record) + "\n"
+        with self._jsonl_lock:
+            if self._jsonl is None:
+                self._jsonl = open(self.jsonl_path, "a", encoding="utf-8", buffering=1)
+            self._jsonl.write(line)
+
+    def snapshot(self) -> Dict:
+        """Count, sum and errors per stage, and every counter."""
+        with self._lock:
+            stages = {stage: {"count": h.count, "sum": h.sum, "errors": self._errors.get(stage, 0)}
+                      for stage, h in self._histograms.items()}
+            counters = {name + _labels(labels): value for (name, labels), value in self._counters.items()}
+        return {"stages": stages, "counters": counters}
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.sum, h.count) for stage, h in self._histograms.items()}
+            errors = dict(self._errors)
+            counters = dict(self._counters)
+        lines = ["# HELP hair_stage_seconds Time spent in each stage of the analysis pipeline.",
+                 "# TYPE hair_stage_seconds histogram"]
+        for stage in sorted(histograms):
+            counts, total, count = histograms[stage]
+            running = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                running += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"hair_stage_seconds_bucket{_labels((('stage', stage), ('le', le)))} {running}")
+            lines.append(f"hair_stage_seconds_sum{_labels((('stage', stage),))} {total}")
+            lines.append(f"hair_stage_seconds_count{_labels((('stage', stage),))} {count}")
+        lines += ["# HELP hair_stage_errors_total Stage runs that raised an error.",
+                  "# TYPE hair_stage_errors_total counter"]
+        lines += [f"hair_stage_errors_total{_labels((('stage', stage),))} {errors.get(stage, 0)}"
+                  for stage in sorted(histograms)]
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE hair_{name}_total counter")
+            lines += [f"hair_{name}_total{_labels(labels)} {value:g}"
+                      for (counter, labels), value in sorted(counters.items()) if counter == name]
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        with self._jsonl_lock:
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
+
+
+class Span:
+    __slots__ = ("registry", "stage", "start")
+
+    def __init__(self, registry: MetricsRegistry, stage: str):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Cancellation and closed generators are timed but are not errors
+        self.registry.observe(self.stage, time.perf_counter() - self.start,
+                              error=isinstance(exc, Exception))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+# None while disabled; the only thing span() and count() look at
+_registry: Optional[MetricsRegistry] = None
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def enable(jsonl_path: Optional[str] = None, buckets: Tuple[float, ...] = BUCKETS) -> MetricsRegistry:
+    """Start recording into a fresh registry and return it."""
+    global _registry
+    disable()
+    _registry = MetricsRegistry(buckets, jsonl_path)
+    return _registry
+
+
+def disable():
+    global _registry
+    registry, _registry = _registry, None
+    if registry is not None:
+        registry.close()
+
+
+def registry() -> Optional[MetricsRegistry]:
+    return _registry
+
+
+def span(stage: str):
+    """Time the enclosed block as ``stage``; a no-op while metrics are disabled."""
+    if _registry is None:
+        return _NOOP
+    return Span(_registry, stage)
+
+
+def count(name: str, amount: float = 1, **labels: str):
+    if _registry is not None:
+        _registry.inc(name, amount, **labels)
+
+
+def timed_iter(stage: str, iterator: Iterator[str]) -> Iterator[str]:
+    """Time a streamed response from the first request to the last chunk."""
+    if _registry is None:
+        return iterator
+    return _timed_iter(_registry, stage, iterator)
+
+
+def _timed_iter(registry: MetricsRegistry, stage: str, iterator: Iterator[str]) -> Iterator[str]:
+    with Span(registry, stage):
+        yield from iterator
+
+
+def atimed_iter(stage: str, iterator: AsyncIterator[str]) -> AsyncIterator[str]:
+    if _registry is None:
+        return iterator
+    return _atimed_iter(_registry, stage, iterator)
+
+
+async def _atimed_iter(registry: MetricsRegistry, stage: str, iterator: AsyncIterator[str]) -> AsyncIterator[str]:
+    with Span(registry, stage):
+        async for chunk in iterator:
+            yield chunk
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = (_registry.prometheus() if _registry is not None else "").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread; later calls return the running server."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        return _server
+
+
+def serve_from_env() -> Optional[ThreadingHTTPServer]:
+    """Start the endpoint when HAIR_METRICS_PORT is set; called by the apps at start-up."""
+    port = os.getenv("HAIR_METRICS_PORT")
+    if not port or _registry is None:
+        return None
+    return serve(int(port))
+
+
+def _configure_from_env():
+    jsonl_path = os.getenv("HAIR_METRICS_JSONL") or None
+    if os.getenv("HAIR_METRICS", "0") == "1" or jsonl_path or os.getenv("HAIR_METRICS_PORT"):
+        enable(jsonl_path)
+
+
+_configure_from_env()
@@ -0,0 +1,243 @@
+"""Process-wide rate limiting and retries for model calls.
+
+RateLimiter keeps two token buckets, one for requests per minute and one for
+(estimated) tokens per minute, shared by every session and thread in the
+process. A call reserves its share up front; when a bucket is overdrawn the
+caller waits until it refills, so concurrent callers are served in arrival
+order and throughput settles at the quota instead of bursting into 429s.
+
+Calls that still fail with a retryable error (quota, rate limit, overload,
+timeout) are retried with full-jitter exponential backoff.
+
+Limits come from HAIR_RATE_RPM and HAIR_RATE_TPM (0 disables a bucket), and
+retries from HAIR_RATE_MAX_RETRIES, HAIR_RATE_BASE_DELAY and
+HAIR_RATE_MAX_DELAY. ``metrics()`` reports queue depth and wait times.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar, Union
+
+T = TypeVar("T")
+
+# Rough cost of one image part in Gemini's token accounting
+IMAGE_TOKENS = 258
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+                   "InternalServerError", "GatewayTimeout", "RateLimitError", "TimeoutError"}
+RETRYABLE_MESSAGES = ("429", "quota", "rate limit", "resource exhausted", "resource has been exhausted",
+                      "overloaded", "unavailable", "deadline exceeded", "timed out")
+
+
+def estimate_tokens(content: Union[str, List[Dict], List]) -> int:
+    """Rough token count of a prompt: ~4 characters per token plus a flat cost per image."""
+    if isinstance(content, str):
+        return len(content) // 4 + 1
+    total = 0
+    for part in content:
+        # Chat messages carry their content on .content
+        part = getattr(part, "content", part)
+        if isinstance(part, str):
+            total += len(part) // 4 + 1
+        elif isinstance(part, list):
+            total += estimate_tokens(part)
+        elif isinstance(part, dict):
+            if part.get("type") in ("image_url", "image", "image_ref"):
+                total += IMAGE_TOKENS
+            else:
+                total += len(str(part.get("text", ""))) // 4 + 1
+    return total
+
+
+def is_retryable(error: BaseException) -> bool:
+    for cls in type(error).__mro__:
+        if cls.__name__ in RETRYABLE_NAMES:
+            return True
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(status, int) and status in RETRYABLE_STATUS:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RETRYABLE_MESSAGES)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.capacity = float(capacity or per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take ``amount`` now and return how long the caller must wait for it."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # A request larger than the bucket would never fit; let it through at full capacity
+        self.level -= min(amount, self.capacity)
+        return -self.level / self.rate if self.level < 0 else 0.0
+
+    def refund(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 max_retries: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None, burst: Optional[int] = None):
+        rpm = rpm if rpm is not None else float(os.getenv("HAIR_RATE_RPM", "60"))
+        tpm = tpm if tpm is not None else float(os.getenv("HAIR_RATE_TPM", "1000000"))
+        # burst caps how many requests may go out back to back (default: a full minute's worth)
+        self.requests = TokenBucket(rpm, burst) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("HAIR_RATE_MAX_RETRIES", "5"))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv("HAIR_RATE_BASE_DELAY", "1.0"))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("HAIR_RATE_MAX_DELAY", "60"))
+
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._recent_waits = deque(maxlen=1000)
+        self._counters = {"requests": 0, "throttled": 0, "retries": 0, "failures": 0,
+                          "wait_seconds": 0.0, "max_wait": 0.0, "max_queue_depth": 0}
+
+    def _reserve(self, tokens: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            if self.requests is not None:
+                wait = self.requests.reserve(1, now)
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            counters = self._counters
+            counters["requests"] += 1
+            self._recent_waits.append(wait)
+            if wait > 0:
+                counters["throttled"] += 1
+                counters["wait_seconds"] += wait
+                counters["max_wait"] = max(counters["max_wait"], wait)
+                self._waiting += 1
+                counters["max_queue_depth"] = max(counters["max_queue_depth"], self._waiting)
+            return wait
+
+    def _done_waiting(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Block until a request of ``tokens`` estimated tokens may be sent; returns the wait."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done_waiting()
+        return wait
+
+    async def aacquire(self, tokens: int = 1) -> float:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._done_waiting()
+        return wait
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """Correct the token bucket once a response reports its real usage."""
+        if self.tokens is None or not actual:
+            return
+        with self._lock:
+            self.tokens.refund(estimated - actual)
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        retry_after = getattr(error, "retry_after", None)
+        if isinstance(retry_after, (int, float)) and retry_after > 0:
+            return min(self.max_delay, float(retry_after))
+        # Full jitter keeps retrying callers from stampeding together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def should_retry(self, attempt: int, error: BaseException) -> bool:
+        retry = attempt < self.max_retries and is_retryable(error)
+        with self._lock:
+            self._counters["retries" if retry else "failures"] += 1
+        return retry
+
+    def call(self, fn: Callable[[], T], tokens: int = 1) -> T:
+        """Run ``fn`` under the limits, retrying retryable errors."""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                return fn()
+            except Exception as e:
+                if not self.should_retry(attempt, e):
+                    raise
+                time.sleep(self.backoff(attempt, e))
+                attempt += 1
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], tokens: int = 1) -> T:
+        attempt = 0
+        while True:
+            await self.aacquire(tokens)
+            try:
+                return await fn()
+            except Exception as e:
+                if not self.should_retry(attempt, e):
+                    raise
+                await asyncio.sleep(self.backoff(attempt, e))
+                attempt += 1
+
+    def stream(self, fn: Callable[[], Iterator[T]], tokens: int = 1) -> Iterator[T]:
+        """Like call for a streaming response; retries only until the first item arrives."""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            started = False
+            try:
+                for item in fn():
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                if started or not self.should_retry(attempt, e):
+                    raise
+                time.sleep(self.backoff(attempt, e))
+                attempt += 1
+
+    async def astream(self, fn: Callable[[], AsyncIterator[T]], tokens: int = 1) -> AsyncIterator[T]:
+        attempt = 0
+        while True:
+            await self.aacquire(tokens)
+            started = False
+            try:
+                async for item in fn():
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                if started or not self.should_retry(attempt, e):
+                    raise
+                await asyncio.sleep(self.backoff(attempt, e))
+                attempt += 1
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            waits = sorted(self._recent_waits)
+            metrics = dict(self._counters, queue_depth=self._waiting)
+        metrics["p50_wait"] = waits[len(waits) // 2] if waits else 0.0
+        metrics["p95_wait"] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return metrics
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def default_limiter() -> RateLimiter:
+    """The limiter shared by every model call in this process."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
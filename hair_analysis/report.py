@@ -0,0 +1,223 @@
+"""HTML report rendering shared by both apps.
+
+The report layout lives in templates/report.html and its stylesheet in
+templates/report.css. The template is parsed once into literal segments and
+field names, so rendering a report is a single ``str.join``. Patient fields
+are HTML-escaped; the analysis and advice sections are inserted as the HTML
+they already are.
+
+The stylesheet is inlined by default so a report is a single file. For bulk
+output pass ``stylesheet_mode="external"`` and call ``write_stylesheet`` once for
+the output directory.
+
+ReportCache renders a report once per (analysis, advice, patient fields)
+and hands back the same report, with the same report ID and bytes, until any
+of them change. Preview and save share it, so the saved file is exactly the
+report that was previewed.
+"""
+import datetime
+import hashlib
+import html
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from hair_analysis import metrics
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+STYLESHEET_NAME = "report.css"
+# Fields inserted without escaping
+RAW_FIELDS = frozenset({"stylesheet", "analysis_html", "advice_html"})
+
+_FIELD_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+class ReportTemplate:
+    def __init__(self, source: str):
+        self.parts: List[str] = []
+        # (index in parts, field name, escape?)
+        self.slots: List[Tuple[int, str, bool]] = []
+        position = 0
+        for match in _FIELD_PATTERN.finditer(source):
+            self.parts.append(source[position:match.start()])
+            name = match.group(1)
+            self.slots.append((len(self.parts), name, name not in RAW_FIELDS))
+            self.parts.append("")
+            position = match.end()
+        self.parts.append(source[position:])
+        self.fields = frozenset(name for _, name, _ in self.slots)
+
+    def render(self, context: Dict[str, str]) -> str:
+        parts = list(self.parts)
+        for index, name, escape in self.slots:
+            value = str(context.get(name, ""))
+            parts[index] = html.escape(value) if escape else value
+        return "".join(parts)
+
+
+_cache: Dict[str, object] = {}
+_cache_lock = threading.Lock()
+
+
+def _load(name: str) -> str:
+    with open(os.path.join(TEMPLATE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def report_template() -> ReportTemplate:
+    with _cache_lock:
+        if "template" not in _cache:
+            _cache["template"] = ReportTemplate(_load("report.html"))
+        return _cache["template"]
+
+
+def stylesheet() -> str:
+    with _cache_lock:
+        if "stylesheet" not in _cache:
+            _cache["stylesheet"] = _load(STYLESHEET_NAME)
+        return _cache["stylesheet"]
+
+
+def _style_block(mode: str) -> str:
+    with _cache_lock:
+        block = _cache.get("block:" + mode)
+    if block is None:
+        if mode == "external":
+            block = f'<link rel="stylesheet" href="{STYLESHEET_NAME}">'
+        else:
+            block = f"<style>\n{stylesheet()}</style>"
+        with _cache_lock:
+            _cache["block:" + mode] = block
+    return block
+
+
+def write_stylesheet(directory: str) -> str:
+    """Write the shared stylesheet next to externally-styled reports."""
+    path = os.path.join(directory, STYLESHEET_NAME)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(stylesheet())
+    return path
+
+
+def new_report_id() -> str:
+    # 64 random bits: IDs must not repeat, across restarts too
+    return f"HA{uuid.uuid4().hex[:16].upper()}-{datetime.datetime.now().strftime('%Y%m%d')}"
+
+
+def calculate_age(dob: str) -> str:
+    if not dob:
+        return ""
+    try:
+        # fromisoformat is much cheaper than strptime on the render path
+        birth_date = datetime.date.fromisoformat(dob)
+    except ValueError:
+        return "N/A"
+    today = datetime.date.today()
+    return str(today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day)))
+
+
+def render_report(analysis_html: str, advice_html: str, patient_name: str = "", patient_id: str = "",
+                  dob: str = "", gender: str = "", hospital_name: str = "", doctor_name: str = "",
+                  analysis_date: str = "", report_id: Optional[str] = None, stylesheet_mode: str = "inline",
+                  generated_at: Optional[datetime.datetime] = None) -> str:
+    generated_at = generated_at or datetime.datetime.now()
+    with metrics.span("report.render"):
+        return _render_report(analysis_html, advice_html, patient_name, patient_id, dob, gender, hospital_name,
+                              doctor_name, analysis_date, report_id, stylesheet_mode, generated_at)
+
+
+def _render_report(analysis_html: str, advice_html: str, patient_name: str, patient_id: str, dob: str, gender: str,
+                   hospital_name: str, doctor_name: str, analysis_date: str, report_id: Optional[str],
+                   stylesheet_mode: str, generated_at: datetime.datetime) -> str:
+    return report_template().render({
+        "stylesheet": _style_block(stylesheet_mode),
+        "title_name": patient_name or "Patient",
+        "clinic_name": hospital_name or "Hair Analysis Center",
+        "patient_name": patient_name or "Not specified",
+        "patient_id": patient_id or "N/A",
+        "dob": dob or "N/A",
+        "age": calculate_age(dob),
+        "gender": gender or "N/A",
+        "doctor_name": doctor_name or "Not specified",
+        "report_id": report_id or "N/A",
+        "analysis_date": analysis_date or "N/A",
+        "generated_at": generated_at.isoformat(" ", "seconds"),
+        "analysis_html": analysis_html,
+        "advice_html": advice_html,
+        "signature_name": doctor_name or "Hair Specialist",
+        "year": generated_at.year,
+    })
+
+
+class RenderedReport:
+    def __init__(self, key: str, report_id: str, html_content: str):
+        self.key = key
+        self.report_id = report_id
+        self.html = html_content
+        # Encoded once so every save writes identical bytes
+        self.data = html_content.encode("utf-8")
+
+    def write(self, path: str):
+        with metrics.span("report.write"), open(path, "wb") as f:
+            f.write(self.data)
+
+    def save(self, path: str) -> bool:
+        """Write the report unless ``path`` already holds exactly these bytes; returns whether it wrote."""
+        try:
+            if os.path.getsize(path) == len(self.data):
+                with open(path, "rb") as f:
+                    if f.read() == self.data:
+                        return False
+        except OSError:
+            pass
+        self.write(path)
+        return True
+
+
+class ReportCache:
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._reports: "OrderedDict[str, RenderedReport]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "renders": 0}
+
+    @staticmethod
+    def key(analysis: str, advice: str, stylesheet_mode: str = "inline", **fields: str) -> str:
+        parts = [stylesheet_mode, analysis or "", advice or ""]
+        parts += [f"{name}={fields[name] or ''}" for name in sorted(fields)]
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def render(self, analysis: str, advice: str, convert: Callable[[str], str],
+               stylesheet_mode: str = "inline", **fields: str) -> RenderedReport:
+        """Return the cached report for this content, rendering it on first use."""
+        key = self.key(analysis, advice, stylesheet_mode, **fields)
+        with self._lock:
+            report = self._reports.get(key)
+            if report is not None:
+                self._reports.move_to_end(key)
+                self._counters["hits"] += 1
+                return report
+
+        report_id = new_report_id()
+        report = RenderedReport(key, report_id, render_report(
+            convert(analysis), convert(advice), report_id=report_id, stylesheet_mode=stylesheet_mode, **fields
+        ))
+        with self._lock:
+            # Another thread may have rendered the same report meanwhile; keep the first
+            report = self._reports.setdefault(key, report)
+            self._reports.move_to_end(key)
+            self._counters["renders"] += 1
+            while len(self._reports) > self.max_entries:
+                self._reports.popitem(last=False)
+        return report
+
+    def clear(self):
+        with self._lock:
+            self._reports.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, entries=len(self._reports))
@@ -0,0 +1,157 @@
+"""Single-flight sharing of identical in-flight model calls.
+
+When a second caller asks for exactly the same prompt while the first call is
+still running (a double-clicked "Analyze Hair", two tabs with the same
+photos), it joins that call instead of sending another multi-megabyte request.
+The first caller leads the flight and publishes its chunks as they arrive;
+followers replay what has been published so far and then wait for the rest,
+from threads (``follow``) or from an event loop (``afollow``).
+
+If the leader is cancelled or closed mid-stream the flight is abandoned and
+followers get FlightAbandoned, so they can start a call of their own. Any other
+error is passed on to every follower.
+
+Set HAIR_SINGLE_FLIGHT=0 to send every call separately.
+"""
+import asyncio
+import os
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+
+class FlightAbandoned(RuntimeError):
+    """The call being shared was cancelled before it finished."""
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Flight:
+    def __init__(self, group: Optional["SingleFlight"], key: str, owner: Any = None):
+        self.group = group
+        self.key = key
+        # Whatever the leader passed in, e.g. its conversation chain
+        self.owner = owner
+        self.thread = threading.get_ident()
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._cond = threading.Condition()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def publish(self, chunk: str):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self):
+        self._close(None)
+
+    def fail(self, error: BaseException):
+        # Exceptions are shared; cancellation and generator close only concern the leader
+        self._close(error if isinstance(error, Exception) else FlightAbandoned("the shared request was cancelled"))
+
+    def _close(self, error: Optional[BaseException]):
+        if self.group is not None:
+            self.group._land(self, error)
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        self._waiters.clear()
+
+    def __enter__(self) -> "Flight":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None:
+            self.finish()
+        else:
+            self.fail(exc)
+        return False
+
+    def follow(self) -> Iterator[str]:
+        """Yield every chunk of the flight, blocking the calling thread while it runs."""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                chunks = self.chunks[index:]
+                done, error = self.done, self.error
+            index += len(chunks)
+            yield from chunks
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    async def afollow(self) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            future = None
+            with self._cond:
+                chunks = self.chunks[index:]
+                done, error = self.done, self.error
+                if not chunks and not done:
+                    future = loop.create_future()
+                    self._waiters.append((loop, future))
+            if future is not None:
+                await future
+                continue
+            index += len(chunks)
+            for chunk in chunks:
+                yield chunk
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = enabled if enabled is not None else os.getenv("HAIR_SINGLE_FLIGHT", "1") != "0"
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self._counters = {"leaders": 0, "followers": 0, "abandoned": 0, "failed": 0}
+
+    def join(self, key: str, owner: Any = None, asynchronous: bool = False) -> Tuple[Flight, bool]:
+        """Return the flight for ``key`` and whether the caller leads it.
+
+        A leader must run the call, publish its output and close the flight
+        (using it as a context manager does the closing). Threaded callers never
+        follow a flight led from their own thread, which could never finish.
+        """
+        with self._lock:
+            flight = self._flights.get(key) if self.enabled else None
+            if flight is not None and (asynchronous or flight.thread != threading.get_ident()):
+                self._counters["followers"] += 1
+                return flight, False
+            self._counters["leaders"] += 1
+            if not self.enabled or flight is not None:
+                return Flight(None, key, owner), True
+            flight = self._flights[key] = Flight(self, key, owner)
+            return flight, True
+
+    def _land(self, flight: Flight, error: Optional[BaseException]):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if isinstance(error, FlightAbandoned):
+                self._counters["abandoned"] += 1
+            elif error is not None:
+                self._counters["failed"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._flights)
+        return stats
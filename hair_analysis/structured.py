@@ -0,0 +1,169 @@
+"""Structured (JSON) hair analysis results.
+
+With HAIR_STRUCTURED_ANALYSIS=1 the analysis prompts ask the model for a JSON
+object matching ANALYSIS_SCHEMA instead of free text. The reply is validated
+and parsed into a HairAnalysis, which is shown to the user as Markdown. Its
+``compact()`` form goes into follow-up prompts in place of the full analysis,
+so advice and product calls send a few hundred characters, not the whole
+findings text.
+
+Replies that do not parse fall back to the free-text behaviour.
+"""
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+TEXTURES = ("straight", "wavy", "curly", "coily", "unclear")
+DENSITIES = ("thin", "medium", "thick", "unclear")
+DIAMETERS = ("fine", "medium", "coarse", "unclear")
+POROSITIES = ("low", "normal", "high", "unclear")
+# Below this overall confidence the photos are treated as inconclusive
+UNCLEAR_CONFIDENCE = 0.5
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "required": ["texture", "density", "diameter", "porosity", "scalp_findings", "damage", "confidence"],
+    "properties": {
+        "texture": {"enum": list(TEXTURES)},
+        "density": {"enum": list(DENSITIES)},
+        "diameter": {"enum": list(DIAMETERS)},
+        "porosity": {"enum": list(POROSITIES)},
+        "scalp_findings": {"type": "array", "items": {"type": "string"}},
+        "damage": {"type": "array", "items": {"type": "string"}},
+        "observations": {"type": "array", "items": {"type": "string"}},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    },
+}
+
+JSON_INSTRUCTIONS = f"""
+        Respond with ONLY a JSON object, no other text, matching this JSON Schema:
+        {json.dumps(ANALYSIS_SCHEMA)}
+        Use short phrases in the arrays. Use "unclear" for anything the images do not show,
+        and set "confidence" (0 to 1) to your overall confidence in the findings.
+        """
+
+
+def structured_enabled() -> bool:
+    return os.getenv("HAIR_STRUCTURED_ANALYSIS", "0") == "1"
+
+
+class AnalysisFormatError(ValueError):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class HairAnalysis:
+    texture: str
+    density: str
+    diameter: str
+    porosity: str
+    scalp_findings: Tuple[str, ...]
+    damage: Tuple[str, ...]
+    confidence: float
+    observations: Tuple[str, ...] = ()
+
+    @property
+    def is_unclear(self) -> bool:
+        return (self.confidence < UNCLEAR_CONFIDENCE or
+                "unclear" in (self.texture, self.density, self.diameter, self.porosity))
+
+    def compact(self) -> str:
+        """The findings in a few hundred characters, for follow-up prompts."""
+        fields = [
+            f"texture={self.texture}",
+            f"density={self.density}",
+            f"diameter={self.diameter}",
+            f"porosity={self.porosity}",
+            f"scalp={', '.join(self.scalp_findings) or 'none noted'}",
+            f"damage={', '.join(self.damage) or 'none noted'}",
+        ]
+        if self.observations:
+            fields.append(f"other={', '.join(self.observations)}")
+        fields.append(f"confidence={self.confidence:.2f}")
+        return "; ".join(fields)
+
+    def to_markdown(self) -> str:
+        lines = [
+            "## Hair Characteristics",
+            f"- **Texture:** {self.texture.capitalize()}",
+            f"- **Density:** {self.density.capitalize()}",
+            f"- **Diameter:** {self.diameter.capitalize()}",
+            f"- **Porosity:** {self.porosity.capitalize()}",
+        ]
+        for title, items in (("Scalp Findings", self.scalp_findings), ("Damage", self.damage),
+                             ("Additional Observations", self.observations)):
+            if items:
+                lines += ["", f"## {title}"] + [f"- {item}" for item in items]
+        lines += ["", f"**Overall confidence:** {self.confidence:.0%}"]
+        return "\n".join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps({name: getattr(self, name) for name in self.__slots__})
+
+
+def _choice(data: Dict, name: str, choices: Sequence[str]) -> str:
+    value = str(data.get(name, "")).strip().lower()
+    if value not in choices:
+        raise AnalysisFormatError(f"{name} must be one of {', '.join(choices)}, got {value!r}")
+    return value
+
+
+def _strings(data: Dict, name: str, required: bool = True) -> Tuple[str, ...]:
+    value = data.get(name)
+    if value is None and not required:
+        return ()
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise AnalysisFormatError(f"{name} must be a list of strings")
+    return tuple(item.strip() for item in value if item.strip())
+
+
+def parse_analysis(text: str) -> HairAnalysis:
+    """Validate a model reply against ANALYSIS_SCHEMA; raises AnalysisFormatError."""
+    # Models often wrap JSON in a ```json fence or a sentence; take the outermost object
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise AnalysisFormatError("no JSON object in the analysis")
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise AnalysisFormatError(f"invalid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise AnalysisFormatError("the analysis must be a JSON object")
+
+    confidence = data.get("confidence")
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+        raise AnalysisFormatError("confidence must be a number")
+    if 1 < confidence <= 100:
+        # Tolerate percentages
+        confidence = confidence / 100
+    if not 0 <= confidence <= 1:
+        raise AnalysisFormatError("confidence must be between 0 and 1")
+
+    return HairAnalysis(
+        texture=_choice(data, "texture", TEXTURES),
+        density=_choice(data, "density", DENSITIES),
+        diameter=_choice(data, "diameter", DIAMETERS),
+        porosity=_choice(data, "porosity", POROSITIES),
+        scalp_findings=_strings(data, "scalp_findings"),
+        damage=_strings(data, "damage"),
+        confidence=float(confidence),
+        observations=_strings(data, "observations", required=False),
+    )
+
+
+def try_parse_analysis(text: str) -> Optional[HairAnalysis]:
+    try:
+        return parse_analysis(text)
+    except AnalysisFormatError:
+        return None
+
+
+def analysis_context(analysis: Union[str, HairAnalysis]) -> str:
+    """What follow-up prompts should quote: compact fields when available."""
+    if isinstance(analysis, HairAnalysis):
+        return analysis.compact()
+    if not structured_enabled():
+        return analysis
+    result = try_parse_analysis(analysis)
+    return result.compact() if result is not None else analysis
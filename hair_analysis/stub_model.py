@@ -0,0 +1,236 @@
+"""A local stand-in for the Gemini chat model, for load tests and offline runs.
+
+StubChatModel answers every prompt with a canned but realistic reply from
+data/stub_responses.json: hair analyses (Markdown, or JSON in structured mode),
+treatment and care plans, product tables and narratives, memory summaries.
+The same images always get the same profile, and the plans follow the hair
+type named in the analysis they are given.
+
+Timing is simulated rather than skipped, so the pipeline's own throughput and
+tail latency can be measured without network access:
+
+- ``latency``: time to first chunk, as ``fixed:S``, ``uniform:LOW,HIGH``,
+  ``exponential:MEAN`` or ``lognormal:MEDIAN,P95`` (seconds)
+- ``chunk_rate``: streamed chunks per second (0 sends them back to back)
+- ``chunk_chars``: characters per chunk
+- ``error_rate``: share of calls rejected up front with a 429-style
+  ResourceExhausted, which the rate limiter retries like a real quota error
+
+``from_env`` reads these from HAIR_STUB_LATENCY, HAIR_STUB_CHUNK_RATE,
+HAIR_STUB_CHUNK_CHARS, HAIR_STUB_ERROR_RATE and HAIR_STUB_SEED.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from hair_analysis.ratelimit import estimate_tokens
+from hair_analysis.structured import JSON_INSTRUCTIONS
+
+DEFAULT_RESPONSES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stub_responses.json")
+LATENCY_KINDS = ("fixed", "uniform", "exponential", "lognormal")
+# z-score of the 95th percentile of a standard normal
+Z95 = 1.6449
+IMAGE_URL = re.compile(r"data:image/[^'\"]+")
+JSON_MARKER = JSON_INSTRUCTIONS.strip().splitlines()[0].strip()
+
+
+class ResourceExhausted(RuntimeError):
+    """Simulated quota rejection; named like Gemini's so it is retried the same way."""
+
+    code = 429
+
+
+@dataclass(frozen=True, slots=True)
+class LatencyDistribution:
+    kind: str
+    a: float
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, _, args = spec.strip().lower().partition(":")
+        if kind not in LATENCY_KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}', expected one of {LATENCY_KINDS}")
+        try:
+            values = [float(v) for v in args.split(",") if v.strip()]
+        except ValueError:
+            raise ValueError(f"Bad latency spec '{spec}'") from None
+        expected = 2 if kind in ("uniform", "lognormal") else 1
+        if len(values) != expected or min(values) < 0:
+            raise ValueError(f"Latency '{kind}' takes {expected} non-negative value(s), got '{spec}'")
+        if kind == "lognormal" and not 0 < values[0] <= values[1]:
+            raise ValueError(f"Lognormal latency needs 0 < median <= p95, got '{spec}'")
+        return cls(kind, *values)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.a
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "exponential":
+            return rng.expovariate(1 / self.a) if self.a else 0.0
+        # median and p95 pin down mu and sigma of the underlying normal
+        return rng.lognormvariate(math.log(self.a), math.log(self.b / self.a) / Z95)
+
+
+def load_responses(path: str = DEFAULT_RESPONSES_PATH) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    # Content lists are flattened the way LangChain's string prompts render them
+    return str(content)
+
+
+class StubChatModel(BaseChatModel):
+    latency: str = "lognormal:1.0,3.0"
+    chunk_rate: float = 40.0
+    chunk_chars: int = 24
+    error_rate: float = 0.0
+    seed: Optional[int] = None
+    responses_path: str = DEFAULT_RESPONSES_PATH
+
+    _rng: random.Random = PrivateAttr()
+    _rng_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _distribution: LatencyDistribution = PrivateAttr()
+    _responses: Dict = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        if not 0 <= self.error_rate <= 1:
+            raise ValueError(f"error_rate must be between 0 and 1, got {self.error_rate}")
+        self._rng = random.Random(self.seed)
+        self._distribution = LatencyDistribution.parse(self.latency)
+        self._responses = load_responses(self.responses_path)
+
+    @classmethod
+    def from_env(cls) -> "StubChatModel":
+        seed = os.getenv("HAIR_STUB_SEED")
+        return cls(
+            latency=os.getenv("HAIR_STUB_LATENCY", "lognormal:1.0,3.0"),
+            chunk_rate=float(os.getenv("HAIR_STUB_CHUNK_RATE", "40")),
+            chunk_chars=int(os.getenv("HAIR_STUB_CHUNK_CHARS", "24")),
+            error_rate=float(os.getenv("HAIR_STUB_ERROR_RATE", "0")),
+            seed=int(seed) if seed else None,
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "hair-stub"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"latency": self.latency, "chunk_rate": self.chunk_rate, "chunk_chars": self.chunk_chars,
+                "error_rate": self.error_rate}
+
+    # Canned replies
+
+    def reply(self, messages: List[BaseMessage]) -> str:
+        """The canned reply for a prompt, chosen from the current turn only."""
+        prompt = _text(messages[-1].content) if messages else ""
+        # ConversationChain renders history and input into one "...Human: <input>\nAI:" string
+        turn = prompt.rpartition("Human:")[2] or prompt
+        lowered = turn.lower()
+        profiles = self._responses["profiles"]
+        if "analyze this hair image" in lowered or "analyze these" in lowered:
+            # Keyed by the images alone, so plain and structured prompts describe the same hair
+            images = "".join(IMAGE_URL.findall(turn)) or turn
+            profile = profiles[int(hashlib.sha256(images.encode()).hexdigest(), 16) % len(profiles)]
+            if JSON_MARKER in turn:
+                return json.dumps(profile["analysis_json"], indent=2)
+            return profile["analysis"]
+        if "progressively summarize" in lowered:
+            return self._responses["summary"]
+        if "format as a clear table" in lowered:
+            return self._responses["products"]
+        profile = self._profile_for(lowered)
+        if "these products were selected" in lowered:
+            return profile["narrative"] if profile else self._responses["answer"]
+        if "treatment plan" in lowered or "care recommendations" in lowered:
+            return (profile or profiles[0])["plan"]
+        return self._responses["answer"]
+
+    def _profile_for(self, text: str) -> Optional[Dict]:
+        # Follow-ups carry the analysis; the earliest texture it mentions picks the matching profile
+        found = [(text.find(p["texture"]), p) for p in self._responses["profiles"] if p["texture"] in text]
+        return min(found, key=lambda item: item[0])[1] if found else None
+
+    # Timing
+
+    def _plan(self) -> float:
+        """Time to first chunk for one call; raises ResourceExhausted for a simulated rejection."""
+        with self._rng_lock:
+            rejected = self._rng.random() < self.error_rate
+            delay = self._distribution.sample(self._rng)
+        if rejected:
+            # Quota errors come back at once, before any output
+            raise ResourceExhausted("429 Resource has been exhausted (simulated by the stub backend)")
+        return delay
+
+    def _chunks(self, messages: List[BaseMessage]) -> Iterator[ChatGenerationChunk]:
+        reply = self.reply(messages)
+        size = max(1, self.chunk_chars)
+        pieces = [reply[i:i + size] for i in range(0, len(reply), size)] or [""]
+        for i, piece in enumerate(pieces):
+            message = AIMessageChunk(content=piece)
+            if i == len(pieces) - 1:
+                input_tokens = estimate_tokens(messages)
+                output_tokens = len(reply) // 4 + 1
+                message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                          "total_tokens": input_tokens + output_tokens}
+            yield ChatGenerationChunk(message=message)
+
+    @property
+    def _chunk_interval(self) -> float:
+        return 1 / self.chunk_rate if self.chunk_rate > 0 else 0.0
+
+    # LangChain interface
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._plan())
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i and self._chunk_interval:
+                time.sleep(self._chunk_interval)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._plan())
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i and self._chunk_interval:
+                await asyncio.sleep(self._chunk_interval)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        return self._result(list(self._stream(messages, stop, run_manager, **kwargs)))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        return self._result([chunk async for chunk in self._astream(messages, stop, run_manager, **kwargs)])
+
+    def _result(self, chunks: List[ChatGenerationChunk]) -> ChatResult:
+        message = AIMessage(content="".join(chunk.text for chunk in chunks),
+                            usage_metadata=chunks[-1].message.usage_metadata)
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The package is used from a checkout, not installed; V2/appv2.py is imported as ``appv2``
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "V2"))
+
+
+@pytest.fixture(autouse=True)
+def isolated_env(tmp_path, monkeypatch):
+    """Keep caches out of ~/.cache and start every test with metrics off and no rate limits."""
+    monkeypatch.setenv("HAIR_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("HAIR_RATE_RPM", "0")
+    monkeypatch.setenv("HAIR_RATE_TPM", "0")
+    for name in ("HAIR_METRICS", "HAIR_METRICS_JSONL", "HAIR_METRICS_PORT", "HAIR_LLM_BACKEND"):
+        monkeypatch.delenv(name, raising=False)
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from hair_analysis.admission import AdmissionGate, GateFull
+
+
+def test_gate_runs_queues_then_sheds():
+    async def run():
+        gate = AdmissionGate("analysis", limit=1, max_waiting=1)
+        running = gate.admit()
+        waiting = gate.admit()
+        with pytest.raises(GateFull):
+            gate.admit()
+        assert running.admitted and not waiting.admitted and waiting.position == 1
+        running.close()
+        assert waiting.admitted and waiting.position == 0
+        waiting.close()
+        return gate.stats()
+
+    stats = asyncio.run(run())
+    assert stats["shed"] == 1 and stats["queued"] == 1 and stats["admitted"] == 2
+    assert stats["active"] == 0 and stats["waiting"] == 0
+
+
+def test_handover_keeps_arrival_order():
+    async def run():
+        gate = AdmissionGate("analysis", limit=1, max_waiting=3)
+        order = []
+
+        async def request(name):
+            ticket = gate.admit()
+            try:
+                while not ticket.admitted:
+                    await ticket.moved()
+                order.append(name)
+                await asyncio.sleep(0.01)
+            finally:
+                ticket.close()
+
+        await asyncio.gather(*(request(name) for name in "abcd"))
+        return order
+
+    assert asyncio.run(run()) == list("abcd")
+
+
+def test_leaving_the_line_moves_everyone_up():
+    async def run():
+        gate = AdmissionGate("analysis", limit=1, max_waiting=2)
+        running, first, second = gate.admit(), gate.admit(), gate.admit()
+        moved = asyncio.create_task(second.moved())
+        await asyncio.sleep(0)
+        first.close()
+        first.close()
+        await asyncio.wait_for(moved, 1)
+        assert second.position == 1
+        running.close()
+        assert second.admitted
+        second.close()
+        return gate.stats()
+
+    assert asyncio.run(run())["active"] == 0
+
+
+def test_overflowing_analyses_get_the_busy_message(tmp_path, monkeypatch):
+    pytest.importorskip("gradio")
+    monkeypatch.setenv("GEMINI_API_KEY", "dummy")
+    import appv2
+
+    # Gradio must let every analysis through to the gate, or it queues them itself and the gate never sheds
+    analysis = next(fn for fn in appv2.demo.fns.values() if fn.name == "analyze_images")
+    assert analysis.concurrency_limit is None
+
+    async def run():
+        gate = AdmissionGate("analysis", limit=1, max_waiting=0)
+        monkeypatch.setattr(appv2, "analysis_gate", gate)
+        held = gate.admit()
+        outputs = [out async for out in appv2.analyze_images(None, "n", "i", "d", "g", "h", "dr", "t",
+                                                               str(tmp_path / "a.jpg"), None, None, None)]
+        held.close()
+        return outputs
+
+    outputs = asyncio.run(run())
+    assert len(outputs) == 1 and "at capacity" in outputs[0][0]
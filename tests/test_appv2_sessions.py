@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("gradio")
+
+
+class Request:
+    def __init__(self, session_hash):
+        self.session_hash = session_hash
+
+
+PATIENT = ("n", "i", "2000-01-01", "Male", "h", "d", "2024-01-01")
+
+
+def test_concurrent_sessions_keep_their_own_results(tmp_path, monkeypatch):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    monkeypatch.setenv("GEMINI_API_KEY", "dummy")
+    import appv2
+    from hair_analysis.memory import SessionMemoryStore
+    from hair_analysis.ratelimit import RateLimiter
+    from hair_analysis.singleflight import SingleFlight
+
+    # Every call goes to the model separately, so each session's answers come from its own calls
+    model = FakeListChatModel(responses=["findings 1", "findings 2", "advice 1", "advice 2"], sleep=0.01)
+    store = SessionMemoryStore(model, limiter=RateLimiter(rpm=0, tpm=0), flights=SingleFlight(enabled=False))
+    monkeypatch.setattr(appv2.engine, "memory_store", store)
+
+    async def analyze(session):
+        path = str(tmp_path / f"{session}.jpg")
+        Image.new("RGB", (64, 48), (len(session) * 40, 80, 40)).save(path)
+        outputs = [out async for out in appv2.analyze_images(None, *PATIENT, path, None, None, None,
+                                                               request=Request(session))]
+        return outputs[-1]
+
+    async def both():
+        return await asyncio.gather(analyze("a"), analyze("bb"))
+
+    first, second = asyncio.run(both())
+    for (analysis, advice, _, system), session in ((first, "a"), (second, "bb")):
+        # What each session was shown is what its report is built from
+        assert system.session_id == session
+        assert (system.analysis_results, system.advice_results) == (analysis, advice)
+    assert first[3] is not second[3] and first[0] != second[0]
+    assert appv2.preview_report(None, *PATIENT)[1] == "No analysis results to preview"
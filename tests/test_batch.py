@@ -0,0 +1,34 @@
+import os
+
+from PIL import Image
+
+from batch_analysis import report_filename, run_batch
+from hair_analysis.engine import HairAnalysisEngine
+
+
+def patient(tmp_path, patient_id="", name=""):
+    path = str(tmp_path / "photo.jpg")
+    if not os.path.exists(path):
+        Image.new("RGB", (64, 48), (120, 80, 40)).save(path)
+    return {"patient_name": name, "patient_id": patient_id, "dob": "", "gender": "", "hospital_name": "",
+            "doctor_name": "", "analysis_date": "", "images": [path]}
+
+
+def test_duplicate_ids_and_names_get_their_own_reports(tmp_path, monkeypatch):
+    monkeypatch.setenv("HAIR_STUB_LATENCY", "fixed:0")
+    monkeypatch.setenv("HAIR_STUB_CHUNK_RATE", "0")
+    patients = [patient(tmp_path, "P1", "Ann"), patient(tmp_path, "P1", "Bea"),
+                patient(tmp_path, name="John Smith"), patient(tmp_path, name="John_Smith"), patient(tmp_path)]
+    names = [report_filename(p, i) for i, p in enumerate(patients)]
+    assert len(set(names)) == len(patients)
+    assert names[0] == "hair_report_0001_P1.html" and names[4] == "hair_report_0005.html"
+
+    out = str(tmp_path / "out")
+    engine = HairAnalysisEngine(backend="stub")
+    assert run_batch(patients, out, workers=2, engine=engine)["succeeded"] == 5
+    assert "Bea" in open(os.path.join(out, names[1]), encoding="utf-8").read()
+
+    # Only the patient whose report is missing runs again
+    os.remove(os.path.join(out, names[3]))
+    summary = run_batch(patients, out, workers=2, skip_existing=True, engine=engine)
+    assert summary["patients"] == 1 and os.path.exists(os.path.join(out, names[3]))
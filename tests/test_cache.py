@@ -0,0 +1,101 @@
+import os
+
+from hair_analysis.cache import AnalysisCache, PreparedImageCache
+
+
+def write(path, data: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_analysis_cache_survives_a_restart(tmp_path):
+    path = str(tmp_path / "analysis.sqlite3")
+    key = AnalysisCache.key(["a", "b"], "v1", "model")
+    AnalysisCache(path).put(key, "findings")
+    reopened = AnalysisCache(path)
+    assert reopened.get(key) == "findings"
+    assert reopened.get(AnalysisCache.key(["a", "b"], "v2", "model")) is None
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_analysis_cache_trims_by_size(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "analysis.sqlite3"), memory_entries=1, max_bytes=250)
+    for i in range(5):
+        cache.put(f"k{i}", "x" * 100)
+    assert cache.stats()["disk_entries"] == 2
+    assert cache.get("k4") is not None and cache.get("k0") is None
+
+
+def test_prepared_cache_recognises_a_copy_by_content(tmp_path):
+    cache = PreparedImageCache(":memory:")
+    original = write(tmp_path / "a.jpg", b"photo bytes")
+    upload = write(tmp_path / "upload.jpg", b"photo bytes")
+    assert cache.content_key(original) == cache.content_key(upload)
+    assert cache.content_key(original) == cache.content_key(original)
+    stats = cache.stats()
+    assert stats["content_hashes"] == 2 and stats["identity_hits"] == 2
+
+
+def test_prepared_cache_bounds_its_aliases(tmp_path):
+    cache = PreparedImageCache(":memory:", max_aliases=5)
+    for i in range(20):
+        cache.content_key(write(tmp_path / f"{i}.jpg", os.urandom(16)))
+    assert cache.stats()["aliases"] == 5
+    assert cache._db.execute("SELECT COUNT(*) FROM image_aliases").fetchone()[0] == 5
+
+
+def test_prepared_cache_evicts_memory_by_bytes():
+    cache = PreparedImageCache(":memory:", memory_bytes=25)
+    for i in range(4):
+        cache.put(f"k{i}", {"data": "x" * 10})
+    assert cache.stats()["memory_entries"] == 2
+    # Evicted from memory but still on disk
+    assert cache.get("k0") == {"data": "x" * 10}
+
+
+def test_async_analysis_keeps_sqlite_off_the_event_loop(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+
+    from PIL import Image
+
+    from hair_analysis.engine import HairAnalysisEngine
+
+    class RecordingCache(AnalysisCache):
+        threads = []
+
+        def get(self, key):
+            self.threads.append(threading.get_ident())
+            return super().get(key)
+
+        def put(self, key, value):
+            self.threads.append(threading.get_ident())
+            super().put(key, value)
+
+    monkeypatch.setenv("HAIR_STUB_LATENCY", "fixed:0")
+    monkeypatch.setenv("HAIR_STUB_CHUNK_RATE", "0")
+    path = str(tmp_path / "photo.jpg")
+    Image.new("RGB", (64, 48), (120, 80, 40)).save(path)
+    engine = HairAnalysisEngine(analysis_cache=RecordingCache(str(tmp_path / "a.sqlite3")), backend="stub")
+
+    async def run():
+        loop_thread = threading.get_ident()
+        await engine.aanalyze([path], "s1")
+        async for _ in engine.astream_analysis([path], "s2"):
+            pass
+        return loop_thread
+
+    loop_thread = asyncio.run(run())
+    # get + put for the first analysis, a hit for the second
+    assert len(RecordingCache.threads) == 3 and loop_thread not in RecordingCache.threads
+
+
+def test_prepared_payloads_read_the_same_from_both_tiers(tmp_path):
+    path = str(tmp_path / "prepared.sqlite3")
+    payload = {"data": "AAAA", "size": (1024, 768), "format": "JPEG"}
+    cache = PreparedImageCache(path)
+    cache.put("k", payload)
+    assert cache.get("k") == payload
+    # A fresh process reads it back from disk
+    assert PreparedImageCache(path).get("k") == payload
@@ -0,0 +1,93 @@
+import random
+import time
+
+from hair_analysis.markdown import MarkdownRenderer, markdown_to_html
+
+RESPONSE = """## 1. Scalp Assessment
+**Hair type:** 2B waves with *fine* strands & <moderate> porosity.
+
+1. Crown density
+   - Miniaturised follicles
+   - Visible `scalp`
+2. Hairline
+
+| Product | Price |
+|:---|---:|
+| **Shampoo** | $14 |
+
+* Avoid heavy silicones
+---
+Done.
+"""
+
+
+def streamed(text, sizes):
+    renderer = MarkdownRenderer()
+    parts, i = [], 0
+    while i < len(text):
+        size = next(sizes)
+        parts.append(renderer.feed(text[i:i + size]))
+        i += size
+    parts.append(renderer.close())
+    return "\n".join(part for part in parts if part)
+
+
+def test_headings_and_inline_markup():
+    assert markdown_to_html("# Title ##") == "<h1>Title</h1>"
+    assert markdown_to_html("**bold** and *em* and `code` <b>&") == (
+        "<p><strong>bold</strong> and <em>em</em> and <code>code</code> &lt;b&gt;&amp;</p>")
+    assert markdown_to_html("snake_case_name") == "<p>snake_case_name</p>"
+
+
+def test_nested_and_numbered_lists():
+    assert markdown_to_html("- a\n  - b\n- c") == "<ul>\n<li>a\n<ul>\n<li>b\n</li></ul>\n</li>\n<li>c\n</li></ul>"
+    assert markdown_to_html("3. x\n4. y").startswith('<ol start="3">')
+
+
+def test_table_with_alignment():
+    html = markdown_to_html("| A | B |\n|:--|--:|\n| **1** | 2 |")
+    assert '<th style="text-align: right">B</th>' in html
+    assert '<tr><td><strong>1</strong></td><td style="text-align: right">2</td></tr>' in html
+    assert html.endswith("</tbody>\n</table>")
+
+
+def test_a_lone_pipe_row_is_a_paragraph():
+    assert markdown_to_html("| not a table |") == "<p>| not a table |</p>"
+
+
+def test_any_chunking_matches_one_shot():
+    expected = markdown_to_html(RESPONSE)
+    rng = random.Random(0)
+    for _ in range(50):
+        sizes = iter(lambda: rng.randint(1, 12), None)
+        assert streamed(RESPONSE, sizes) == expected
+    assert streamed(RESPONSE.replace("\n", "\r\n"), iter(lambda: 3, None)) == expected
+
+
+def test_partial_output_closes_open_blocks():
+    renderer = MarkdownRenderer()
+    head = renderer.feed("- one\n- tw")
+    tail = renderer.close()
+    assert f"{head}\n{tail}".count("<ul>") == f"{head}\n{tail}".count("</ul>") == 1
+
+
+def test_a_long_line_streams_in_linear_time():
+    def cost(size):
+        text = "word " * (size // 5)
+        start = time.perf_counter()
+        streamed(text, iter(lambda: 64, None))
+        return time.perf_counter() - start
+
+    small, large = cost(50_000), cost(400_000)
+    # Eight times the text; a quadratic tail would cost ~64x
+    assert large < small * 24
+
+
+def test_engine_reuses_html_rendered_while_streaming(monkeypatch):
+    from hair_analysis.engine import HairAnalysisEngine
+    monkeypatch.setenv("HAIR_STUB_LATENCY", "fixed:0")
+    monkeypatch.setenv("HAIR_STUB_CHUNK_RATE", "0")
+    engine = HairAnalysisEngine(backend="stub")
+    text = "".join(engine.stream_ask("Any advice?", "s1"))
+    assert text in engine._streamed_html
+    assert engine.convert_to_html(text) == markdown_to_html(text)
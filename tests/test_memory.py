@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from hair_analysis.backends import build_model
+from hair_analysis.history import trim_to_tokens
+from hair_analysis.memory import SessionMemoryStore
+from hair_analysis.ratelimit import RateLimiter, estimate_tokens
+
+pytest.importorskip("langchain.memory")
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setenv("HAIR_STUB_LATENCY", "fixed:0")
+    monkeypatch.setenv("HAIR_STUB_CHUNK_RATE", "0")
+    return build_model("stub")
+
+
+def store(llm, policy):
+    return SessionMemoryStore(llm, policy=policy, window_turns=2, max_tokens=120,
+                              limiter=RateLimiter(rpm=0, tpm=0))
+
+
+def messages(memory):
+    return memory.chat_memory.messages
+
+
+def test_trim_to_tokens_drops_oldest_first():
+    from langchain_core.messages import AIMessage, HumanMessage
+    history = [HumanMessage(content="a" * 400), AIMessage(content="b" * 40), HumanMessage(content="c" * 40)]
+    pruned = trim_to_tokens(history, 30)
+    assert [m.content[0] for m in pruned] == ["a"]
+    assert [m.content[0] for m in history] == ["b", "c"]
+    assert estimate_tokens(history) <= 30
+
+
+@pytest.mark.parametrize("policy", ["window", "tokens", "summary"])
+def test_policies_bound_history_on_stub(stub, policy):
+    memories = store(stub, policy)
+    for i in range(8):
+        memories.invoke("s", f"Question {i} about wavy hair care " + "detail " * 20)
+    chain = memories.conversation("s")
+    history = memories._history(chain)
+    assert 0 < len(history) < 16
+    if policy == "window":
+        assert len(history) == 4
+    else:
+        assert estimate_tokens(messages(chain.memory)) <= 120
+    memory = chain.memory
+    if policy == "summary":
+        assert memory.moving_summary_buffer
+
+
+@pytest.mark.parametrize("policy", ["tokens", "summary"])
+def test_async_turns_are_trimmed_too(stub, policy):
+    memories = store(stub, policy)
+
+    async def run():
+        for i in range(8):
+            await memories.ainvoke("s", f"Question {i} about curly hair " + "detail " * 20)
+
+    asyncio.run(run())
+    assert estimate_tokens(messages(memories.conversation("s").memory)) <= 120
+
+
+@pytest.mark.parametrize("policy", ["tokens", "summary"])
+def test_gemini_memory_never_asks_the_model_to_count(monkeypatch, policy):
+    genai = pytest.importorskip("langchain_google_genai")
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("token counting went to the model")
+
+    monkeypatch.setattr(genai.ChatGoogleGenerativeAI, "get_num_tokens_from_messages", no_network)
+    monkeypatch.setattr(genai.ChatGoogleGenerativeAI, "get_num_tokens", no_network)
+    memories = store(build_model("gemini"), policy)
+    memory = memories._build_memory()
+    if policy == "summary":
+        # Summaries are real model calls; only the counting is under test here
+        monkeypatch.setattr(type(memory), "predict_new_summary", lambda self, pruned, summary: "summary")
+    for i in range(8):
+        memory.save_context({"input": f"question {i} " * 30}, {"response": "answer " * 30})
+    assert estimate_tokens(messages(memory)) <= 120
+
+
+def test_every_call_settles_the_token_estimate(stub):
+    class Recording(RateLimiter):
+        settled = []
+
+        def settle(self, estimated, actual):
+            self.settled.append(actual)
+            super().settle(estimated, actual)
+
+    limiter = Recording(rpm=0, tpm=1000)
+    memories = SessionMemoryStore(stub, policy="window", limiter=limiter)
+    memories.invoke("s1", "hello")
+    asyncio.run(memories.ainvoke("s1", "again"))
+    list(memories.stream("s1", "more"))
+    assert len(Recording.settled) == 3 and all(Recording.settled)
+    assert len(messages(memories.conversation("s1").memory)) == 6
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from hair_analysis.ratelimit import RateLimiter, TokenBucket, estimate_tokens, is_retryable
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def limiter(**kwargs):
+    return RateLimiter(**{"rpm": 0, "tpm": 0, "max_retries": 3, "base_delay": 0, **kwargs})
+
+
+def test_retryable_errors_are_recognised():
+    assert is_retryable(ResourceExhausted("boom"))
+    assert is_retryable(RuntimeError("429 Too Many Requests"))
+    assert is_retryable(HTTPError(503))
+    assert not is_retryable(HTTPError(400))
+    assert not is_retryable(ValueError("bad prompt"))
+
+
+def test_bucket_charges_the_wait_for_an_empty_bucket():
+    bucket = TokenBucket(per_minute=60, capacity=2)
+    start = bucket.updated
+    assert bucket.reserve(1, start) == 0 and bucket.reserve(1, start) == 0
+    # One per second refill: the third request waits a second, the fourth two
+    assert bucket.reserve(1, start) == pytest.approx(1.0)
+    assert bucket.reserve(1, start) == pytest.approx(2.0)
+    # An oversized request is let through at full capacity rather than never
+    fresh = TokenBucket(per_minute=60, capacity=2)
+    assert fresh.reserve(50, fresh.updated) == 0
+
+
+def test_estimate_counts_text_and_images():
+    assert estimate_tokens("x" * 400) == pytest.approx(100, abs=2)
+    with_image = [{"type": "text", "text": "look"}, {"type": "image_url", "image_url": "data:image/jpeg;base64,AAAA"}]
+    assert estimate_tokens(with_image) > estimate_tokens("look")
+
+
+def test_call_retries_only_retryable_errors():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ResourceExhausted("quota")
+        return "ok"
+
+    rate = limiter()
+    assert rate.call(flaky) == "ok" and len(attempts) == 3
+    assert rate.metrics()["retries"] == 2
+
+    def broken():
+        attempts.append(1)
+        raise ValueError("bad prompt")
+
+    attempts.clear()
+    with pytest.raises(ValueError):
+        rate.call(broken)
+    assert len(attempts) == 1
+
+
+def test_call_gives_up_after_max_retries():
+    rate = limiter(max_retries=2)
+    with pytest.raises(ResourceExhausted):
+        rate.call(lambda: (_ for _ in ()).throw(ResourceExhausted("quota")))
+    metrics = rate.metrics()
+    assert metrics["retries"] == 2 and metrics["failures"] == 1
+
+
+def test_stream_does_not_retry_once_output_started():
+    calls = []
+
+    def stream():
+        calls.append(1)
+        yield "a"
+        raise ResourceExhausted("quota")
+
+    with pytest.raises(ResourceExhausted):
+        list(limiter().stream(stream))
+    assert len(calls) == 1
+
+
+def test_async_call_retries_and_throttles():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ResourceExhausted("quota")
+        return "ok"
+
+    rate = limiter(rpm=600, burst=1)
+
+    async def run():
+        return await rate.acall(flaky), await rate.acall(flaky)
+
+    assert asyncio.run(run()) == ("ok", "ok")
+    metrics = rate.metrics()
+    # Three requests through a one-request bucket refilled every 0.1s: the last two waited
+    assert metrics["requests"] == 3 and metrics["throttled"] == 2
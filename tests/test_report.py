@@ -0,0 +1,40 @@
+import pytest
+
+from hair_analysis import report as reports
+
+PATIENT = ("n", "i", "2000-01-01", "Male", "h", "d", "2024-01-01")
+
+
+def test_report_ids_do_not_repeat():
+    ids = {reports.new_report_id() for _ in range(20000)}
+    assert len(ids) == 20000
+
+
+def test_save_rewrites_only_changed_files(tmp_path):
+    path = str(tmp_path / "r.html")
+    report = reports.RenderedReport("k", "HA1", "<p>same</p>")
+    assert report.save(path) and not report.save(path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<p>stale</p>")
+    assert report.save(path)
+    assert open(path, encoding="utf-8").read() == "<p>same</p>"
+
+
+def test_patients_never_get_each_others_report(tmp_path, monkeypatch):
+    pytest.importorskip("gradio")
+    monkeypatch.setenv("GEMINI_API_KEY", "dummy")
+    import appv2
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(appv2.webbrowser, "open", lambda *args, **kwargs: None)
+    # Every report gets the same ID, as two random IDs on one day could before
+    monkeypatch.setattr(reports, "new_report_id", lambda: "HA1234-20240101")
+    monkeypatch.setattr("hair_analysis.engine.new_report_id", lambda: "HA1234-20240101")
+    paths = {}
+    for name in ("Alice", "Bob"):
+        system = appv2.ProfessionalHairAnalysisSystem(name)
+        system.analysis_results, system.advice_results = f"findings for {name}", "advice"
+        paths[name], _ = system.generate_report(name, *PATIENT[1:])
+    assert paths["Alice"] != paths["Bob"]
+    assert "Bob" in open(paths["Bob"], encoding="utf-8").read()
+    assert "Alice" not in open(paths["Bob"], encoding="utf-8").read()
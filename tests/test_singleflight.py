@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+import pytest
+
+from hair_analysis.singleflight import FlightAbandoned, SingleFlight
+
+
+def test_threaded_followers_replay_and_wait_for_the_leader():
+    group = SingleFlight(enabled=True)
+    flight, leads = group.join("prompt")
+    assert leads
+    flight.publish("a")
+    received, joined = [], threading.Event()
+
+    def follower():
+        shared, follower_leads = group.join("prompt")
+        assert not follower_leads and shared is flight
+        joined.set()
+        received.append("".join(shared.follow()))
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    joined.wait(2)
+    flight.publish("b")
+    flight.finish()
+    thread.join(2)
+    assert received == ["ab"]
+    assert group.stats() == {"leaders": 1, "followers": 1, "abandoned": 0, "failed": 0, "in_flight": 0}
+
+
+def test_same_thread_never_follows_itself():
+    group = SingleFlight(enabled=True)
+    with group.join("prompt")[0]:
+        second, leads = group.join("prompt")
+        assert leads and second.group is None
+
+
+def test_disabled_group_always_leads():
+    group = SingleFlight(enabled=False)
+    first, _ = group.join("prompt", asynchronous=True)
+    assert group.join("prompt", asynchronous=True)[1]
+    assert group.stats()["in_flight"] == 0
+
+
+def test_errors_reach_every_async_follower():
+    group = SingleFlight(enabled=True)
+
+    async def run():
+        flight, _ = group.join("prompt", asynchronous=True)
+
+        async def follow():
+            shared, leads = group.join("prompt", asynchronous=True)
+            assert not leads
+            return [chunk async for chunk in shared.afollow()]
+
+        followers = [asyncio.create_task(follow()) for _ in range(3)]
+        await asyncio.sleep(0)
+        flight.publish("partial")
+        flight.fail(RuntimeError("model down"))
+        return await asyncio.gather(*followers, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert group.stats()["failed"] == 1 and group.stats()["in_flight"] == 0
+
+
+def test_cancelled_leader_abandons_the_flight():
+    group = SingleFlight(enabled=True)
+    flight, _ = group.join("prompt")
+    follower, _ = group.join("prompt", asynchronous=True)
+    with pytest.raises(asyncio.CancelledError):
+        with flight:
+            raise asyncio.CancelledError()
+    with pytest.raises(FlightAbandoned):
+        list(follower.follow())
+    # The next caller leads a fresh flight
+    assert group.join("prompt")[1] and group.stats()["abandoned"] == 1
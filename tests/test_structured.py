@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from hair_analysis.structured import (AnalysisFormatError, HairAnalysis, analysis_context, parse_analysis,
+                                      try_parse_analysis)
+
+REPLY = {"texture": "Wavy", "density": "medium", "diameter": "fine", "porosity": "high",
+         "scalp_findings": ["mild flaking", " "], "damage": ["split ends"], "confidence": 0.8}
+
+
+def test_parses_a_fenced_reply():
+    result = parse_analysis(f"Here you go:\n```json\n{json.dumps(REPLY)}\n```")
+    assert result == HairAnalysis("wavy", "medium", "fine", "high", ("mild flaking",), ("split ends",), 0.8)
+    assert not result.is_unclear
+    assert "texture=wavy" in result.compact() and "## Hair Characteristics" in result.to_markdown()
+    assert parse_analysis(result.to_json()) == result
+
+
+def test_percent_confidence_and_unclear_fields():
+    result = parse_analysis(json.dumps(dict(REPLY, confidence=80, porosity="unclear")))
+    assert result.confidence == pytest.approx(0.8) and result.is_unclear
+    assert parse_analysis(json.dumps(dict(REPLY, confidence=0.3))).is_unclear
+
+
+@pytest.mark.parametrize("reply", [
+    "The hair looks wavy and dry.",
+    "{not json}",
+    "[1, 2]",
+    json.dumps(dict(REPLY, texture="frizzy")),
+    json.dumps(dict(REPLY, damage="split ends")),
+    json.dumps(dict(REPLY, confidence="high")),
+    json.dumps(dict(REPLY, confidence=True)),
+    json.dumps(dict(REPLY, confidence=150)),
+    json.dumps({key: value for key, value in REPLY.items() if key != "density"}),
+])
+def test_invalid_replies_fall_back_to_free_text(reply, monkeypatch):
+    with pytest.raises(AnalysisFormatError):
+        parse_analysis(reply)
+    assert try_parse_analysis(reply) is None
+    monkeypatch.setenv("HAIR_STRUCTURED_ANALYSIS", "1")
+    assert analysis_context(reply) == reply
+
+
+def test_follow_ups_quote_compact_fields_only_when_structured(monkeypatch):
+    reply = json.dumps(REPLY)
+    assert analysis_context(reply) == reply
+    monkeypatch.setenv("HAIR_STRUCTURED_ANALYSIS", "1")
+    assert analysis_context(reply) == parse_analysis(reply).compact()
+
+
+def test_engine_shows_markdown_for_valid_replies_and_text_otherwise(monkeypatch):
+    from hair_analysis.engine import HairAnalysisEngine
+    monkeypatch.setenv("HAIR_STRUCTURED_ANALYSIS", "1")
+    engine = HairAnalysisEngine(backend="stub")
+    shown, parsed = engine.finish_analysis(json.dumps(REPLY))
+    assert parsed is not None and shown == parsed.to_markdown()
+    assert engine.finish_analysis("free text") == ("free text", None)
@@ -0,0 +1,40 @@
+import queue
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("tkinter")
+
+
+def test_cancel_before_the_first_chunk_returns_at_once(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "dummy")
+    import app
+    from hair_analysis.backends import build_model
+    from hair_analysis.memory import SessionMemoryStore
+    from hair_analysis.ratelimit import RateLimiter
+
+    # The first token takes 3s, like a slow vision call
+    monkeypatch.setenv("HAIR_STUB_LATENCY", "fixed:3")
+    monkeypatch.setenv("HAIR_STUB_CHUNK_RATE", "0")
+    monkeypatch.setenv("HAIR_SINGLE_FLIGHT", "0")
+    monkeypatch.setattr(app.engine, "memory_store",
+                        SessionMemoryStore(build_model("stub"), limiter=RateLimiter(rpm=0, tpm=0)))
+    path = str(tmp_path / "photo.jpg")
+    Image.new("RGB", (64, 48), (120, 80, 40)).save(path)
+
+    # The worker only needs the engine, not a Tk window
+    system = app.ProfessionalHairAnalysisSystem.__new__(app.ProfessionalHairAnalysisSystem)
+    cancel, results = threading.Event(), queue.Queue()
+    worker = threading.Thread(target=system.run_analysis, args=([path], "tk", cancel, results))
+    worker.start()
+    time.sleep(0.3)
+    cancelled_at = time.perf_counter()
+    cancel.set()
+    worker.join(timeout=2)
+    assert not worker.is_alive() and time.perf_counter() - cancelled_at < 1
+    messages = []
+    while not results.empty():
+        messages.append(results.get()[0])
+    assert messages[-1] == "cancelled" and "text" not in messages